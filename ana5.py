@@ -2,14 +2,35 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+from plotly.offline import get_plotlyjs
 import numpy as np
 import io
+import os
+import re
+import sys
+import html
+import json
+import time
+import uuid
+import hashlib
+import threading
+import importlib
+import collections
 import traceback
+import unicodedata
+import zipfile
 import folium
+from folium.plugins import FastMarkerCluster
 from streamlit_folium import folium_static
+import streamlit.components.v1 as components
 from statsmodels import api as sm
 from scipy import stats
+from scipy.cluster import hierarchy
 import calendar
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 # Configuración de la página
 def setup_page():
@@ -221,6 +242,49 @@ def apply_custom_styles():
 
 # --- FUNCIONES DE PROCESAMIENTO ---
 
+# Límites de memoria, configurables por variables de entorno
+MAX_ENTRADAS_CACHE = int(os.environ.get('CUENCAS_CACHE_ENTRADAS', 64))
+PRESUPUESTO_SESION_MB = float(os.environ.get('CUENCAS_SESION_MB', 64))
+# Carpeta con el cubo de la red nacional (vacía: solo archivos cargados)
+CARPETA_CUBO = os.environ.get('CUENCAS_CUBO', '')
+
+# Variables que el ANA publica con el mismo formato de hoja: columna de valores,
+# unidad, agregación de los meses en un año y rango físicamente posible. El
+# campo 'Variable' de los metadatos se reconoce por las claves (sin tildes).
+VARIABLES = {
+    'Precipitación': {
+        'columna': 'Precipitación (mm)', 'unidad': 'mm', 'agregacion': 'sum',
+        'rango': (0.0, 1500.0), 'claves': ('precipitacion', 'lluvia')
+    },
+    'Evaporación': {
+        'columna': 'Evaporación (mm)', 'unidad': 'mm', 'agregacion': 'sum',
+        'rango': (0.0, 1000.0), 'claves': ('evaporacion',)
+    },
+    'Temperatura máxima': {
+        'columna': 'Temperatura máxima (°C)', 'unidad': '°C', 'agregacion': 'max',
+        'rango': (-50.0, 50.0), 'claves': ('temperatura maxima',)
+    },
+    'Temperatura mínima': {
+        'columna': 'Temperatura mínima (°C)', 'unidad': '°C', 'agregacion': 'min',
+        'rango': (-50.0, 50.0), 'claves': ('temperatura minima',)
+    },
+    'Temperatura media': {
+        'columna': 'Temperatura media (°C)', 'unidad': '°C', 'agregacion': 'mean',
+        'rango': (-50.0, 50.0), 'claves': ('temperatura',)
+    },
+    'Caudal': {
+        'columna': 'Caudal (m³/s)', 'unidad': 'm³/s', 'agregacion': 'mean',
+        'rango': (0.0, 100000.0), 'claves': ('caudal',)
+    },
+    'Humedad relativa': {
+        'columna': 'Humedad relativa (%)', 'unidad': '%', 'agregacion': 'mean',
+        'rango': (0.0, 100.0), 'claves': ('humedad',)
+    }
+}
+VARIABLE_PREDETERMINADA = 'Precipitación'
+COLUMNAS_VARIABLES = {definicion['columna']: nombre for nombre, definicion in VARIABLES.items()}
+NOMBRES_AGREGACION = {'sum': 'Total', 'mean': 'Promedio', 'max': 'Máximo', 'min': 'Mínimo'}
+
 def Extraer_Metadata(df):
     """Extrae metadatos del formato exacto del Excel"""
     metadata = {}
@@ -276,8 +340,8 @@ def Extraer_Metadata(df):
     
     return metadata
 
-def Extracion_datos_mensuales(df):
-    """Extrae y transforma los datos mensuales de precipitación"""
+def Extracion_datos_mensuales(df, columna='Precipitación (mm)'):
+    """Extrae y transforma los datos mensuales de la hoja en la columna de su variable"""
     inicio_id = None
     for i in range(len(df)):
         if str(df.iloc[i, 0]).strip() == 'Año':
@@ -318,7 +382,7 @@ def Extracion_datos_mensuales(df):
                     'Año': year,
                     'Mes': meses[month_num],
                     'Mes_num': month_num,
-                    'Precipitación (mm)': value,
+                    columna: value,
                     'Fecha': pd.to_datetime(f"{year}-{month_num}-01")
                 })
             except:
@@ -326,13 +390,154 @@ def Extracion_datos_mensuales(df):
     
     return pd.DataFrame(data)
 
-def Calcular_estadisticas_Mensuales(data_df):
-    """Calcula estadísticas mensuales agregadas"""
+def Reducir_memoria(data_df):
+    """Tipos compactos para los datos mensuales: Mes categórico, Año int16, Mes_num int8 y valores float32"""
+    if data_df.empty:
+        return data_df
+
+    meses = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Set', 'Oct', 'Nov', 'Dic']
+    return data_df.astype({
+        'Mes': pd.CategoricalDtype(meses, ordered=True),
+        'Año': 'int16',
+        'Mes_num': 'int8',
+        **{columna: 'float32' for columna in data_df.columns if columna in COLUMNAS_VARIABLES}
+    })
+
+def Cargar_estacion(contenido):
+    """Lee un archivo Excel ANA (bytes) y devuelve sus metadatos y datos mensuales"""
+    df = pd.read_excel(io.BytesIO(contenido), header=None)
+    metadata = Extraer_Metadata(df)
+    columna = VARIABLES[Variable_metadata(metadata)]['columna']
+    data_df = Reducir_memoria(Extracion_datos_mensuales(df, columna))
+    # La hoja cruda (tipo object) ocupa varias veces más que los datos extraídos
+    del df
+    return metadata, data_df
+
+def _Normalizar_texto(texto):
+    """Minúsculas y sin tildes, para reconocer el campo Variable de los metadatos"""
+    texto = unicodedata.normalize('NFKD', str(texto).lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+def Variable_metadata(metadata):
+    """Variable del registro que corresponde al campo 'Variable' de los metadatos (precipitación si no se reconoce)"""
+    texto = _Normalizar_texto(metadata.get('Variable', ''))
+    for nombre, definicion in VARIABLES.items():
+        if any(clave in texto for clave in definicion['claves']):
+            return nombre
+    return VARIABLE_PREDETERMINADA
+
+def Variables_datos(data_df):
+    """Variables del registro presentes como columnas en los datos de una estación"""
+    return [COLUMNAS_VARIABLES[c] for c in data_df.columns if c in COLUMNAS_VARIABLES]
+
+def Variable_datos(data_df):
+    """Variable de los datos (la primera si la estación guarda varias)"""
+    variables = Variables_datos(data_df)
+    return variables[0] if variables else VARIABLE_PREDETERMINADA
+
+def Columna_valor(data_df):
+    """Columna de valores de la variable de los datos"""
+    return VARIABLES[Variable_datos(data_df)]['columna']
+
+def Agregacion_anual(data_df):
+    """Agregación de los meses en un año para la variable de los datos ('sum', 'mean', 'max' o 'min')"""
+    return VARIABLES[Variable_datos(data_df)]['agregacion']
+
+def Agregar_valores(valores, agregacion, axis=-1):
+    """Agrega un arreglo a lo largo de un eje; NaN si falta algún valor (solo períodos completos)"""
+    return getattr(np, agregacion)(valores, axis=axis)
+
+def Unir_variables(data_df, nuevo_df):
+    """Agrega a los datos de una estación las variables de otro archivo: una fila por mes y una columna float32 por variable"""
+    nuevas = [c for c in nuevo_df.columns if c in COLUMNAS_VARIABLES and c not in data_df.columns]
+    if not nuevas:
+        return data_df
+    claves = ['Año', 'Mes', 'Mes_num', 'Fecha']
+    unido = data_df.merge(nuevo_df[claves + nuevas], on=claves, how='outer')
+    return Reducir_memoria(unido.sort_values(['Año', 'Mes_num'], ignore_index=True))
+
+def Seleccionar_variable(data_df, variable):
+    """Datos de una sola variable (sin sus meses vacíos) a partir de los datos de varias variables de una estación"""
+    columna = VARIABLES[variable]['columna']
+    otras = [c for c in data_df.columns if c in COLUMNAS_VARIABLES and c != columna]
+    if not otras:
+        return data_df
+    return data_df.drop(columns=otras).dropna(subset=[columna]).reset_index(drop=True)
+
+def Combinar_estaciones(estaciones):
+    """Une los datos mensuales de varias estaciones (de una misma variable) en un solo DataFrame largo"""
+    frames = [
+        data_df.assign(Estación=nombre)
+        for nombre, (metadata, data_df) in estaciones.items()
+        if not data_df.empty
+    ]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+def Cubo_estaciones(combined_df):
+    """Construye el cubo estaciones × años × 12 meses (NaN en faltantes) a partir del DataFrame combinado"""
+    if combined_df.empty:
+        return [], np.array([], dtype=int), np.empty((0, 0, 12))
+
+    codigos, estaciones = pd.factorize(combined_df['Estación'], sort=False)
+    año_min = int(combined_df['Año'].min())
+    años = np.arange(año_min, int(combined_df['Año'].max()) + 1)
+
+    cubo = np.full((len(estaciones), len(años), 12), np.nan)
+    cubo[
+        codigos,
+        combined_df['Año'].to_numpy() - año_min,
+        combined_df['Mes_num'].to_numpy() - 1
+    ] = combined_df[Columna_valor(combined_df)].to_numpy(dtype=float)
+
+    return list(estaciones), años, cubo
+
+def Cubo_regional(estaciones, cubo_disco=None, seleccion=(), años=None):
+    """Cubo (estaciones, años, cubo) de la cuenca: filas elegidas del cubo en disco y estaciones cargadas
+
+    Las filas del cubo en disco se copian directamente, sin pasar por un
+    DataFrame largo. Se descartan las estaciones sin datos y los años vacíos
+    de los extremos.
+    """
+    partes = [Cubo_estaciones(Combinar_estaciones(estaciones))]
+    if seleccion:
+        partes.insert(0, cubo_disco.seleccionar(seleccion, años))
+    partes = [parte for parte in partes if len(parte[0]) and len(parte[1])]
+    if not partes:
+        return [], np.array([], dtype=int), np.empty((0, 0, 12))
+
+    if len(partes) == 1:
+        nombres, años, cubo = partes[0]
+    else:
+        inicio = min(int(parte[1][0]) for parte in partes)
+        años = np.arange(inicio, max(int(parte[1][-1]) for parte in partes) + 1)
+        nombres = [nombre for parte in partes for nombre in parte[0]]
+        cubo = np.full((len(nombres), len(años), 12), np.nan)
+        fila = 0
+        for nombres_parte, años_parte, cubo_parte in partes:
+            cubo[fila:fila + len(nombres_parte), años_parte[0] - inicio:años_parte[-1] - inicio + 1] = cubo_parte
+            fila += len(nombres_parte)
+
+    con_datos = ~np.isnan(cubo).all(axis=2)
+    estaciones_validas = con_datos.any(axis=1)
+    años_validos = np.flatnonzero(con_datos.any(axis=0))
+    if not len(años_validos):
+        return [], np.array([], dtype=int), np.empty((0, 0, 12))
+    rebanada = slice(años_validos[0], años_validos[-1] + 1)
+    return (
+        [nombre for nombre, valida in zip(nombres, estaciones_validas) if valida],
+        años[rebanada],
+        cubo[estaciones_validas, rebanada]
+    )
+
+def Calcular_estadisticas_Mensuales(data_df, intervalos=False, n_replicas=1000, nivel=0.95, semilla=0):
+    """Calcula estadísticas mensuales agregadas; con intervalos=True agrega los IC bootstrap"""
     if data_df.empty:
         return pd.DataFrame()
     
     monthly_stats = data_df.groupby('Mes_num').agg({
-        'Precipitación (mm)': ['mean', 'median', 'std', 'min', 'max', 'count']
+        Columna_valor(data_df): ['mean', 'median', 'std', 'min', 'max', 'count']
     }).reset_index()
     
     monthly_stats.columns = [
@@ -347,19 +552,66 @@ def Calcular_estadisticas_Mensuales(data_df):
     }
     monthly_stats['Mes'] = monthly_stats['Mes_num'].map(month_map)
     
+    if intervalos:
+        ic = Intervalos_mensuales(data_df, n_replicas, nivel, semilla)
+        monthly_stats = monthly_stats.join(ic, on='Mes_num')
+    
     return monthly_stats
 
+def Calcular_tendencia_anual(data_df):
+    """Regresión lineal de los agregados anuales (totales en precipitación): pendiente, intercepto, r, p y error estándar"""
+    if data_df.empty:
+        return None
+    
+    annual_data = data_df.groupby('Año')[Columna_valor(data_df)].agg(Agregacion_anual(data_df)).dropna()
+    if len(annual_data) < 2:
+        return None
+    
+    x = annual_data.index.to_numpy(dtype=float)
+    y = annual_data.to_numpy(dtype=float)
+    slope, intercept, r_value, p_value, std_err = stats.linregress(x, y)
+    
+    return {
+        'pendiente': slope,
+        'intercepto': intercept,
+        'r': r_value,
+        'r2': r_value ** 2,
+        'p': p_value,
+        'error_pendiente': std_err,
+        'n': len(x),
+        'x': x,
+        'y': y
+    }
+
+def Filtrar_datos(data_df, year_range, selected_months, min_months=0, exclude_flagged=False):
+    """Aplica los filtros de la barra lateral: rango de años, meses, mínimo de meses por año y valores marcados"""
+    months_per_year = data_df.groupby('Año')['Mes_num'].transform('nunique')
+    filtered_df = data_df[
+        (data_df['Año'] >= year_range[0]) & 
+        (data_df['Año'] <= year_range[1]) &
+        (data_df['Mes'].isin(selected_months)) &
+        (months_per_year >= min_months)
+    ]
+    
+    if exclude_flagged:
+        flags = Marcar_calidad(filtered_df)
+        filtered_df = filtered_df[~(flags['Negativo'] | flags['Implausible'])]
+    
+    return filtered_df
+
 def Calcular_estadisticas_anuales(data_df):
     """Calcula estadísticas anuales agregadas"""
     if data_df.empty:
         return pd.DataFrame()
     
+    agregacion = Agregacion_anual(data_df)
     annual_stats = data_df.groupby('Año').agg({
-        'Precipitación (mm)': ['sum', 'mean', 'median', 'std', 'min', 'max', 'count']
+        Columna_valor(data_df): [agregacion, 'mean', 'median', 'std', 'min', 'max', 'count']
     }).reset_index()
     
+    # La primera columna es el agregado anual de la variable: 'Total Anual' en precipitación
     annual_stats.columns = [
-        'Año', 'Total Anual', 'Promedio Mensual', 'Mediana Mensual', 
+        'Año', f'{NOMBRES_AGREGACION[agregacion]} Anual', 'Promedio Mensual', 'Mediana Mensual', 
         'Variabilidad', 'Mínimo Mensual', 'Máximo Mensual', 'Meses con Datos'
     ]
     
@@ -374,320 +626,3507 @@ def Detectar_patrones_estacionales(data_df):
         df_season = data_df.pivot_table(
             index='Año', 
             columns='Mes_num', 
-            values='Precipitación (mm)', 
+            values=Columna_valor(data_df), 
             aggfunc='mean'
         )
         
-        df_normalized = df_season.apply(
-            lambda x: (x - x.mean()) / x.std(), 
-            axis=1
-        )
+        # Normalización por año con difusión: (años × meses) contra (años × 1)
+        values = df_season.to_numpy(dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            normalized = (
+                (values - np.nanmean(values, axis=1, keepdims=True)) /
+                np.nanstd(values, axis=1, ddof=1, keepdims=True)
+            )
+        
+        months = df_season.columns.to_numpy()
+        avg_by_month = np.nanmean(normalized, axis=0)
+        threshold = 0.5
         
         seasonality = {
-            'meses_lluviosos': [],
-            'meses_secos': [],
+            'meses_lluviosos': months[avg_by_month > threshold].tolist(),
+            'meses_secos': months[avg_by_month < -threshold].tolist(),
             'consistencia': None
         }
         
-        avg_by_month = df_normalized.mean()
-        threshold = 0.5
-        
-        for month in avg_by_month.index:
-            if avg_by_month[month] > threshold:
-                seasonality['meses_lluviosos'].append(month)
-            elif avg_by_month[month] < -threshold:
-                seasonality['meses_secos'].append(month)
-        
-        consistency = (df_normalized > 0).mean().mean()
+        consistency = (normalized > 0).mean()
         seasonality['consistencia'] = max(0, min(1, 2 * abs(consistency - 0.5)))
         
         return seasonality
     except:
         return None
 
-# --- FUNCIONES DE GRÁFICOS ---
-def Crear_figura(message):
-    """Crea una figura vacía con un mensaje"""
-    fig = go.Figure()
-    fig.add_annotation(
-        text=message,
-        xref="paper", yref="paper",
-        x=0.5, y=0.5, showarrow=False
-    )
-    fig.update_layout(
-        plot_bgcolor='white',
-        paper_bgcolor='grey'
+def Matriz_anual_mensual(data_df):
+    """Construye la matriz año × mes (12 columnas, años continuos) con NaN en los faltantes"""
+    if data_df.empty:
+        return pd.DataFrame(columns=range(1, 13), dtype=float)
+
+    matriz = data_df.pivot_table(
+        index='Año',
+        columns='Mes_num',
+        values=Columna_valor(data_df),
+        aggfunc='mean'
     )
-    return fig
 
-def Grafica_distribucion_mensual(data_df, metadata):
-    """Gráfico de distribución mensual"""
-    if data_df.empty:
-        return Crear_figura("No hay datos disponibles")
-    
-    try:
-        df_agg = data_df.groupby(['Mes_num', 'Mes'])['Precipitación (mm)'].agg(
-            ['mean', 'median', 'std', 'min', 'max']
-        ).reset_index()
-        
-        fig = go.Figure()
-        
-        fig.add_trace(go.Box(
-            x=data_df['Mes'],
-            y=data_df['Precipitación (mm)'],
-            name='Distribución',
-            boxpoints=False,
-            marker_color='#4a7cb1',
-            line_color='#1e3d6b',
-            fillcolor='rgba(74, 124, 177, 0.3)'
-        ))
-        
-        fig.add_trace(go.Scatter(
-            x=df_agg['Mes'],
-            y=df_agg['mean'],
-            mode='lines+markers',
-            name='Promedio',
-            line=dict(color='#ff8c00', width=3),
-            marker=dict(size=8),
-            hovertemplate="<b>%{x}</b><br>Promedio: %{y:.1f} mm<extra></extra>"
-        ))
-        
-        fig.add_trace(go.Scatter(
-            x=df_agg['Mes'],
-            y=df_agg['median'],
-            mode='lines',
-            name='Mediana',
-            line=dict(color='#2ca02c', width=2, dash='dash'),
-            hovertemplate="<b>%{x}</b><br>Mediana: %{y:.1f} mm<extra></extra>"
-        ))
-        
-        fig.update_layout(
-            title=dict(
-                text=f'Distribución Mensual de Precipitación<br><sup>{metadata.get("Estación", "")}</sup>',
-                x=0.5,
-                xanchor='center',
-                font=dict(size=18, color='#1e3d6b')
-            ),
-            xaxis_title='Mes',
-            yaxis_title='Precipitación (mm)',
-            hovermode='x unified',
-            plot_bgcolor='white',
-            paper_bgcolor='grey',
-            font=dict(
-                family="Arial",
-                size=12,
-                color="#333333"
-            ),
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1,
-                font=dict(
-                    color="#333333",
-                    size=12
-                )
-            ),
-            margin=dict(l=50, r=50, t=100, b=50)
-        )
-        
-        return fig
-    
-    except Exception as e:
-        st.error(f"Error al generar gráfico de distribución: {str(e)}")
-        return Crear_figura("Error al generar gráfico")
+    años = range(int(matriz.index.min()), int(matriz.index.max()) + 1)
+    return matriz.reindex(index=años, columns=range(1, 13))
 
-def Grafico_tendencia_anual(data_df, metadata):
-    """Gráfico de tendencia anual"""
-    if data_df.empty:
-        return Crear_figura("No hay datos disponibles")
-    
-    try:
-        annual_data = data_df.groupby('Año')['Precipitación (mm)'].sum().reset_index()
-        
-        x = annual_data['Año']
-        y = annual_data['Precipitación (mm)']
-        
-        mask = ~y.isna()
-        x = x[mask]
-        y = y[mask]
-        
-        if len(x) < 2:
-            return Crear_figura("Datos insuficientes para análisis de tendencia")
-        
-        coeffs = np.polyfit(x, y, 1)
-        trend_line = np.poly1d(coeffs)(x)
-        
-        lowess = sm.nonparametric.lowess(y, x, frac=0.3) if len(x) > 5 else None
-        
-        slope, intercept, r_value, p_value, std_err = stats.linregress(x, y)
-        y_err = std_err * np.sqrt(1/len(x) + (x - np.mean(x))**2 / np.sum((x - np.mean(x))**2))
-        
-        fig = go.Figure()
-        
-        fig.add_trace(go.Scatter(
-            x=np.concatenate([x, x[::-1]]),
-            y=np.concatenate([trend_line + 1.96*y_err, (trend_line - 1.96*y_err)[::-1]]),
-            fill='toself',
-            fillcolor='rgba(30, 61, 107, 0.2)',
-            line_color='rgba(255,255,255,0)',
-            name='Intervalo 95% confianza'
-        ))
-        
-        fig.add_trace(go.Scatter(
-            x=x,
-            y=y,
-            mode='markers',
-            marker=dict(size=10, color='#4a7cb1', line=dict(width=1, color='#1e3d6b')),
-            name='Precipitación anual',
-            hovertemplate="<b>Año %{x}</b><br>Precipitación: %{y:.1f} mm<extra></extra>"
-        ))
-        
-        fig.add_trace(go.Scatter(
-            x=x,
-            y=trend_line,
-            mode='lines',
-            line=dict(color='#ff8c00', width=3, dash='dash'),
-            name=f'Tendencia (R²={r_value**2:.2f})',
-            hovertemplate="<b>Año %{x}</b><br>Tendencia: %{y:.1f} mm<extra></extra>"
-        ))
-        
-        if lowess is not None:
-            fig.add_trace(go.Scatter(
-                x=lowess[:, 0],
-                y=lowess[:, 1],
-                mode='lines',
-                line=dict(color='#1e3d6b', width=3),
-                name='Tendencia suavizada',
-                hovertemplate="<b>Año %{x:.0f}</b><br>Tendencia suavizada: %{y:.1f} mm<extra></extra>"
-            ))
-        
-        fig.update_layout(
-            title=dict(
-                text=f'Tendencia Anual de Precipitación<br><sup>{metadata.get("Estación", "")}</sup>',
-                x=0.5,
-                xanchor='center',
-                font=dict(size=18, color='#1e3d6b')
-            ),
-            xaxis_title='Año',
-            yaxis_title='Precipitación total anual (mm)',
-            hovermode='x unified',
-            plot_bgcolor='white',
-            paper_bgcolor='grey',
-            font=dict(
-                family="Arial",
-                size=12,
-                color="#333333"
-            ),
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1,
-                font=dict(
-                    color="#333333",
-                    size=12
-                )
-            ),
-            margin=dict(l=50, r=50, t=100, b=50)
-        )
-        
-        return fig
-    
-    except Exception as e:
-        st.error(f"Error al generar gráfico de tendencia: {str(e)}")
-        return Crear_figura("Error al generar gráfico")
+# Percentiles de la envolvente climatológica (0 y 100 son el mínimo y el máximo)
+PERCENTILES_ENVOLVENTE = (0, 10, 25, 50, 75, 90, 100)
 
-def Mapa_calor_mensual(data_df, metadata):
-    """Heatmap de precipitación mensual por año"""
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Envolvente_climatologica(data_df):
+    """Percentiles mensuales (P0–P100), promedio y años con dato de la matriz año × mes
+
+    Todos los percentiles salen de una sola llamada a nanpercentile; se cachea
+    por cada combinación de filtros y no depende de los años que se comparen.
+    """
+    matriz = Matriz_anual_mensual(data_df)
+    con_dato = ~matriz.isna().all(axis=0)
+    if not con_dato.any():
+        return pd.DataFrame()
+
+    valores = matriz.loc[:, con_dato].to_numpy(dtype=float)
+    percentiles = np.nanpercentile(valores, PERCENTILES_ENVOLVENTE, axis=0)
+
+    envolvente = pd.DataFrame(percentiles.T, columns=[f'P{p}' for p in PERCENTILES_ENVOLVENTE])
+    envolvente.insert(0, 'Mes_num', matriz.columns[con_dato].to_numpy())
+    meses = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Set', 'Oct', 'Nov', 'Dic']
+    envolvente.insert(1, 'Mes', [meses[m - 1] for m in envolvente['Mes_num']])
+    envolvente['Promedio'] = np.nanmean(valores, axis=0)
+    envolvente['Años'] = (~np.isnan(valores)).sum(axis=0)
+    return envolvente
+
+# --- INTERVALOS DE CONFIANZA (BOOTSTRAP) ---
+
+def Intervalos_bootstrap(X, n_replicas=1000, nivel=0.95, semilla=0, max_elementos=4_000_000):
+    """Intervalos percentil bootstrap del promedio, la mediana y la desviación de cada columna de X
+
+    Cada columna se remuestrea con reemplazo entre sus valores válidos. Las
+    réplicas se generan por bloques como matrices de índices (take_along_axis),
+    con a lo sumo max_elementos valores por bloque; la semilla fija hace que
+    los intervalos sean reproducibles. Columnas con menos de 2 datos quedan en NaN.
+    """
+    X = np.asarray(X, dtype=float)
+    if X.ndim == 1:
+        X = X[:, None]
+    columnas = ['Promedio IC inf', 'Promedio IC sup', 'Mediana IC inf', 'Mediana IC sup', 'Desviación IC inf', 'Desviación IC sup']
+    resultado = np.full((X.shape[1], 6), np.nan)
+
+    usar = (~np.isnan(X)).sum(axis=0) >= 2
+    if usar.any() and n_replicas > 0:
+        Xc, n, _ = _Compactar_columnas(X[:, usar])
+        n_max = int(n.max())
+        Xc = Xc[None, :n_max]
+        fuera = np.arange(n_max)[None, :, None] >= n[None, None, :]
+        por_bloque = max(1, max_elementos // Xc.size)
+        rng = np.random.default_rng(semilla)
+
+        replicas = []
+        for inicio in range(0, n_replicas, por_bloque):
+            b = min(por_bloque, n_replicas - inicio)
+            # Índice j de cada réplica: entero uniforme en [0, n) de su columna; las posiciones >= n se anulan
+            indices = (rng.random((b, n_max, Xc.shape[2])) * n).astype(np.intp)
+            muestra = np.where(fuera, np.nan, np.take_along_axis(Xc, indices, axis=1))
+            replicas.append(np.stack([
+                np.nanmean(muestra, axis=1),
+                np.nanmedian(muestra, axis=1),
+                np.nanstd(muestra, axis=1, ddof=1)
+            ]))
+
+        alfa = (1 - nivel) / 2
+        limites = np.percentile(np.concatenate(replicas, axis=1), [100 * alfa, 100 * (1 - alfa)], axis=1)
+        # limites: (inf/sup, estadístico, columna) -> columnas intercaladas inf, sup por estadístico
+        resultado[usar] = limites.transpose(2, 1, 0).reshape(-1, 6)
+
+    return pd.DataFrame(resultado, columns=columnas)
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Intervalos_mensuales(data_df, n_replicas=1000, nivel=0.95, semilla=0):
+    """Intervalos bootstrap de cada mes con dato, remuestreando los años; indexados por Mes_num"""
+    matriz = Matriz_anual_mensual(data_df)
+    matriz = matriz.loc[:, ~matriz.isna().all(axis=0)]
+    intervalos = Intervalos_bootstrap(matriz.to_numpy(), n_replicas, nivel, semilla)
+    intervalos.index = pd.Index(matriz.columns, name='Mes_num')
+    return intervalos
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Intervalos_totales_anuales(data_df, n_replicas=1000, nivel=0.95, semilla=0):
+    """Promedio, mediana y desviación de los agregados anuales con sus intervalos bootstrap
+
+    Solo se usan los años con el número máximo de meses del período, para no
+    mezclar totales completos con años parciales.
+    """
+    annual_stats = Calcular_estadisticas_anuales(data_df)
+    if annual_stats.empty:
+        return pd.DataFrame()
+
+    completos = annual_stats['Meses con Datos'] == annual_stats['Meses con Datos'].max()
+    totales = annual_stats.loc[completos, annual_stats.columns[1]].to_numpy(dtype=float)
+    ic = Intervalos_bootstrap(totales, n_replicas, nivel, semilla).iloc[0].to_numpy()
+    return pd.DataFrame({
+        'Estadístico': ['Promedio', 'Mediana', 'Desviación'],
+        'Valor': [totales.mean(), np.median(totales), totales.std(ddof=1) if len(totales) > 1 else np.nan],
+        'IC inf': ic[0::2],
+        'IC sup': ic[1::2],
+        'Años completos': len(totales)
+    })
+
+# --- PERÍODOS DE AGREGACIÓN ---
+
+# Meses de cada período y mes de inicio; los períodos que cruzan el fin de año
+# se rotulan con el año en que terminan (p. ej. Set 2000 - Ago 2001 -> 2001)
+DEFINICIONES_PERIODO = {
+    'Año calendario (Ene–Dic)': {'meses': tuple(range(1, 13)), 'inicio': 1},
+    'Año hidrológico (Set–Ago)': {'meses': (9, 10, 11, 12, 1, 2, 3, 4, 5, 6, 7, 8), 'inicio': 9},
+    'DEF (Dic–Feb)': {'meses': (12, 1, 2), 'inicio': 12},
+    'MAM (Mar–May)': {'meses': (3, 4, 5), 'inicio': 3},
+    'JJA (Jun–Ago)': {'meses': (6, 7, 8), 'inicio': 6},
+    'SON (Set–Nov)': {'meses': (9, 10, 11), 'inicio': 9},
+    'Época húmeda (Oct–Abr)': {'meses': (10, 11, 12, 1, 2, 3, 4), 'inicio': 10},
+    'Época seca (May–Set)': {'meses': (5, 6, 7, 8, 9), 'inicio': 5}
+}
+
+def _Compilar_periodo(periodo):
+    """Convierte una definición de período en máscara de meses incluidos y desfase de año por mes"""
+    definicion = DEFINICIONES_PERIODO[periodo]
+    meses = np.array(definicion['meses'])
+    inicio = definicion['inicio']
+
+    incluido = np.zeros(12, dtype=bool)
+    incluido[meses - 1] = True
+
+    desfase = np.zeros(12, dtype=int)
+    if (meses < inicio).any():
+        desfase[np.arange(12) + 1 >= inicio] = 1
+
+    return incluido, desfase
+
+def Aplicar_periodo(data_df, periodo):
+    """Reasigna cada registro mensual al año de su período y descarta los meses fuera de él"""
+    if data_df.empty or periodo == 'Año calendario (Ene–Dic)':
+        return data_df
+
+    incluido, desfase = _Compilar_periodo(periodo)
+    mes = data_df['Mes_num'].to_numpy() - 1
+    seleccion = incluido[mes]
+
+    resultado = data_df[seleccion].copy()
+    resultado['Año'] = resultado['Año'].to_numpy() + desfase[mes[seleccion]]
+    return resultado
+
+def Agregar_periodo(matriz, periodo, agregacion='sum'):
+    """Agregado (total en precipitación) y meses con dato por año de período a partir de la matriz año × mes"""
+    if matriz.empty:
+        return pd.DataFrame(columns=['Año', 'Total', 'Meses con datos', 'Completo'])
+
+    incluido, desfase = _Compilar_periodo(periodo)
+    valores = matriz.to_numpy(dtype=float)
+    año_base = int(matriz.index[0])
+
+    # Índice de año de período de cada celda: fila + desfase del mes
+    fila = np.arange(len(matriz))[:, None] + desfase[None, :]
+    usar = incluido[None, :] & ~np.isnan(valores)
+    n_periodos = len(matriz) + 1
+
+    meses = np.bincount(fila[usar], minlength=n_periodos)
+    if agregacion in ('max', 'min'):
+        total = np.full(n_periodos, np.nan)
+        getattr(np, 'f' + agregacion).at(total, fila[usar], valores[usar])
+    else:
+        total = np.bincount(fila[usar], weights=valores[usar], minlength=n_periodos)
+        if agregacion == 'mean':
+            total = total / np.maximum(meses, 1)
+
+    resultado = pd.DataFrame({
+        'Año': np.arange(año_base, año_base + n_periodos),
+        'Total': total,
+        'Meses con datos': meses,
+        'Completo': meses == incluido.sum()
+    })
+    return resultado[resultado['Meses con datos'] > 0].reset_index(drop=True)
+
+def Calcular_estadisticas_estacionales(data_df):
+    """Estadísticas de los agregados de cada estación del año y época, con períodos completos"""
     if data_df.empty:
-        return None
-    
-    try:
+        return pd.DataFrame()
+
+    matriz = Matriz_anual_mensual(data_df)
+    agregacion = Agregacion_anual(data_df)
+    filas = []
+    for periodo in DEFINICIONES_PERIODO:
+        if periodo.startswith('Año'):
+            continue
+        agregado = Agregar_periodo(matriz, periodo, agregacion)
+        totales = agregado.loc[agregado['Completo'], 'Total']
+        filas.append({
+            'Período': periodo,
+            'Promedio': totales.mean(),
+            'Mediana': totales.median(),
+            'Desviación': totales.std(),
+            'Mínimo': totales.min(),
+            'Máximo': totales.max(),
+            'Períodos completos': len(totales)
+        })
+
+    return pd.DataFrame(filas)
+
+# --- PIRÁMIDE DE AGREGADOS ---
+
+# Resoluciones temporales y niveles espaciales precalculados al cargar las estaciones
+RESOLUCIONES = ('Mensual', 'Estacional', 'Anual', 'Decadal')
+NIVELES_ESPACIALES = ('Estación', 'Cuenca', 'Departamento')
+ESTACIONES_AÑO = ('DEF (Dic–Feb)', 'MAM (Mar–May)', 'JJA (Jun–Ago)', 'SON (Set–Nov)')
+
+def _Totales_estacionales(cubo, agregacion='sum'):
+    """Agregados (n × años × 4) de DEF, MAM, JJA y SON; NaN si falta algún mes de la estación
+
+    DEF se rotula con el año en que termina, igual que en Aplicar_periodo.
+    """
+    vacio = np.full((cubo.shape[0], 1, 12), np.nan)
+    previo = np.concatenate([vacio, cubo[:, :-1]], axis=1)
+    totales = []
+    for periodo in ESTACIONES_AÑO:
+        incluido, desfase = _Compilar_periodo(periodo)
+        fuente = np.where(desfase[None, None, :] == 1, previo, cubo)
+        totales.append(Agregar_valores(fuente[:, :, incluido], agregacion, axis=2))
+    return np.stack(totales, axis=2)
+
+def _Medias_decadales(años, anual, minimo_años=5):
+    """Promedio de los totales anuales completos de cada década (n × décadas)"""
+    decadas = np.unique(años // 10 * 10)
+    pertenencia = (años // 10 * 10)[:, None] == decadas[None, :]
+    valido = ~np.isnan(anual)
+    suma = np.where(valido, anual, 0.0) @ pertenencia
+    conteo = valido.astype(float) @ pertenencia
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = np.where(conteo >= minimo_años, suma / conteo, np.nan)
+    return decadas, media
+
+def Construir_piramide(nombres, años, cubo, agregacion='sum'):
+    """Pirámide de agregados a partir del cubo n × años × 12
+
+    Cada resolución es un arreglo cuyo primer eje son las series (estaciones o
+    regiones): Mensual (años × 12), Estacional (años × 4), Anual (años) y
+    Decadal (décadas). Los agregados solo usan períodos completos.
+    """
+    anual = Totales_anuales_cubo(cubo, agregacion)
+    decadas, decadal = _Medias_decadales(años, anual)
+    return {
+        'Agregación': agregacion,
+        'Series': list(nombres),
+        'Años': años,
+        'Décadas': decadas,
+        'Mensual': cubo,
+        'Estacional': _Totales_estacionales(cubo, agregacion),
+        'Anual': anual,
+        'Decadal': decadal,
+        'Estaciones': (~np.isnan(anual)).astype(int)
+    }
+
+def Piramide_estacion(data_df):
+    """Pirámide de una estación; se calcula una sola vez al cargar el archivo y se guarda en la caché"""
+    matriz = Matriz_anual_mensual(data_df)
+    if matriz.empty:
+        return None
+    return Construir_piramide([None], matriz.index.to_numpy(), matriz.to_numpy(dtype=float)[None], Agregacion_anual(data_df))
+
+def Unir_piramides(nombres, piramides):
+    """Alinea las pirámides de varias estaciones en un eje de años común"""
+    if not piramides:
+        return None
+
+    año_min = min(int(p['Años'][0]) for p in piramides)
+    años = np.arange(año_min, max(int(p['Años'][-1]) for p in piramides) + 1)
+    cubo = np.full((len(piramides), len(años), 12), np.nan)
+    for i, p in enumerate(piramides):
+        inicio = int(p['Años'][0]) - año_min
+        cubo[i, inicio:inicio + len(p['Años'])] = p['Mensual'][0]
+
+    return Construir_piramide(nombres, años, cubo, piramides[0]['Agregación'])
+
+def Agregar_piramide(piramide, grupos):
+    """Pirámide regional: promedio de las estaciones de cada grupo en cada resolución
+
+    Cada celda promedia solo las estaciones con dato en ella; 'Estaciones' guarda
+    cuántas estaciones aportan al total anual de cada región y año.
+    """
+    codigos, nombres = pd.factorize(pd.Series(grupos, dtype=object).fillna('Sin dato'), sort=True)
+    pertenencia = (codigos[None, :] == np.arange(len(nombres))[:, None]).astype(float)
+
+    def promedio(valores):
+        valido = ~np.isnan(valores)
+        suma = np.tensordot(pertenencia, np.where(valido, valores, 0.0), axes=1)
+        conteo = np.tensordot(pertenencia, valido.astype(float), axes=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(conteo > 0, suma / conteo, np.nan), conteo.astype(int)
+
+    regional = {
+        'Agregación': piramide['Agregación'],
+        'Series': list(nombres),
+        'Años': piramide['Años'],
+        'Décadas': piramide['Décadas']
+    }
+    for resolucion in RESOLUCIONES:
+        regional[resolucion], conteo = promedio(piramide[resolucion])
+        if resolucion == 'Anual':
+            regional['Estaciones'] = conteo
+    return regional
+
+def Piramides_regionales(metadatas, piramides):
+    """Pirámides por estación, cuenca y departamento a partir de las pirámides y metadatos de cada estación"""
+    nombres = [nombre for nombre in metadatas if piramides.get(nombre) is not None]
+    por_estacion = Unir_piramides(nombres, [piramides[nombre] for nombre in nombres])
+    if por_estacion is None:
+        return {}
+    metadatas = [metadatas[nombre] for nombre in nombres]
+
+    def departamento(meta):
+        ambito = meta.get('Ámbito Político')
+        return ambito.get('Departamento') if isinstance(ambito, dict) else None
+
+    return {
+        'Estación': por_estacion,
+        'Cuenca': Agregar_piramide(por_estacion, [meta.get('Cuenca') or None for meta in metadatas]),
+        'Departamento': Agregar_piramide(por_estacion, [departamento(meta) for meta in metadatas])
+    }
+
+def Tabla_piramide(piramide, resolucion):
+    """Tabla ancha (Período, Fecha y una columna por serie) de una resolución de la pirámide"""
+    años, decadas = piramide['Años'], piramide['Décadas']
+
+    if resolucion == 'Mensual':
+        fechas = pd.to_datetime({'year': np.repeat(años, 12), 'month': np.tile(np.arange(1, 13), len(años)), 'day': 1})
+        periodos = fechas.dt.strftime('%Y-%m')
+    elif resolucion == 'Estacional':
+        # Mes central de cada estación (DEF -> enero del año que la rotula)
+        fechas = pd.to_datetime({'year': np.repeat(años, 4), 'month': np.tile([1, 4, 7, 10], len(años)), 'day': 1})
+        periodos = pd.Series(np.repeat(años, 4).astype(str)) + ' ' + np.tile([e[:3] for e in ESTACIONES_AÑO], len(años))
+    elif resolucion == 'Anual':
+        fechas = pd.to_datetime({'year': años, 'month': 7, 'day': 1})
+        periodos = pd.Series(años.astype(str))
+    else:
+        fechas = pd.to_datetime({'year': decadas + 5, 'month': 1, 'day': 1})
+        periodos = pd.Series([f"{d}s" for d in decadas])
+
+    valores = piramide[resolucion].reshape(len(piramide['Series']), -1)
+    tabla = pd.DataFrame(valores.T, columns=piramide['Series'])
+    tabla.insert(0, 'Período', periodos.to_numpy())
+    tabla.insert(1, 'Fecha', fechas.to_numpy())
+    return tabla.dropna(subset=piramide['Series'], how='all').reset_index(drop=True)
+
+# --- ACUMULADOS MÓVILES Y NORMALES ---
+
+NORMALES_OMM = {
+    '1961–1990': (1961, 1990),
+    '1991–2020': (1991, 2020)
+}
+
+def _Sumas_moviles(valores, ventanas):
+    """Sumas móviles de todas las ventanas con una sola suma acumulada (NaN si falta algún dato)"""
+    valores = np.asarray(valores, dtype=float)
+    ventanas = np.asarray(ventanas, dtype=int)
+    validos = ~np.isnan(valores)
+
+    suma = np.concatenate([[0.0], np.cumsum(np.where(validos, valores, 0.0))])
+    cuenta = np.concatenate([[0], np.cumsum(validos)])
+
+    fin = np.arange(1, len(valores) + 1)
+    inicio = fin[None, :] - ventanas[:, None]
+    completo = inicio >= 0
+    inicio = np.maximum(inicio, 0)
+
+    sumas = suma[fin][None, :] - suma[inicio]
+    completo &= (cuenta[fin][None, :] - cuenta[inicio]) == ventanas[:, None]
+    return np.where(completo, sumas, np.nan)
+
+def Acumulados_moviles(data_df, ventanas=(3, 6, 12)):
+    """Totales móviles de varios meses sobre la serie mensual continua de la estación"""
+    if data_df.empty:
+        return pd.DataFrame()
+
+    matriz = Matriz_anual_mensual(data_df)
+    valores = matriz.to_numpy(dtype=float).ravel()
+    sumas = _Sumas_moviles(valores, ventanas)
+
+    moviles = pd.DataFrame({
+        'Fecha': pd.date_range(f"{matriz.index[0]}-01-01", periods=len(valores), freq='MS'),
+        Columna_valor(data_df): valores
+    })
+    for i, ventana in enumerate(ventanas):
+        moviles[f'Acumulado {ventana} meses'] = sumas[i]
+
+    return moviles
+
+def Media_movil_anual(annual_data, ventana=5):
+    """Media móvil de los agregados anuales, con la ventana terminando en cada año (años continuos)"""
+    serie = annual_data.set_index('Año')[Columna_valor(annual_data)]
+    serie = serie.reindex(range(int(serie.index.min()), int(serie.index.max()) + 1))
+    media = _Sumas_moviles(serie.to_numpy(), [ventana])[0] / ventana
+    return pd.Series(media, index=serie.index)
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Normal_climatologica(data_df, inicio, fin, periodo='Año calendario (Ene–Dic)', fraccion_minima=0.8):
+    """Normal climatológica mensual y del total del período para una ventana de referencia"""
+    matriz = Matriz_anual_mensual(data_df)
+    base = matriz[(matriz.index >= inicio) & (matriz.index <= fin)]
+
+    agregado = Agregar_periodo(matriz, periodo, Agregacion_anual(data_df))
+    totales = agregado.loc[
+        agregado['Completo'] & (agregado['Año'] >= inicio) & (agregado['Año'] <= fin),
+        'Total'
+    ]
+
+    return {
+        'inicio': inicio,
+        'fin': fin,
+        'mensual': base.mean(),
+        'desviacion_mensual': base.std(),
+        'años_mensual': base.count(),
+        'total': totales.mean(),
+        'desviacion': totales.std(),
+        'años': len(totales),
+        # Criterio OMM simplificado: al menos 80% de los años de la ventana
+        'valida': len(totales) >= fraccion_minima * (fin - inicio + 1)
+    }
+
+def Anomalias_estandarizadas(data_df, normal, periodo='Año calendario (Ene–Dic)'):
+    """Anomalías mensuales y del período (puntaje z y % de la normal) respecto a una ventana base fija"""
+    matriz = Matriz_anual_mensual(data_df)
+    valores = matriz.to_numpy(dtype=float)
+
+    # Difusión (años × 12) contra los estadísticos base de cada mes (12,)
+    media = normal['mensual'].reindex(range(1, 13)).to_numpy(dtype=float)
+    desviacion = normal['desviacion_mensual'].reindex(range(1, 13)).to_numpy(dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = np.where(desviacion > 0, (valores - media) / desviacion, np.nan)
+        porcentaje = np.where(media > 0, 100 * valores / media, np.nan)
+
+    agregado = Agregar_periodo(matriz, periodo, Agregacion_anual(data_df))
+    agregado = agregado[agregado['Completo']].set_index('Año')['Total']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        anual = pd.DataFrame({
+            'Total': agregado,
+            'Puntaje z': (agregado - normal['total']) / normal['desviacion'],
+            '% de la normal': 100 * agregado / normal['total']
+        })
+
+    return {
+        'z': pd.DataFrame(z, index=matriz.index, columns=matriz.columns),
+        'porcentaje': pd.DataFrame(porcentaje, index=matriz.index, columns=matriz.columns),
+        'anual': anual
+    }
+
+# --- RACHAS SECAS Y HÚMEDAS ---
+
+TIPOS_UMBRAL_RACHAS = {
+    'percentil': "Percentil de la climatología mensual",
+    'mm': "Umbral fijo (mm)"
+}
+
+def _Codificar_rachas(mascara):
+    """Codificación por longitud de rachas (RLE): inicio y longitud de cada racha de valores True"""
+    borde = np.diff(np.concatenate([[0], np.asarray(mascara, dtype=np.int8), [0]]))
+    inicios = np.flatnonzero(borde == 1)
+    return inicios, np.flatnonzero(borde == -1) - inicios
+
+def Umbrales_rachas(cubo, tipo='percentil', seco=20.0, humedo=80.0):
+    """Umbrales seco y húmedo por estación y mes (estaciones × 12)
+
+    Con tipo='percentil' cada umbral es el percentil del mismo mes en la
+    estación, de modo que un mes seco es uno más seco de lo habitual en esa
+    época del año; con tipo='mm' son valores fijos.
+    """
+    if tipo == 'percentil':
+        umbral_seco, umbral_humedo = np.nanpercentile(cubo, [seco, humedo], axis=1)
+        return umbral_seco, umbral_humedo
+    forma = (cubo.shape[0], 12)
+    return np.full(forma, float(seco)), np.full(forma, float(humedo))
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Rachas(cubo_regional, variable=VARIABLE_PREDETERMINADA, tipo='percentil', seco=20.0, humedo=80.0):
+    """Eventos de meses secos y húmedos consecutivos de todas las estaciones del cubo
+
+    Las series mensuales de todas las estaciones se encadenan separadas por un
+    mes vacío y se codifican de una sola vez. Los meses faltantes cortan las
+    rachas; una racha es completa si tiene datos antes y después. La columna de
+    la variable guarda el total de la racha (variables que se suman) o su promedio.
+    """
+    columna = VARIABLES[variable]['columna']
+    columnas = ['Estación', 'Tipo', 'Inicio', 'Fin', 'Duración (meses)', columna, 'Completa']
+    estaciones, años, cubo = cubo_regional
+    if not len(estaciones):
+        return pd.DataFrame(columns=columnas)
+    promediar = VARIABLES[variable]['agregacion'] != 'sum'
+
+    n_estaciones = len(estaciones)
+    separador = np.full((n_estaciones, 1), np.nan)
+
+    serie = np.concatenate([cubo.reshape(n_estaciones, -1), separador], axis=1)
+    largo = serie.shape[1]
+    serie = serie.ravel()
+    valido = ~np.isnan(serie)
+    suma = np.concatenate([[0.0], np.cumsum(np.where(valido, serie, 0.0))])
+
+    def por_mes(umbral):
+        return np.concatenate([np.tile(umbral, len(años)), separador], axis=1).ravel()
+
+    def fecha(indices):
+        posicion = indices % largo
+        return pd.to_datetime(pd.DataFrame({'year': años[posicion // 12], 'month': posicion % 12 + 1, 'day': 1}))
+
+    umbral_seco, umbral_humedo = Umbrales_rachas(cubo, tipo, seco, humedo)
+    with np.errstate(invalid='ignore'):
+        mascaras = {'Seca': serie < por_mes(umbral_seco), 'Húmeda': serie > por_mes(umbral_humedo)}
+
+    eventos = []
+    for nombre, mascara in mascaras.items():
+        inicios, duraciones = _Codificar_rachas(mascara)
+        fines = inicios + duraciones
+        eventos.append(pd.DataFrame({
+            'Estación': np.asarray(estaciones, dtype=object)[inicios // largo],
+            'Tipo': nombre,
+            'Inicio': fecha(inicios),
+            'Fin': fecha(fines - 1),
+            'Duración (meses)': duraciones,
+            columna: (suma[fines] - suma[inicios]) / (duraciones if promediar else 1),
+            # El índice -1 y los separadores son meses vacíos: las rachas en los bordes quedan incompletas
+            'Completa': valido[inicios - 1] & valido[fines]
+        }))
+
+    return pd.concat(eventos, ignore_index=True)[columnas].sort_values(['Estación', 'Inicio'], ignore_index=True)
+
+def Resumen_rachas(rachas, cubo_regional, duracion_minima=2, year_range=None):
+    """Racha más larga, número de eventos y frecuencia de retorno por estación y tipo de racha
+
+    Solo cuentan las rachas de al menos duracion_minima meses que empiezan
+    dentro de year_range; la frecuencia se refiere a los años con datos.
+    """
+    estaciones, años, cubo = cubo_regional
+    if rachas.empty or not len(estaciones):
+        return pd.DataFrame()
+
+    con_datos = ~np.isnan(cubo).all(axis=2)
+    if year_range is not None:
+        rachas = rachas[rachas['Inicio'].dt.year.between(*year_range)]
+        con_datos &= ((años >= year_range[0]) & (años <= year_range[1]))[None, :]
+    años_registro = pd.Series(con_datos.sum(axis=1), index=pd.Index(estaciones, name='Estación'))
+    años_registro = años_registro[años_registro > 0].sort_index()
+
+    seleccion = rachas[rachas['Duración (meses)'] >= duracion_minima]
+    mas_larga = seleccion.loc[seleccion.groupby(['Estación', 'Tipo'])['Duración (meses)'].idxmax()]
+    resumen = seleccion.groupby(['Estación', 'Tipo']).agg(**{
+        'Racha más larga (meses)': ('Duración (meses)', 'max'),
+        'Eventos': ('Duración (meses)', 'size'),
+        'Duración media (meses)': ('Duración (meses)', 'mean')
+    }).join(mas_larga.set_index(['Estación', 'Tipo'])['Inicio'].rename('Inicio de la más larga'))
+
+    # Estaciones sin eventos de algún tipo se reportan con cero eventos
+    indice = pd.MultiIndex.from_product([años_registro.index, ['Seca', 'Húmeda']], names=['Estación', 'Tipo'])
+    resumen = resumen.reindex(indice)
+    resumen['Eventos'] = resumen['Eventos'].fillna(0).astype(int)
+    resumen = resumen.reset_index()
+
+    resumen['Años con datos'] = resumen['Estación'].map(años_registro).to_numpy()
+    resumen['Eventos por década'] = 10 * resumen['Eventos'] / resumen['Años con datos']
+    resumen['Período de retorno (años)'] = resumen['Años con datos'] / resumen['Eventos'].replace(0, np.nan)
+    return resumen
+
+# --- ESTACIONALIDAD ---
+
+def _Indices_estacionalidad(X, meses, referencia=None):
+    """Índices de estacionalidad sobre el último eje de X (12 meses consecutivos, cualquier forma previa)"""
+    X = np.asarray(X, dtype=float)
+    meses = np.asarray(meses)
+    completo = ~np.isnan(X).any(axis=-1)
+    total = X.sum(axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Walsh y Lawler (1981) y Oliver (1980)
+        si = np.abs(X - total[..., None] / 12).sum(axis=-1) / total
+        pci = 100 * (X ** 2).sum(axis=-1) / total ** 2
+
+        # Estadística circular: cada mes es un vector con ángulo en su punto medio
+        angulo = 2 * np.pi * (meses - 0.5) / 12
+        seno = (X * np.sin(angulo)).sum(axis=-1)
+        coseno = (X * np.cos(angulo)).sum(axis=-1)
+        centroide = (np.arctan2(seno, coseno) % (2 * np.pi)) * 12 / (2 * np.pi) + 0.5
+        concentracion = np.hypot(seno, coseno) / total
+
+        # Acumulación de anomalías (Liebmann y Marengo): inicio tras el mínimo, fin en el máximo
+        if referencia is None:
+            referencia = np.nanmean(np.where(completo, total, np.nan)) / 12
+        acumulado = np.cumsum(X - referencia, axis=-1)
+        inicio = meses[(np.argmin(np.where(completo[..., None], acumulado, 0), axis=-1) + 1) % 12]
+        fin = meses[np.argmax(np.where(completo[..., None], acumulado, 0), axis=-1)]
+
+        lluviosos = (X > total[..., None] / 12).sum(axis=-1)
+
+    def solo_completos(valores):
+        return np.where(completo, valores, np.nan)
+
+    return {
+        'total': solo_completos(total),
+        'si': solo_completos(si),
+        'pci': solo_completos(pci),
+        'centroide': solo_completos(centroide),
+        'concentracion': solo_completos(concentracion),
+        'inicio': solo_completos(inicio),
+        'fin': solo_completos(fin),
+        'lluviosos': solo_completos(lluviosos)
+    }
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Indices_estacionalidad(data_df):
+    """Índices de estacionalidad por año, con años que comienzan en el mes climatológicamente más seco"""
+    matriz = Matriz_anual_mensual(data_df)
+    if matriz.empty or len(matriz) < 2:
+        return pd.DataFrame(), None
+
+    # El año de análisis empieza en el mes más seco para no cortar la temporada de lluvias
+    mes_inicio = int(matriz.mean().idxmin())
+    desplazamiento = mes_inicio - 1
+    serie = matriz.to_numpy(dtype=float).ravel()[desplazamiento:]
+    n_años = len(serie) // 12
+    X = serie[:n_años * 12].reshape(n_años, 12)
+    meses = (np.arange(12) + desplazamiento) % 12 + 1
+
+    indices = _Indices_estacionalidad(X, meses)
+    # Igual que en los períodos: los años que cruzan el fin de año se rotulan con el año en que terminan
+    año_fin = int(matriz.index[0]) + (1 if desplazamiento else 0)
+
+    anual = pd.DataFrame({
+        'Año': np.arange(año_fin, año_fin + n_años),
+        'Total': indices['total'],
+        'Índice de estacionalidad': indices['si'],
+        'PCI': indices['pci'],
+        'Centroide (mes)': indices['centroide'],
+        'Concentración': indices['concentracion'],
+        'Inicio de lluvias': indices['inicio'],
+        'Fin de lluvias': indices['fin'],
+        'Meses lluviosos': indices['lluviosos']
+    }).dropna(subset=['Total'])
+
+    # Índices de la climatología media (sin depender de años completos)
+    climatologia = _Indices_estacionalidad(matriz.mean().to_numpy()[meses - 1][None, :], meses)
+    resumen = {clave: float(valor[0]) for clave, valor in climatologia.items()}
+    resumen['mes_inicio_año'] = mes_inicio
+
+    return anual.reset_index(drop=True), resumen
+
+def Clasificar_estacionalidad(si):
+    """Clase de régimen según el índice de estacionalidad de Walsh y Lawler"""
+    limites = [0.19, 0.39, 0.59, 0.79, 0.99, 1.19]
+    clases = [
+        'Muy uniforme', 'Uniforme con estación húmeda definida', 'Algo estacional con estación seca corta',
+        'Estacional', 'Marcadamente estacional con estación seca larga',
+        'La mayor parte de la lluvia en 3 meses o menos', 'Extremo: casi toda la lluvia en 1-2 meses'
+    ]
+    return clases[int(np.searchsorted(limites, si))] if np.isfinite(si) else 'Sin datos'
+
+# --- PRUEBAS DE HOMOGENEIDAD ---
+
+def _Compactar_columnas(X):
+    """Sube los valores válidos de cada columna al inicio y deja los NaN al final"""
+    X = np.asarray(X, dtype=float)
+    if X.ndim == 1:
+        X = X[:, None]
+
+    orden = np.argsort(np.isnan(X), axis=0, kind='stable')
+    Xc = np.take_along_axis(X, orden, axis=0)
+    n = (~np.isnan(X)).sum(axis=0)
+
+    return Xc, n, orden
+
+def _Estadisticos_homogeneidad(Xc, n):
+    """Calcula Pettitt, SNHT, Buishand y von Neumann para cada columna con sumas acumuladas"""
+    N, k = Xc.shape
+    pos = np.arange(1, N + 1)[:, None]
+    valido = pos <= n
+    interior = pos < n
+    n_seguro = np.maximum(n, 2)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = np.where(valido, Xc, 0.0).sum(axis=0) / n_seguro
+        dev = np.where(valido, Xc - media, 0.0)
+        suma_cuad = (dev ** 2).sum(axis=0)
+        S = np.cumsum(dev, axis=0)
+
+        # Buishand: rango de las sumas parciales ajustadas (S_0 = S_n = 0)
+        D = np.sqrt(suma_cuad / n_seguro)
+        S_max = np.maximum(np.where(interior, S, -np.inf).max(axis=0), 0.0)
+        S_min = np.minimum(np.where(interior, S, np.inf).min(axis=0), 0.0)
+        buishand = (S_max - S_min) / D / np.sqrt(n_seguro)
+        buishand_t = np.argmax(np.where(interior, np.abs(S), -np.inf), axis=0) + 1
+
+        # SNHT: T(t) = n·Z_t² / (t·(n - t)) con Z_t la suma parcial estandarizada
+        s = np.sqrt(suma_cuad / (n_seguro - 1))
+        T = np.where(interior, (S / s) ** 2 * n / (pos * (n - pos)), -np.inf)
+        snht = T.max(axis=0)
+        snht_t = np.argmax(T, axis=0) + 1
+
+        # Pettitt: U_t = 2·Σ r_i - t·(n + 1) sobre los rangos de cada serie
+        rangos = np.where(valido, stats.rankdata(np.where(valido, Xc, np.inf), axis=0), 0.0)
+        U = np.where(interior, np.abs(2 * np.cumsum(rangos, axis=0) - pos * (n + 1)), -np.inf)
+        pettitt = U.max(axis=0)
+        pettitt_t = np.argmax(U, axis=0) + 1
+
+        # Von Neumann: cociente de diferencias sucesivas sobre la varianza
+        dif = np.where(interior[:-1], np.diff(Xc, axis=0), 0.0)
+        von_neumann = (dif ** 2).sum(axis=0) / suma_cuad
+
+    return {
+        'pettitt': pettitt, 'pettitt_t': pettitt_t,
+        'snht': snht, 'snht_t': snht_t,
+        'buishand': buishand, 'buishand_t': buishand_t,
+        'von_neumann': von_neumann
+    }
+
+@functools.lru_cache(maxsize=64)
+def _Distribucion_nula_snht(n, simulaciones=4000, semilla=12345):
+    """Distribución nula de T0 (SNHT) para series normales independientes de longitud n"""
+    rng = np.random.default_rng(semilla)
+    Xc = rng.standard_normal((n, simulaciones))
+    nulos = _Estadisticos_homogeneidad(Xc, np.full(simulaciones, n))['snht']
+    return np.sort(nulos)
+
+def _Pvalores_asintoticos(est, n):
+    """P-valores aproximados de cada prueba cuando no se usa Monte-Carlo"""
+    n = n.astype(float)
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        p_pettitt = np.minimum(1.0, 2 * np.exp(-6 * est['pettitt'] ** 2 / (n ** 3 + n ** 2)))
+
+        # Rango del puente browniano (distribución de Kuiper) para R/√n
+        j = np.arange(1, 101)[:, None]
+        x = est['buishand']
+        p_buishand = np.clip(2 * ((4 * j ** 2 * x ** 2 - 1) * np.exp(-2 * j ** 2 * x ** 2)).sum(axis=0), 0, 1)
+
+        # N ~ Normal(2, 4(n-2)/(n²-1)); valores bajos indican inhomogeneidad
+        p_von_neumann = stats.norm.cdf((est['von_neumann'] - 2) / np.sqrt(4 * (n - 2) / (n ** 2 - 1)))
+
+    p_snht = np.full(len(n), np.nan)
+    for i, (t0, ni) in enumerate(zip(est['snht'], n.astype(int))):
+        if ni >= 10 and np.isfinite(t0):
+            nulos = _Distribucion_nula_snht(ni)
+            p_snht[i] = (len(nulos) - np.searchsorted(nulos, t0, side='left') + 1) / (len(nulos) + 1)
+
+    return {
+        'pettitt': p_pettitt,
+        'snht': p_snht,
+        'buishand': p_buishand,
+        'von_neumann': p_von_neumann
+    }
+
+def _Pvalores_montecarlo(Xc, n, est, n_simulaciones, semilla):
+    """P-valores por permutación, repartiendo las simulaciones en lotes paralelos"""
+    N, k = Xc.shape
+    valido = np.arange(N)[:, None] < n
+    lote = max(1, min(n_simulaciones, 200_000 // max(N * k, 1)))
+    tamaños = [lote] * (n_simulaciones // lote)
+    if n_simulaciones % lote:
+        tamaños.append(n_simulaciones % lote)
+    semillas = np.random.SeedSequence(semilla).spawn(len(tamaños))
+
+    def simular(args):
+        b, semilla_lote = args
+        rng = np.random.default_rng(semilla_lote)
+        # Claves aleatorias con +inf en las posiciones vacías: permutan solo los datos válidos
+        claves = np.where(valido[:, :, None], rng.random((N, k, b)), np.inf)
+        orden = np.argsort(claves, axis=0)
+        Xp = np.take_along_axis(np.repeat(Xc[:, :, None], b, axis=2), orden, axis=0)
+        sim = _Estadisticos_homogeneidad(Xp.reshape(N, k * b), np.repeat(n, b))
+        return {
+            'pettitt': (sim['pettitt'].reshape(k, b) >= est['pettitt'][:, None]).sum(axis=1),
+            'snht': (sim['snht'].reshape(k, b) >= est['snht'][:, None]).sum(axis=1),
+            'buishand': (sim['buishand'].reshape(k, b) >= est['buishand'][:, None]).sum(axis=1),
+            'von_neumann': (sim['von_neumann'].reshape(k, b) <= est['von_neumann'][:, None]).sum(axis=1)
+        }
+
+    with ThreadPoolExecutor(max_workers=min(len(tamaños), os.cpu_count() or 1)) as executor:
+        conteos = list(executor.map(simular, zip(tamaños, semillas)))
+
+    return {
+        prueba: (1 + sum(c[prueba] for c in conteos)) / (n_simulaciones + 1)
+        for prueba in ('pettitt', 'snht', 'buishand', 'von_neumann')
+    }
+
+def Pruebas_homogeneidad(X, n_simulaciones=0, semilla=0, alfa=0.05):
+    """Aplica las pruebas de homogeneidad a cada columna de X (series con NaN permitidos)"""
+    Xc, n, orden = _Compactar_columnas(X)
+    est = _Estadisticos_homogeneidad(Xc, n)
+
+    if n_simulaciones > 0:
+        pvalores = _Pvalores_montecarlo(Xc, n, est, int(n_simulaciones), semilla)
+    else:
+        pvalores = _Pvalores_asintoticos(est, n)
+
+    insuficiente = n < 10
+    for clave in ('pettitt', 'snht', 'buishand', 'von_neumann'):
+        est[clave] = np.where(insuficiente, np.nan, est[clave])
+        pvalores[clave] = np.where(insuficiente, np.nan, pvalores[clave])
+
+    # Posición (fila original de X) del primer valor posterior a cada quiebre
+    quiebres = {}
+    for clave in ('pettitt', 'snht', 'buishand'):
+        t = np.minimum(est[f'{clave}_t'], np.maximum(n - 1, 0))
+        quiebres[clave] = np.where(insuficiente, -1, orden[t, np.arange(len(n))])
+
+    rechazos = sum((pvalores[clave] < alfa).astype(int) for clave in pvalores)
+
+    return est, pvalores, quiebres, n, rechazos
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Reporte_homogeneidad(data_df, n_simulaciones=0, semilla=0, periodo='Año calendario (Ene–Dic)'):
+    """Reporte de quiebres para el total del período y cada serie mensual de la estación"""
+    if data_df.empty:
+        return pd.DataFrame()
+
+    month_map = {
+        1: 'Ene', 2: 'Feb', 3: 'Mar', 4: 'Abr',
+        5: 'May', 6: 'Jun', 7: 'Jul', 8: 'Ago',
+        9: 'Set', 10: 'Oct', 11: 'Nov', 12: 'Dic'
+    }
+
+    matriz = Matriz_anual_mensual(data_df)
+    # El total del período solo se evalúa cuando tiene todos sus meses
+    agregado = Agregar_periodo(matriz, periodo, Agregacion_anual(data_df)).set_index('Año')
+    anual = agregado['Total'].where(agregado['Completo']).reindex(matriz.index)
+    series = pd.concat([anual.rename('Anual'), matriz.rename(columns=month_map)], axis=1)
+    años = series.index.to_numpy()
+
+    est, pvalores, quiebres, n, rechazos = Pruebas_homogeneidad(
+        series.to_numpy(), n_simulaciones, semilla
+    )
+
+    def año_quiebre(clave):
+        return pd.array(
+            [años[i] if i >= 0 else None for i in quiebres[clave]],
+            dtype='Int64'
+        )
+
+    reporte = pd.DataFrame({
+        'Serie': series.columns,
+        'Años': n,
+        'Pettitt K': est['pettitt'],
+        'Pettitt p': pvalores['pettitt'],
+        'Pettitt quiebre': año_quiebre('pettitt'),
+        'SNHT T0': est['snht'],
+        'SNHT p': pvalores['snht'],
+        'SNHT quiebre': año_quiebre('snht'),
+        'Buishand R/√n': est['buishand'],
+        'Buishand p': pvalores['buishand'],
+        'Buishand quiebre': año_quiebre('buishand'),
+        'Von Neumann N': est['von_neumann'],
+        'Von Neumann p': pvalores['von_neumann'],
+        'Pruebas rechazadas': rechazos
+    })
+
+    # Clasificación de Wijngaard et al. (2003)
+    reporte['Clasificación'] = np.select(
+        [n < 10, rechazos <= 1, rechazos == 2],
+        ['Insuficiente', 'Útil', 'Dudosa'],
+        default='Sospechosa'
+    )
+
+    return reporte
+
+# --- PUNTOS DE CAMBIO ---
+
+def _Pelt(y, penalizacion=None, largo_minimo=5):
+    """Puntos de cambio en media y varianza por PELT (Killick et al., 2012) sobre una serie sin NaN
+
+    El costo de un tramo es m·log(varianza), obtenido en O(1) con sumas
+    prefijo; la poda mantiene pocos candidatos y el tiempo es casi lineal.
+    Devuelve los índices donde empieza cada tramo nuevo.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n < 2 * largo_minimo:
+        return np.array([], dtype=int)
+    if penalizacion is None:
+        # BIC: media, varianza y posición de cada cambio
+        penalizacion = 3 * np.log(n)
+
+    s1 = np.concatenate([[0.0], np.cumsum(y)])
+    s2 = np.concatenate([[0.0], np.cumsum(y * y)])
+    piso = 1e-3 * (np.var(y) or 1.0)
+
+    def costo(inicios, fin):
+        m = fin - inicios
+        varianza = (s2[fin] - s2[inicios]) / m - ((s1[fin] - s1[inicios]) / m) ** 2
+        return m * np.log(np.maximum(varianza, piso))
+
+    F = np.full(n + 1, np.inf)
+    F[0] = -penalizacion
+    anterior = np.zeros(n + 1, dtype=int)
+    candidatos = np.array([0])
+
+    for t in range(largo_minimo, n + 1):
+        parcial = F[candidatos] + costo(candidatos, t)
+        i = np.argmin(parcial)
+        F[t] = parcial[i] + penalizacion
+        anterior[t] = candidatos[i]
+        # Poda: un inicio que ya no puede mejorar a F[t] no se vuelve a evaluar
+        candidatos = np.append(candidatos[parcial <= F[t]], t - largo_minimo + 1)
+
+    quiebres = []
+    t = anterior[n]
+    while t > 0:
+        quiebres.append(t)
+        t = anterior[t]
+    return np.array(quiebres[::-1], dtype=int)
+
+def _Cambios_serie(valores, largo_minimo=5):
+    """PELT sobre una serie con faltantes: se omiten los NaN y los quiebres se devuelven en índices originales"""
+    valores = np.asarray(valores, dtype=float)
+    posiciones = np.flatnonzero(~np.isnan(valores))
+    return posiciones[_Pelt(valores[posiciones], largo_minimo=largo_minimo)]
+
+def Segmentos(valores, etiquetas, quiebres):
+    """Media y desviación de cada tramo entre puntos de cambio"""
+    valores = np.asarray(valores, dtype=float)
+    limites = np.concatenate([[0], quiebres, [len(valores)]]).astype(int)
+    filas = []
+    for a, b in zip(limites[:-1], limites[1:]):
+        tramo = valores[a:b]
+        filas.append({
+            'Inicio': etiquetas[a],
+            'Fin': etiquetas[b - 1],
+            'Datos': int((~np.isnan(tramo)).sum()),
+            'Media': np.nanmean(tramo),
+            'Desviación': np.nanstd(tramo, ddof=1)
+        })
+    return pd.DataFrame(filas)
+
+def Series_cambio(data_df):
+    """Agregados anuales (solo períodos completos) y anomalías mensuales estandarizadas de una estación"""
+    columna = Columna_valor(data_df)
+    conteo = data_df.groupby('Año')[columna].count()
+    anual = data_df.groupby('Año')[columna].agg(Agregacion_anual(data_df))[conteo == conteo.max()]
+
+    # Sin el ciclo estacional, de lo contrario cada temporada de lluvias sería un "cambio"
+    mensual = data_df.dropna(subset=[columna]).sort_values(['Año', 'Mes_num'])
+    por_mes = mensual.groupby('Mes_num')[columna]
+    z = (mensual[columna] - por_mes.transform('mean')) / por_mes.transform('std')
+    fechas = pd.to_datetime({'year': mensual['Año'], 'month': mensual['Mes_num'], 'day': 1})
+
+    return anual, pd.Series(z.fillna(0.0).to_numpy(), index=fechas.to_numpy())
+
+def Series_cambio_cubo(años, valores, agregacion='sum'):
+    """Series_cambio a partir de la fila de una estación en el cubo (años × 12)"""
+    valido = ~np.isnan(valores)
+    conteo = valido.sum(axis=1)
+    completos = (conteo > 0) & (conteo == conteo.max())
+    anual = pd.Series(
+        getattr(np, 'nan' + agregacion)(valores[completos], axis=1),
+        index=pd.Index(años[completos], name='Año')
+    )
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = (valores - np.nanmean(valores, axis=0)) / np.nanstd(valores, axis=0, ddof=1)
+    i_año, i_mes = np.nonzero(valido)
+    fechas = pd.to_datetime({'year': años[i_año], 'month': i_mes + 1, 'day': 1})
+    return anual, pd.Series(np.nan_to_num(z[valido], nan=0.0), index=fechas.to_numpy())
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Puntos_de_cambio(data_df, largo_minimo_anual=5, largo_minimo_mensual=24):
+    """Tramos homogéneos de la serie anual y de las anomalías mensuales de una estación"""
+    if data_df.empty:
+        return None
+
+    anual, mensual = Series_cambio(data_df)
+    quiebres_anuales = _Cambios_serie(anual.to_numpy(), largo_minimo_anual)
+    quiebres_mensuales = _Cambios_serie(mensual.to_numpy(), largo_minimo_mensual)
+
+    return {
+        'anual': Segmentos(anual.to_numpy(), anual.index.to_numpy(), quiebres_anuales),
+        'mensual': Segmentos(mensual.to_numpy(), mensual.index, quiebres_mensuales)
+    }
+
+def _Modulo_trabajo():
+    """Módulo importable con las funciones de trabajo
+
+    Streamlit ejecuta este archivo como __main__, que los procesos hijos no
+    pueden resolver al deserializar; se usa el mismo archivo importado por nombre.
+    """
+    if __name__ != '__main__':
+        return sys.modules[__name__]
+    return importlib.import_module(os.path.splitext(os.path.basename(__file__))[0])
+
+def _Fila_cambios(nombre, anual, mensual, largo_minimo_anual=5, largo_minimo_mensual=24):
+    """Resumen de puntos de cambio de una estación (tarea independiente para los procesos de trabajo)"""
+    qa = _Cambios_serie(anual.to_numpy(), largo_minimo_anual)
+    qm = _Cambios_serie(mensual.to_numpy(), largo_minimo_mensual)
+    return {
+        'Estación': nombre,
+        'Años analizados': len(anual),
+        'Cambios anuales': len(qa),
+        'Años de cambio': ', '.join(str(a) for a in anual.index.to_numpy()[qa]) or '--',
+        'Cambios mensuales': len(qm),
+        'Fechas de cambio (mensual)': ', '.join(pd.DatetimeIndex(mensual.index[qm]).strftime('%m/%Y')) or '--'
+    }
+
+def Tareas_cambios_cuenca(cubo_regional, variable=VARIABLE_PREDETERMINADA):
+    """Argumentos de _Fila_cambios para cada estación del cubo"""
+    estaciones, años, cubo = cubo_regional
+    agregacion = VARIABLES[variable]['agregacion']
+    return [
+        (nombre, *Series_cambio_cubo(años, valores, agregacion))
+        for nombre, valores in zip(estaciones, cubo)
+    ]
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Puntos_de_cambio_cuenca(cubo_regional, variable=VARIABLE_PREDETERMINADA, largo_minimo_anual=5, largo_minimo_mensual=24, min_paralelo=8):
+    """Puntos de cambio de todas las estaciones, repartidos en un grupo de procesos si son muchas"""
+    if not len(cubo_regional[0]):
+        return pd.DataFrame()
+
+    tareas = Tareas_cambios_cuenca(cubo_regional, variable)
+    nombres, anuales, mensuales = zip(*tareas)
+    largos = ([largo_minimo_anual] * len(tareas), [largo_minimo_mensual] * len(tareas))
+
+    if len(tareas) >= min_paralelo:
+        modulo = _Modulo_trabajo()
+        with ProcessPoolExecutor(max_workers=min(len(tareas), os.cpu_count() or 1)) as executor:
+            filas = list(executor.map(
+                modulo._Fila_cambios, nombres, anuales, mensuales, *largos,
+                chunksize=max(1, len(tareas) // (4 * (os.cpu_count() or 1)))
+            ))
+    else:
+        filas = list(map(_Fila_cambios, nombres, anuales, mensuales, *largos))
+
+    return pd.DataFrame(filas)
+
+# --- TRABAJOS EN SEGUNDO PLANO ---
+
+def Huella_datos(df):
+    """Huella del contenido de un DataFrame, para reconocer trabajos y resultados ya calculados"""
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
+
+class Gestor_trabajos:
+    """Cola local de análisis pesados ejecutados en un grupo de procesos
+
+    Cada trabajo se divide en tareas independientes: el progreso es la fracción
+    de tareas terminadas y los resultados parciales están disponibles mientras
+    el resto se calcula. Los trabajos se identifican por una clave de contenido,
+    de modo que sesiones que piden el mismo análisis comparten el resultado.
+    """
+
+    def __init__(self, max_workers=None, max_trabajos=32):
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self.max_trabajos = max_trabajos
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self._trabajos = collections.OrderedDict()
+        self._por_clave = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _errores(trabajo):
+        """Excepciones de las tareas terminadas con error"""
+        return [
+            f.exception() for f in trabajo['futuros']
+            if f.done() and not f.cancelled() and f.exception() is not None
+        ]
+
+    def buscar(self, clave):
+        """Identificador del trabajo con esa clave, si existe y no fue cancelado ni falló"""
+        with self._lock:
+            trabajo_id = self._por_clave.get(clave)
+            trabajo = self._trabajos.get(trabajo_id)
+            if trabajo is not None and not trabajo['cancelado'] and not self._errores(trabajo):
+                self._trabajos.move_to_end(trabajo_id)
+                return trabajo_id
+            return None
+
+    def enviar(self, clave, nombre, funcion, tareas):
+        """Encola una tarea por cada tupla de argumentos y devuelve el identificador del trabajo"""
+        existente = self.buscar(clave)
+        if existente is not None:
+            return existente
+
+        tareas = list(tareas)
+        with self._lock:
+            try:
+                futuros = [self._executor.submit(funcion, *args) for args in tareas]
+            except BrokenProcessPool:
+                # Un proceso murió (por ejemplo, por memoria): se reinicia el grupo
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                futuros = [self._executor.submit(funcion, *args) for args in tareas]
+
+            trabajo_id = uuid.uuid4().hex[:8]
+            self._trabajos[trabajo_id] = {
+                'clave': clave,
+                'nombre': nombre,
+                'futuros': futuros,
+                'executor': self._executor,
+                'inicio': time.time(),
+                'fin': None,
+                'cancelado': False
+            }
+            self._por_clave[clave] = trabajo_id
+            self._purgar()
+        return trabajo_id
+
+    def estado(self, trabajo_id):
+        """Estado, progreso y resultados parciales (None en las tareas pendientes) de un trabajo"""
+        with self._lock:
+            trabajo = self._trabajos.get(trabajo_id)
+        if trabajo is None:
+            return {'estado': 'desconocido', 'progreso': 0.0, 'completadas': 0, 'total': 0, 'resultados': [], 'error': None}
+
+        futuros = trabajo['futuros']
+        listos = [f for f in futuros if f.done() and not f.cancelled()]
+        errores = self._errores(trabajo)
+        completadas = len(listos) - len(errores)
+
+        if any(isinstance(e, BrokenProcessPool) for e in errores):
+            self._reiniciar(trabajo['executor'])
+
+        if trabajo['cancelado']:
+            estado = 'cancelado'
+        elif errores:
+            estado = 'error'
+        elif completadas == len(futuros):
+            estado = 'terminado'
+        elif any(f.running() for f in futuros) or completadas:
+            estado = 'en curso'
+        else:
+            estado = 'pendiente'
+
+        if estado in ('terminado', 'error', 'cancelado') and trabajo['fin'] is None:
+            trabajo['fin'] = time.time()
+
+        return {
+            'nombre': trabajo['nombre'],
+            'estado': estado,
+            'progreso': completadas / len(futuros) if futuros else 1.0,
+            'completadas': completadas,
+            'total': len(futuros),
+            'resultados': [f.result() if f in listos and f.exception() is None else None for f in futuros],
+            'error': str(errores[0]) if errores else None,
+            'duracion': (trabajo['fin'] or time.time()) - trabajo['inicio']
+        }
+
+    def _reiniciar(self, executor):
+        """Reemplaza el grupo de procesos si un proceso murió (por ejemplo, por memoria) mientras trabajaba"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def cancelar(self, trabajo_id):
+        """Descarta las tareas que aún no empezaron; las que están en curso terminan pero se ignoran"""
+        with self._lock:
+            trabajo = self._trabajos.get(trabajo_id)
+            if trabajo is not None:
+                trabajo['cancelado'] = True
+                for futuro in trabajo['futuros']:
+                    futuro.cancel()
+
+    def _purgar(self):
+        """Olvida los trabajos más antiguos por encima del máximo (cancelando los que sigan pendientes)"""
+        while len(self._trabajos) > self.max_trabajos:
+            trabajo_id, trabajo = self._trabajos.popitem(last=False)
+            for futuro in trabajo['futuros']:
+                futuro.cancel()
+            if self._por_clave.get(trabajo['clave']) == trabajo_id:
+                del self._por_clave[trabajo['clave']]
+
+@st.cache_resource(show_spinner=False)
+def Gestor_trabajos_compartido():
+    """Única cola de trabajos del servidor, compartida por todas las sesiones"""
+    return Gestor_trabajos()
+
+def Trabajo_sesion(clave, nombre, funcion, preparar_tareas, *args):
+    """Trabajo que muestra la sesión para esa clave
+
+    Busca o envía el trabajo compartido; las tareas (preparar_tareas(*args))
+    solo se construyen al enviarlo. Si el trabajo de la sesión fue cancelado o
+    falló se sigue mostrando hasta que se pida calcularlo de nuevo.
+    """
+    gestor = Gestor_trabajos_compartido()
+    propios = st.session_state.setdefault('trabajos', {})
+    trabajo_id = propios.get(clave)
+    if trabajo_id is not None and gestor.estado(trabajo_id)['estado'] in ('cancelado', 'error'):
+        return trabajo_id
+
+    trabajo_id = gestor.buscar(clave) or gestor.enviar(clave, nombre, funcion, preparar_tareas(*args))
+    propios[clave] = trabajo_id
+    return trabajo_id
+
+# --- CACHÉ COMPARTIDA DE ESTACIONES ---
+
+def Tamaño_objeto(objeto):
+    """Memoria aproximada en bytes de un DataFrame, Series, arreglo o contenedor de ellos"""
+    if isinstance(objeto, pd.DataFrame):
+        return int(objeto.memory_usage(deep=True).sum())
+    if isinstance(objeto, pd.Series):
+        return int(objeto.memory_usage(deep=True))
+    if isinstance(objeto, np.ndarray):
+        return objeto.nbytes
+    if isinstance(objeto, dict):
+        return sum(Tamaño_objeto(v) for v in objeto.values()) + 64 * len(objeto)
+    if isinstance(objeto, (list, tuple)):
+        return sum(Tamaño_objeto(v) for v in objeto) + 8 * len(objeto)
+    return sys.getsizeof(objeto)
+
+class Cache_estaciones:
+    """Estaciones leídas y sus agregados, compartidos por todas las sesiones del servidor
+
+    Las entradas se identifican por el hash del archivo (o la huella de la fila
+    del cubo en disco), de modo que N usuarios
+    que abren la misma estación usan una sola copia en memoria. Los objetos
+    devueltos son de solo lectura: las sesiones filtran creando DataFrames nuevos.
+    Cuando se supera el presupuesto de memoria se descartan las estaciones
+    usadas hace más tiempo.
+    """
+
+    def __init__(self, presupuesto_mb=None):
+        if presupuesto_mb is None:
+            presupuesto_mb = float(os.environ.get('CUENCAS_CACHE_MB', 256))
+        self.presupuesto = int(presupuesto_mb * 1024 ** 2)
+        self._entradas = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    @staticmethod
+    def huella(contenido):
+        """Hash del contenido del archivo"""
+        return hashlib.sha1(contenido).hexdigest()
+
+    def obtener(self, contenido):
+        """Metadatos y datos mensuales de un archivo, leyéndolo solo si nadie lo cargó antes"""
+        clave = self.huella(contenido)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada['data_df'] is not None:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada['metadata'], entrada['data_df']
+
+        # La lectura se hace fuera del candado para no bloquear a otras sesiones
+        metadata, data_df = Cargar_estacion(contenido)
+        with self._lock:
+            self.fallos += 1
+            entrada = self._entrada(clave)
+            if entrada['data_df'] is None:
+                entrada.update(metadata=metadata, data_df=data_df)
+                entrada['bytes'] += Tamaño_objeto(data_df) + Tamaño_objeto(metadata)
+            self._entradas.move_to_end(clave)
+            self._liberar(conservar=clave)
+            return entrada['metadata'], entrada['data_df']
+
+    def agregado(self, clave, nombre, funcion, *args):
+        """Resultado de funcion(*args) guardado junto a la estación con esa huella"""
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and nombre in entrada['agregados']:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada['agregados'][nombre]
+
+        resultado = funcion(*args)
+        with self._lock:
+            self.fallos += 1
+            entrada = self._entrada(clave)
+            if nombre not in entrada['agregados']:
+                entrada['agregados'][nombre] = resultado
+                entrada['bytes'] += Tamaño_objeto(resultado)
+            self._entradas.move_to_end(clave)
+            self._liberar(conservar=clave)
+            return entrada['agregados'][nombre]
+
+    def _entrada(self, clave):
+        """Entrada de una huella; las estaciones del cubo en disco solo guardan agregados (sin archivo leído)"""
+        return self._entradas.setdefault(clave, {'metadata': None, 'data_df': None, 'agregados': {}, 'bytes': 0})
+
+    def metricas(self):
+        """Aciertos, fallos, desalojos y memoria ocupada"""
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'Estaciones': len(self._entradas),
+                'Memoria (MB)': sum(e['bytes'] for e in self._entradas.values()) / 1024 ** 2,
+                'Presupuesto (MB)': self.presupuesto / 1024 ** 2,
+                'Aciertos': self.aciertos,
+                'Fallos': self.fallos,
+                'Tasa de aciertos': self.aciertos / consultas if consultas else 0.0,
+                'Desalojos': self.desalojos
+            }
+
+    def _liberar(self, conservar=None):
+        """Descarta las entradas menos usadas hasta volver al presupuesto (nunca la recién usada)"""
+        total = sum(e['bytes'] for e in self._entradas.values())
+        for clave in list(self._entradas):
+            if total <= self.presupuesto:
+                break
+            if clave == conservar:
+                continue
+            total -= self._entradas.pop(clave)['bytes']
+            self.desalojos += 1
+
+@st.cache_resource(show_spinner=False)
+def Cache_estaciones_compartida():
+    """Única caché de estaciones del servidor"""
+    return Cache_estaciones()
+
+# --- MEMORIA DE LA SESIÓN ---
+
+def Registrar_memoria(nombre, objeto, compartido=False):
+    """Anota el tamaño de un objeto usado en esta ejecución para el reporte de memoria de la sesión"""
+    st.session_state.setdefault('memoria', {})[nombre] = {
+        'bytes': Tamaño_objeto(objeto),
+        'compartido': compartido
+    }
+
+def Artefacto_sesion(nombre, clave, funcion, *args):
+    """Resultado de funcion(*args) guardado en la sesión mientras clave no cambie
+
+    Si los artefactos de la sesión superan PRESUPUESTO_SESION_MB se descartan
+    los usados hace más tiempo; se vuelven a calcular cuando se necesiten.
+    """
+    artefactos = st.session_state.setdefault('artefactos', collections.OrderedDict())
+    guardado = artefactos.get(nombre)
+    if guardado is not None and guardado['clave'] == clave:
+        artefactos.move_to_end(nombre)
+        return guardado['valor']
+
+    valor = funcion(*args)
+    artefactos[nombre] = {'clave': clave, 'valor': valor, 'bytes': Tamaño_objeto(valor)}
+    artefactos.move_to_end(nombre)
+    Liberar_memoria_sesion(conservar=nombre)
+    return valor
+
+def Artefacto_guardado(nombre, clave):
+    """Artefacto de la sesión ya calculado para esa clave, o None"""
+    guardado = st.session_state.get('artefactos', {}).get(nombre)
+    if guardado is not None and guardado['clave'] == clave:
+        return guardado['valor']
+    return None
+
+def Liberar_memoria_sesion(presupuesto_mb=None, conservar=None):
+    """Descarta los artefactos menos usados de la sesión hasta volver al presupuesto"""
+    presupuesto = (presupuesto_mb or PRESUPUESTO_SESION_MB) * 1024 ** 2
+    artefactos = st.session_state.get('artefactos', {})
+    total = sum(a['bytes'] for a in artefactos.values())
+    for nombre in list(artefactos):
+        if total <= presupuesto:
+            break
+        if nombre == conservar:
+            continue
+        total -= artefactos.pop(nombre)['bytes']
+        st.session_state['artefactos_descartados'] = st.session_state.get('artefactos_descartados', 0) + 1
+
+def Memoria_sesion():
+    """Tabla con el tamaño de los datos de la ejecución actual y de los artefactos guardados en la sesión"""
+    filas = [
+        {'Objeto': nombre, 'Tipo': 'Compartido' if info['compartido'] else 'Ejecución', 'MB': info['bytes'] / 1024 ** 2}
+        for nombre, info in st.session_state.get('memoria', {}).items()
+    ]
+    filas += [
+        {'Objeto': nombre, 'Tipo': 'Artefacto', 'MB': info['bytes'] / 1024 ** 2}
+        for nombre, info in st.session_state.get('artefactos', {}).items()
+    ]
+    return pd.DataFrame(filas, columns=['Objeto', 'Tipo', 'MB'])
+
+# --- CUBO EN DISCO ---
+
+# Red nacional: cubo estaciones × años × 12 (float32, NaN en faltantes) y su índice de metadatos
+ARCHIVO_CUBO = 'cubo.npy'
+ARCHIVO_INDICE_CUBO = 'indice.json'
+
+def Fila_indice(fila, nombre, metadata, data_df, huella=''):
+    """Metadatos de una estación en forma plana para el índice del cubo"""
+    ambito = metadata.get('Ámbito Político')
+    ambito = ambito if isinstance(ambito, dict) else {}
+    coordenadas = metadata.get('Coordenadas')
+    coordenadas = coordenadas if isinstance(coordenadas, dict) else {}
+    return {
+        'Fila': fila,
+        'Estación': nombre,
+        'Variable': metadata.get('Variable', ''),
+        'Tipo': metadata.get('Tipo', ''),
+        'Operador': metadata.get('Operador', ''),
+        'Cuenca': metadata.get('Cuenca', ''),
+        'Departamento': ambito.get('Departamento', ''),
+        'Provincia': ambito.get('Provincia', ''),
+        'Distrito': ambito.get('Distrito', ''),
+        'Ámbito Administrativo': metadata.get('Ámbito Administrativo', ''),
+        'Latitud': coordenadas.get('Latitud'),
+        'Longitud': coordenadas.get('Longitud'),
+        'Altitud': coordenadas.get('Altitud', ''),
+        'Año inicial': int(data_df['Año'].min()),
+        'Año final': int(data_df['Año'].max()),
+        'Meses con datos': int(data_df[Columna_valor(data_df)].notna().sum()),
+        'Huella': huella
+    }
+
+def Metadata_desde_indice(fila):
+    """Metadatos con la estructura de Extraer_Metadata a partir de una fila del índice"""
+    metadata = {
+        'Estación': fila['Estación'],
+        'Variable': fila['Variable'],
+        'Operador': fila['Operador'],
+        'Tipo': fila['Tipo'],
+        'Ámbito Político': {
+            'Departamento': fila['Departamento'],
+            'Provincia': fila['Provincia'],
+            'Distrito': fila['Distrito']
+        },
+        'Ámbito Administrativo': fila['Ámbito Administrativo'],
+        'Cuenca': fila['Cuenca']
+    }
+    if pd.notna(fila['Latitud']) and pd.notna(fila['Longitud']):
+        metadata['Coordenadas'] = {
+            'Latitud': float(fila['Latitud']),
+            'Longitud': float(fila['Longitud']),
+            'Altitud': fila['Altitud']
+        }
+    return metadata
+
+class Escritor_cubo:
+    """Escribe el cubo en disco estación por estación, junto con su índice de metadatos
+
+    El archivo .npy se crea con su tamaño final y cada estación se copia a su
+    fila, de modo que en memoria nunca hay más de una estación a la vez.
+    """
+
+    def __init__(self, carpeta, n_estaciones, año_inicial, año_final):
+        os.makedirs(carpeta, exist_ok=True)
+        self.carpeta = carpeta
+        self.año_inicial = int(año_inicial)
+        self.n_años = int(año_final) - self.año_inicial + 1
+        self.cubo = np.lib.format.open_memmap(
+            os.path.join(carpeta, ARCHIVO_CUBO), mode='w+',
+            dtype=np.float32, shape=(n_estaciones, self.n_años, 12)
+        )
+        self.cubo[:] = np.nan
+        self.estaciones = []
+        self.descartados = 0
+
+    def agregar(self, nombre, metadata, data_df, huella=''):
+        """Copia los datos mensuales de una estación a la siguiente fila libre; devuelve la fila"""
+        fila = len(self.estaciones)
+        años = data_df['Año'].to_numpy(dtype=int) - self.año_inicial
+        dentro = (años >= 0) & (años < self.n_años)
+        self.descartados += int((~dentro).sum())
+        self.cubo[fila, años[dentro], data_df['Mes_num'].to_numpy(dtype=int)[dentro] - 1] = (
+            data_df[Columna_valor(data_df)].to_numpy(dtype=np.float32)[dentro]
+        )
+        self.estaciones.append(Fila_indice(fila, nombre, metadata, data_df, huella))
+        return fila
+
+    def cerrar(self):
+        """Vacía el cubo a disco y escribe el índice (de forma atómica)"""
+        self.cubo.flush()
+        del self.cubo
+        indice = {
+            'año_inicial': self.año_inicial,
+            'n_años': self.n_años,
+            'n_estaciones': len(self.estaciones),
+            'estaciones': self.estaciones
+        }
+        ruta = os.path.join(self.carpeta, ARCHIVO_INDICE_CUBO)
+        with open(ruta + '.tmp', 'w', encoding='utf-8') as archivo:
+            json.dump(indice, archivo, ensure_ascii=False)
+        os.replace(ruta + '.tmp', ruta)
+
+def Escribir_cubo_disco(carpeta, estaciones, huellas=None):
+    """Escribe en disco el cubo de un diccionario {nombre: (metadata, data_df)}"""
+    estaciones = {n: e for n, e in estaciones.items() if not e[1].empty}
+    año_inicial = min(int(d['Año'].min()) for _, d in estaciones.values())
+    año_final = max(int(d['Año'].max()) for _, d in estaciones.values())
+    escritor = Escritor_cubo(carpeta, len(estaciones), año_inicial, año_final)
+    for nombre, (metadata, data_df) in estaciones.items():
+        escritor.agregar(nombre, metadata, data_df, (huellas or {}).get(nombre, ''))
+    escritor.cerrar()
+
+class Cubo_disco:
+    """Cubo de la red en disco abierto con memoria mapeada (sin copiarlo a memoria)
+
+    Solo se leen del disco las filas (estaciones) y años que se seleccionan;
+    el índice de metadatos permite filtrar por cuenca o departamento sin tocar
+    los datos.
+    """
+
+    def __init__(self, carpeta):
+        self.carpeta = carpeta
+        with open(os.path.join(carpeta, ARCHIVO_INDICE_CUBO), encoding='utf-8') as archivo:
+            info = json.load(archivo)
+        self.años = np.arange(info['año_inicial'], info['año_inicial'] + info['n_años'])
+        self.indice = pd.DataFrame(info['estaciones']).set_index('Estación', drop=False)
+        self.cubo = np.load(os.path.join(carpeta, ARCHIVO_CUBO), mmap_mode='r')[:info['n_estaciones']]
+        # Variable y metadatos se resuelven una vez por estación: el índice no cambia mientras el cubo está abierto
+        self.variables = pd.Series([Variable_metadata(fila) for _, fila in self.indice.iterrows()], index=self.indice.index)
+        self._metadatas = {}
+
+    def _años(self, años=None):
+        """Rebanada de años (contigua, sin copiar) para un rango (inicio, fin)"""
+        if años is None:
+            return slice(0, len(self.años))
+        inicio = int(np.clip(años[0] - self.años[0], 0, len(self.años)))
+        fin = int(np.clip(años[1] - self.años[0] + 1, inicio, len(self.años)))
+        return slice(inicio, fin)
+
+    def seleccionar(self, estaciones=None, años=None):
+        """(estaciones, años, cubo) en el formato de Cubo_estaciones con solo lo pedido"""
+        nombres = list(self.indice.index if estaciones is None else estaciones)
+        filas = self.indice.loc[nombres, 'Fila'].to_numpy()
+        rebanada = self._años(años)
+        return nombres, self.años[rebanada], self.cubo[filas, rebanada].astype(float)
+
+    def variable(self, nombre):
+        """Variable del registro guardada en la fila de una estación"""
+        return self.variables[nombre]
+
+    def datos_estacion(self, nombre, años=None):
+        """DataFrame mensual largo de una estación (mismo formato que Cargar_estacion)"""
+        fila = int(self.indice.at[nombre, 'Fila'])
+        rebanada = self._años(años)
+        valores = np.asarray(self.cubo[fila, rebanada])
+        i_año, i_mes = np.nonzero(~np.isnan(valores))
+        if len(i_año) == 0:
+            return pd.DataFrame()
+
+        meses = np.array(['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Set', 'Oct', 'Nov', 'Dic'])
+        año = self.años[rebanada][i_año]
+        return Reducir_memoria(pd.DataFrame({
+            'Año': año,
+            'Mes': meses[i_mes],
+            'Mes_num': i_mes + 1,
+            VARIABLES[self.variable(nombre)]['columna']: valores[i_año, i_mes],
+            'Fecha': pd.to_datetime({'year': año, 'month': i_mes + 1, 'day': 1})
+        }))
+
+    def metadata(self, nombre):
+        """Metadatos de una estación con la estructura de Extraer_Metadata (de solo lectura)"""
+        if nombre not in self._metadatas:
+            self._metadatas[nombre] = Metadata_desde_indice(self.indice.loc[nombre])
+        return self._metadatas[nombre]
+
+    def piramide(self, nombre, años=None):
+        """Pirámide de agregados de una estación directamente desde su fila del cubo"""
+        fila = self.indice.loc[nombre]
+        inicio, fin = int(fila['Año inicial']), int(fila['Año final'])
+        if años is not None:
+            inicio, fin = max(inicio, años[0]), min(fin, años[1])
+        if inicio > fin:
+            return None
+        rebanada = self._años((inicio, fin))
+        return Construir_piramide(
+            [None], self.años[rebanada], self.cubo[int(fila['Fila']), rebanada].astype(float)[None],
+            VARIABLES[self.variable(nombre)]['agregacion']
+        )
+
+    def huella(self, nombre, años=None):
+        """Identificador del contenido de una estación (y del rango de años leído)"""
+        return f"{self.indice.at[nombre, 'Huella']}:{self._años(años)}"
+
+def Estacion_cubo(cubo_disco, nombre, años, huella, cache):
+    """Metadatos y datos mensuales de una estación del cubo en disco, guardados en la caché compartida"""
+    return cubo_disco.metadata(nombre), cache.agregado(huella, 'Datos', cubo_disco.datos_estacion, nombre, años)
+
+@st.cache_resource(show_spinner=False)
+def Cubo_disco_compartido(carpeta):
+    """Cubo de la red abierto una sola vez por servidor (la memoria mapeada la comparten todas las sesiones)
+
+    Si la apertura falla se propaga la excepción: los errores no quedan en
+    caché y un cubo escrito o reparado después se abre en la siguiente ejecución.
+    """
+    return Cubo_disco(carpeta)
+
+def Seleccion_cubo_barra_lateral(cubo):
+    """Estaciones y rango de años de la red en disco elegidos en la barra lateral"""
+    indice = cubo.indice
+    with st.sidebar.expander("🗃️ RED NACIONAL", expanded=True):
+        cuencas = st.multiselect("CUENCAS", options=sorted(indice['Cuenca'].unique()), key='cubo_cuencas')
+        departamentos = st.multiselect("DEPARTAMENTOS", options=sorted(indice['Departamento'].unique()), key='cubo_departamentos')
+
+        mascara = np.ones(len(indice), dtype=bool)
+        if cuencas:
+            mascara &= indice['Cuenca'].isin(cuencas).to_numpy()
+        if departamentos:
+            mascara &= indice['Departamento'].isin(departamentos).to_numpy()
+        candidatas = list(indice.index[mascara])
+
+        if st.checkbox(f"Usar las {len(candidatas)} estaciones filtradas", key='cubo_todas'):
+            seleccion = candidatas
+        else:
+            seleccion = st.multiselect(
+                "ESTACIONES DE LA RED",
+                options=candidatas,
+                key='cubo_estaciones',
+                help=f"{len(candidatas)} de {len(indice)} estaciones en {cubo.carpeta}"
+            )
+
+        años = st.slider(
+            "AÑOS A LEER",
+            min_value=int(cubo.años[0]),
+            max_value=int(cubo.años[-1]),
+            value=(int(cubo.años[0]), int(cubo.años[-1])),
+            key='cubo_años'
+        )
+    return seleccion, años
+
+# --- ANÁLISIS REGIONAL ---
+
+def Totales_anuales_cubo(cubo, agregacion='sum'):
+    """Agregados anuales (estaciones × años) del cubo, solo para años con los 12 meses"""
+    completos = ~np.isnan(cubo).any(axis=2)
+    return np.where(completos, Agregar_valores(cubo, agregacion, axis=2), np.nan)
+
+def Matriz_distancias(coordenadas):
+    """Distancias en km entre estaciones (haversine) a partir de un arreglo [lat, lon]"""
+    lat, lon = np.radians(coordenadas[:, 0]), np.radians(coordenadas[:, 1])
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:, None]) * np.cos(lat[None, :]) * np.sin(dlon / 2) ** 2
+    return 2 * 6371.0 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def Pesos_vecinos(coordenadas, n_vecinos=None):
+    """Matriz de pesos para la serie de referencia: promedio de las demás estaciones o de las n más cercanas"""
+    k = len(coordenadas)
+    pesos = 1.0 - np.eye(k)
+
+    if n_vecinos and n_vecinos < k - 1 and not np.isnan(coordenadas).any():
+        distancias = Matriz_distancias(coordenadas)
+        np.fill_diagonal(distancias, np.inf)
+        cercanos = np.argsort(distancias, axis=1)[:, :n_vecinos]
+        pesos = np.zeros((k, k))
+        np.put_along_axis(pesos, cercanos, 1.0, axis=1)
+
+    return pesos
+
+def _Quiebre_pendiente(X, Y, n, largo_minimo=5):
+    """Ajuste de dos rectas con quiebre óptimo para cada columna (curvas compactadas con NaN al final)"""
+    N, k = X.shape
+    pos = np.arange(1, N + 1)[:, None]
+    valido = pos <= n
+    Xz, Yz = np.where(valido, X, 0.0), np.where(valido, Y, 0.0)
+
+    # Sumas prefijo: el ajuste de cualquier tramo sale en O(1)
+    c = {
+        'x': np.cumsum(Xz, axis=0), 'y': np.cumsum(Yz, axis=0),
+        'xx': np.cumsum(Xz * Xz, axis=0), 'xy': np.cumsum(Xz * Yz, axis=0),
+        'yy': np.cumsum(Yz * Yz, axis=0)
+    }
+    total = {clave: valor[np.maximum(n - 1, 0), np.arange(k)] for clave, valor in c.items()}
+
+    def ajuste(m, sx, sy, sxx, sxy, syy):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            vxx = sxx - sx ** 2 / m
+            vxy = sxy - sx * sy / m
+            vyy = syy - sy ** 2 / m
+            pendiente = vxy / vxx
+            return pendiente, np.maximum(vyy - pendiente * vxy, 0.0)
+
+    b1, rss1 = ajuste(pos, c['x'], c['y'], c['xx'], c['xy'], c['yy'])
+    b2, rss2 = ajuste(
+        n - pos,
+        total['x'] - c['x'], total['y'] - c['y'],
+        total['xx'] - c['xx'], total['xy'] - c['xy'], total['yy'] - c['yy']
+    )
+    b0, rss0 = ajuste(n, total['x'], total['y'], total['xx'], total['xy'], total['yy'])
+
+    candidato = (pos >= largo_minimo) & (n - pos >= largo_minimo)
+    rss = np.where(candidato, rss1 + rss2, np.inf)
+    t = np.argmin(rss, axis=0)
+    columnas = np.arange(k)
+    rss12 = rss[t, columnas]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        F = ((rss0 - rss12) / 2) / (rss12 / (n - 4))
+    p = stats.f.sf(F, 2, n - 4)
+    sin_quiebre = ~np.isfinite(rss12)
+
+    return {
+        'pendiente': b0,
+        'pendiente_antes': np.where(sin_quiebre, np.nan, b1[t, columnas]),
+        'pendiente_despues': np.where(sin_quiebre, np.nan, b2[t, columnas]),
+        'posicion': np.where(sin_quiebre, -1, t + 1),
+        'p': np.where(sin_quiebre, np.nan, p)
+    }
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Analisis_doble_masa(cubo_regional, coordenadas, n_vecinos=None, largo_minimo=5, alfa=0.05, tolerancia=0.1):
+    """Curvas de doble masa de cada estación contra la media de sus vecinas, con detección de quiebres"""
+    estaciones, años, cubo = cubo_regional
+    if len(estaciones) < 2:
+        return None
+
+    anual = Totales_anuales_cubo(cubo)
+    valido = ~np.isnan(anual)
+    pesos = Pesos_vecinos(np.array([coordenadas.get(e, (np.nan, np.nan)) for e in estaciones], dtype=float), n_vecinos)
+
+    # Referencia por estación y año: promedio ponderado solo de las vecinas con dato
+    with np.errstate(invalid='ignore', divide='ignore'):
+        referencia = (pesos @ np.where(valido, anual, 0.0)) / (pesos @ valido)
+    usar = valido & np.isfinite(referencia)
+
+    # Curvas acumuladas: filas = años, columnas = estaciones, compactadas sin huecos
+    estacion_acum = np.cumsum(np.where(usar, anual, 0.0), axis=1).T
+    referencia_acum = np.cumsum(np.where(usar, referencia, 0.0), axis=1).T
+    Y, n, orden = _Compactar_columnas(np.where(usar.T, estacion_acum, np.nan))
+    X = np.take_along_axis(np.where(usar.T, referencia_acum, np.nan), orden, axis=0)
+
+    quiebre = _Quiebre_pendiente(X, Y, n, largo_minimo)
+    columnas = np.arange(len(estaciones))
+    posicion = quiebre['posicion']
+    año_quiebre = np.where(posicion >= 0, años[orden[np.clip(posicion, 0, len(años) - 1), columnas]], -1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        razon = quiebre['pendiente_despues'] / quiebre['pendiente_antes']
+    significativo = (quiebre['p'] < alfa) & (np.abs(razon - 1) >= tolerancia)
+
+    resumen = pd.DataFrame({
+        'Estación': estaciones,
+        'Años comparados': n,
+        'Pendiente global': quiebre['pendiente'],
+        'Año de quiebre': pd.Series(año_quiebre, dtype='Int64').where(posicion >= 0),
+        'Pendiente antes': quiebre['pendiente_antes'],
+        'Pendiente después': quiebre['pendiente_despues'],
+        'Razón de pendientes': razon,
+        'p': quiebre['p'],
+        'Quiebre significativo': significativo
+    })
+
+    curvas = pd.DataFrame({
+        'Estación': np.repeat(estaciones, len(años)),
+        'Año': np.tile(años, len(estaciones)),
+        'Acumulado estación': np.where(usar, estacion_acum.T, np.nan).ravel(),
+        'Acumulado referencia': np.where(usar, referencia_acum.T, np.nan).ravel()
+    }).dropna()
+
+    return {'resumen': resumen, 'curvas': curvas}
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Estadisticos_estaciones(piramide, unidad='mm'):
+    """Promedio anual, pendiente de tendencia y completitud de cada estación a partir de su pirámide de agregados"""
+    if not piramide:
+        return pd.DataFrame()
+
+    estaciones, años, cubo = piramide['Series'], piramide['Años'], piramide['Mensual']
+    anual = piramide['Anual']
+    valido = ~np.isnan(anual)
+    n = valido.sum(axis=1)
+
+    # Regresión lineal por estación ignorando los años incompletos
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_media = (valido * años).sum(axis=1) / n
+        y_media = np.nansum(anual, axis=1) / n
+        dx = np.where(valido, años - x_media[:, None], 0.0)
+        dy = np.where(valido, anual - y_media[:, None], 0.0)
+        pendiente = np.where(n >= 3, (dx * dy).sum(axis=1) / (dx ** 2).sum(axis=1), np.nan)
+
+    # Completitud dentro del período de registro de cada estación
+    con_dato = ~np.isnan(cubo).all(axis=2)
+    primero = np.argmax(con_dato, axis=1)
+    ultimo = len(años) - 1 - np.argmax(con_dato[:, ::-1], axis=1)
+    meses_posibles = 12 * (ultimo - primero + 1)
+    completitud = (~np.isnan(cubo)).sum(axis=(1, 2)) / meses_posibles
+
+    return pd.DataFrame({
+        'Estación': estaciones,
+        f'Promedio anual ({unidad})': y_media,
+        f'Tendencia ({unidad}/año)': pendiente,
+        'Completitud': completitud,
+        'Años completos': n
+    })
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def Mapa_cuenca_html(puntos, estadistico, agrupar=False):
+    """HTML de un mapa folium con todas las estaciones en una sola capa coloreada por un estadístico"""
+    puntos = [p for p in puntos if np.isfinite(p[1]) and np.isfinite(p[2])]
+    if not puntos:
+        return None
+
+    latitudes = [p[1] for p in puntos]
+    longitudes = [p[2] for p in puntos]
+    valores = np.array([p[3] for p in puntos], dtype=float)
+    finitos = valores[np.isfinite(valores)]
+    vmin, vmax = (finitos.min(), finitos.max()) if len(finitos) else (0.0, 1.0)
+    if vmin == vmax:
+        vmax = vmin + 1.0
+
+    # Tendencias y cargas EOF tienen signo: escala divergente centrada en cero
+    divergente = estadistico.startswith('Tendencia') or estadistico.startswith('Carga EOF')
+    if divergente:
+        vmax = max(abs(vmin), abs(vmax))
+        vmin = -vmax
+
+    if estadistico == 'Grupo':
+        # Grupos de regionalización: un color cualitativo por grupo
+        n_grupos = int(vmax)
+        colores = px.colors.qualitative.Plotly
+        colormap = folium.StepColormap(
+            colors=[colores[i % len(colores)] for i in range(n_grupos)],
+            index=list(np.arange(1, n_grupos + 2) - 0.5),
+            vmin=0.5,
+            vmax=n_grupos + 0.5,
+            caption=estadistico
+        )
+    else:
+        colormap = folium.LinearColormap(
+            colors=['#b2182b', '#f7f7f7', '#2166ac'] if divergente else ['#d73027', '#fee08b', '#1a9850'],
+            vmin=vmin,
+            vmax=vmax,
+            caption=estadistico
+        )
+
+    def color(valor):
+        return colormap(valor)[:7] if np.isfinite(valor) else '#9e9e9e'
+
+    m = folium.Map(tiles="OpenStreetMap", width="100%")
+    m.fit_bounds([[min(latitudes), min(longitudes)], [max(latitudes), max(longitudes)]])
+
+    if agrupar:
+        # Un solo cluster; los marcadores se crean en el navegador desde un arreglo compacto.
+        # El tooltip se inserta como HTML: los nombres de estación se escapan
+        datos = [
+            [
+                lat, lon, color(valor),
+                f"<b>{html.escape(str(nombre))}</b><br>{html.escape(estadistico)}: "
+                f"{f'{valor:.2f}' if np.isfinite(valor) else '--'}"
+            ]
+            for (nombre, lat, lon, valor) in puntos
+        ]
+        callback = """
+        function (row) {
+            var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+                radius: 7, color: '#1e3d6b', weight: 1, fillColor: row[2], fillOpacity: 0.85
+            });
+            marker.bindTooltip(row[3]);
+            return marker;
+        };
+        """
+        FastMarkerCluster(datos, callback=callback, name='Estaciones').add_to(m)
+    else:
+        features = [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                'properties': {
+                    'Estación': html.escape(str(nombre)),
+                    'Valor': round(float(valor), 2) if np.isfinite(valor) else None,
+                    'color': color(valor)
+                }
+            }
+            for (nombre, lat, lon, valor) in puntos
+        ]
+        folium.GeoJson(
+            {'type': 'FeatureCollection', 'features': features},
+            name='Estaciones',
+            marker=folium.CircleMarker(radius=7, fill=True),
+            style_function=lambda feature: {
+                'fillColor': feature['properties']['color'],
+                'color': '#1e3d6b',
+                'weight': 1,
+                'fillOpacity': 0.85
+            },
+            tooltip=folium.GeoJsonTooltip(fields=['Estación', 'Valor'], aliases=['Estación', html.escape(estadistico)])
+        ).add_to(m)
+
+    colormap.add_to(m)
+    return m.get_root().render()
+
+# --- MODOS DE VARIABILIDAD (EOF) ---
+
+def _SVD_truncada(X, k, n_iter=4, sobremuestreo=10, semilla=0):
+    """Primeros k valores y vectores singulares; aleatorizada (Halko et al.) si la matriz es grande"""
+    if min(X.shape) <= max(200, k + sobremuestreo):
+        U, s, Vt = np.linalg.svd(X, full_matrices=False)
+        return U[:, :k], s[:k], Vt[:k]
+
+    rng = np.random.default_rng(semilla)
+    Q = np.linalg.qr(X @ rng.standard_normal((X.shape[1], k + sobremuestreo)))[0]
+    # Iteraciones de potencia para separar los valores singulares dominantes
+    for _ in range(n_iter):
+        Q = np.linalg.qr(X.T @ Q)[0]
+        Q = np.linalg.qr(X @ Q)[0]
+    Ub, s, Vt = np.linalg.svd(Q.T @ X, full_matrices=False)
+    return (Q @ Ub)[:, :k], s[:k], Vt[:k]
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Analisis_EOF(cubo_regional, inicio=None, fin=None, n_modos=3, estandarizar=True, cobertura_minima=0.5):
+    """Funciones ortogonales empíricas de las anomalías mensuales de todas las estaciones
+
+    Las anomalías se calculan respecto al período base [inicio, fin] (todo el
+    registro si no se indica). Solo se usan los meses con dato en al menos
+    cobertura_minima de las estaciones; los faltantes restantes se toman
+    como anomalía nula.
+    """
+    estaciones, años, cubo = cubo_regional
+    if len(estaciones) < 3:
+        return None
+
+    base = None
+    if inicio is not None and fin is not None:
+        base = (años >= inicio) & (años <= fin)
+    anomalias = Anomalias_mensuales_cubo(cubo, base, estandarizar)
+
+    # Matriz tiempo × estaciones
+    X = anomalias.T
+    cobertura = (~np.isnan(X)).mean(axis=1)
+    usar = cobertura >= cobertura_minima
+    X = np.nan_to_num(X[usar])
+    n_modos = min(n_modos, *X.shape)
+    if n_modos < 1 or len(X) < 24:
+        return None
+
+    U, s, Vt = _SVD_truncada(X, n_modos)
+    varianza = s ** 2 / (X ** 2).sum()
+
+    # Signo: carga media positiva; cargas en unidades de la serie y PCs con varianza unitaria
+    signo = np.where(Vt.sum(axis=1) < 0, -1.0, 1.0)
+    cargas = (Vt * signo[:, None]).T * s / np.sqrt(len(X) - 1)
+    componentes = U * signo * np.sqrt(len(X) - 1)
+
+    meses = np.flatnonzero(usar)
+    nombres = [f'EOF {i + 1}' for i in range(n_modos)]
+    tabla_cargas = pd.DataFrame(cargas, columns=nombres).assign(Estación=estaciones)
+    tabla_componentes = pd.DataFrame(componentes, columns=nombres)
+    tabla_componentes.insert(0, 'Fecha', pd.to_datetime({
+        'year': años[meses // 12],
+        'month': meses % 12 + 1,
+        'day': 1
+    }))
+
+    return {
+        'cargas': tabla_cargas[['Estación'] + nombres],
+        'componentes': tabla_componentes,
+        'varianza': varianza,
+        'meses': len(X),
+        'estandarizado': estandarizar
+    }
+
+# --- REGIONALIZACIÓN ---
+
+def Caracteristicas_regimen(cubo):
+    """Vector de características por estación: climatología mensual relativa y métricas de variabilidad
+
+    La climatología es la media de cada mes (la columna 'Promedio' de
+    Calcular_estadisticas_Mensuales) calculada para todas las estaciones a la vez.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        climatologia = np.nanmean(cubo, axis=1)
+        total = climatologia.sum(axis=1)
+        fracciones = climatologia / total[:, None]
+
+        anual = Totales_anuales_cubo(cubo)
+        cv = np.nanstd(anual, axis=1, ddof=1) / np.nanmean(anual, axis=1)
+        si = np.abs(fracciones - 1 / 12).sum(axis=1)
+
+    escalares = np.column_stack([np.log1p(np.maximum(total, 0)), cv, si])
+    return climatologia, fracciones, escalares
+
+def Clasificar_regimen(climatologia, umbral_arido=250.0):
+    """Régimen pluviométrico de una climatología de 12 meses: árido, unimodal o bimodal"""
+    total = climatologia.sum()
+    if total < umbral_arido:
+        return 'Árido'
+
+    # Picos circulares por encima del reparto uniforme, sobre la climatología suavizada
+    suavizada = (np.roll(climatologia, 1) + 2 * climatologia + np.roll(climatologia, -1)) / 4
+    picos = (
+        (suavizada > np.roll(suavizada, 1)) &
+        (suavizada >= np.roll(suavizada, -1)) &
+        (suavizada > total / 12)
+    )
+    return 'Bimodal' if picos.sum() >= 2 else 'Unimodal'
+
+def _Kmedias(X, k, semilla=0, n_inicios=5, max_iter=100):
+    """K-medias (Lloyd) vectorizado con inicialización k-means++; devuelve la mejor de n_inicios"""
+    rng = np.random.default_rng(semilla)
+    normas = (X ** 2).sum(axis=1)
+    mejor = (np.inf, None)
+
+    for _ in range(n_inicios):
+        centros = X[[rng.integers(len(X))]]
+        for _ in range(1, k):
+            d2 = np.min(normas[:, None] - 2 * X @ centros.T + (centros ** 2).sum(axis=1), axis=1).clip(0)
+            probabilidad = d2 / d2.sum() if d2.sum() > 0 else np.full(len(X), 1 / len(X))
+            centros = np.vstack([centros, X[rng.choice(len(X), p=probabilidad)]])
+
+        etiquetas = np.full(len(X), -1)
+        for _ in range(max_iter):
+            d2 = normas[:, None] - 2 * X @ centros.T + (centros ** 2).sum(axis=1)
+            nuevas = np.argmin(d2, axis=1)
+            if np.array_equal(nuevas, etiquetas):
+                break
+            etiquetas = nuevas
+            # Centros como promedio de sus miembros (los grupos vacíos conservan su centro)
+            conteo = np.bincount(etiquetas, minlength=k)
+            sumas = np.zeros_like(centros)
+            np.add.at(sumas, etiquetas, X)
+            centros = np.where(conteo[:, None] > 0, sumas / np.maximum(conteo, 1)[:, None], centros)
+
+        inercia = d2[np.arange(len(X)), etiquetas].sum()
+        if inercia < mejor[0]:
+            mejor = (inercia, etiquetas)
+
+    return mejor[1]
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Regionalizar_estaciones(cubo_regional, n_grupos=3, metodo='kmeans', semilla=0):
+    """Agrupa las estaciones por régimen pluviométrico (k-medias o jerárquico de Ward)"""
+    estaciones, años, cubo = cubo_regional
+    climatologia, fracciones, escalares = Caracteristicas_regimen(cubo)
+    validas = np.isfinite(fracciones).all(axis=1) & np.isfinite(escalares).all(axis=1)
+    n_grupos = min(n_grupos, int(validas.sum()))
+    if n_grupos < 2:
+        return None
+
+    # Se estandariza cada característica y se da el mismo peso a la forma del régimen y a las escalares
+    X = np.hstack([fracciones, escalares])[validas]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        X = np.nan_to_num((X - X.mean(axis=0)) / X.std(axis=0))
+    X[:, :12] /= np.sqrt(12)
+    X[:, 12:] /= np.sqrt(escalares.shape[1])
+
+    if metodo == 'jerarquico':
+        etiquetas = hierarchy.fcluster(hierarchy.linkage(X, method='ward'), n_grupos, criterion='maxclust') - 1
+    else:
+        etiquetas = _Kmedias(X, n_grupos, semilla)
+
+    # Grupos numerados de mayor a menor precipitación media
+    medias = climatologia[validas]
+    totales = np.array([medias[etiquetas == g].sum(axis=1).mean() if (etiquetas == g).any() else -np.inf for g in range(n_grupos)])
+    rango = np.empty(n_grupos, dtype=int)
+    rango[np.argsort(-totales)] = np.arange(n_grupos)
+    etiquetas = rango[etiquetas]
+
+    regimenes = pd.DataFrame(
+        [medias[etiquetas == g].mean(axis=0) for g in range(n_grupos)],
+        columns=range(1, 13)
+    )
+    regimenes.index = pd.RangeIndex(1, n_grupos + 1, name='Grupo')
+
+    grupo = np.zeros(len(estaciones), dtype=int)
+    grupo[validas] = etiquetas + 1
+    asignacion = pd.DataFrame({
+        'Estación': estaciones,
+        'Grupo': pd.Series(grupo, dtype='Int64').where(validas),
+        'Promedio anual (mm)': climatologia.sum(axis=1),
+        'Coef. variación anual': escalares[:, 1],
+        'Índice de estacionalidad': escalares[:, 2]
+    })
+    asignacion['Régimen'] = asignacion['Grupo'].map(
+        {g: Clasificar_regimen(regimenes.loc[g].to_numpy()) for g in regimenes.index}
+    )
+
+    return {'asignacion': asignacion, 'regimenes': regimenes, 'climatologias': pd.DataFrame(climatologia, columns=range(1, 13), index=estaciones)}
+
+# --- CALIDAD DE DATOS ---
+
+def Marcar_calidad(data_df, metodo='iqr', umbral_z=3.0, factor_iqr=3.0, umbral_maximo=None):
+    """Agrega a cada registro mensual las banderas de duplicado, negativo, implausible y atípico
+
+    Negativo e implausible son los valores fuera del rango físico de la variable
+    (0–1500 mm en precipitación); umbral_maximo reemplaza el límite superior.
+    """
+    if data_df.empty:
+        return data_df.assign(Duplicado=False, Negativo=False, Implausible=False, Atípico=False)
+
+    minimo, maximo = VARIABLES[Variable_datos(data_df)]['rango']
+    claves = ['Estación'] if 'Estación' in data_df.columns else []
+    valores = data_df[Columna_valor(data_df)]
+    por_mes = valores.groupby([data_df[c] for c in claves + ['Mes_num']])
+
+    # Los atípicos se evalúan contra la distribución del mismo mes en la misma estación
+    if metodo == 'zscore':
+        z = (valores - por_mes.transform('mean')) / por_mes.transform('std')
+        atipico = z.abs() > umbral_z
+    else:
+        q1 = por_mes.transform('quantile', 0.25)
+        q3 = por_mes.transform('quantile', 0.75)
+        iqr = q3 - q1
+        atipico = (valores < q1 - factor_iqr * iqr) | (valores > q3 + factor_iqr * iqr)
+
+    return data_df.assign(
+        Duplicado=data_df.duplicated(claves + ['Año', 'Mes_num'], keep=False),
+        Negativo=valores < minimo,
+        Implausible=valores > (maximo if umbral_maximo is None else umbral_maximo),
+        Atípico=atipico.fillna(False)
+    )
+
+def _Racha_maxima(mascara):
+    """Longitud de la racha más larga de valores True a lo largo del último eje"""
+    indices = np.arange(mascara.shape[-1])
+    ultimo_falso = np.maximum.accumulate(np.where(mascara, -1, indices), axis=-1)
+    return (indices - ultimo_falso).max(axis=-1)
+
+def Marcar_calidad_cubo(cubo, variable=VARIABLE_PREDETERMINADA, metodo='iqr', umbral_z=3.0, factor_iqr=3.0, umbral_maximo=None):
+    """Banderas de negativo, implausible y atípico (estaciones × años × 12) con los criterios de Marcar_calidad"""
+    minimo, maximo = VARIABLES[variable]['rango']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if metodo == 'zscore':
+            z = (cubo - np.nanmean(cubo, axis=1, keepdims=True)) / np.nanstd(cubo, axis=1, ddof=1, keepdims=True)
+            atipico = np.abs(z) > umbral_z
+        else:
+            q1, q3 = np.nanquantile(cubo, [0.25, 0.75], axis=1, keepdims=True)
+            iqr = q3 - q1
+            atipico = (cubo < q1 - factor_iqr * iqr) | (cubo > q3 + factor_iqr * iqr)
+        return {
+            'Negativos': cubo < minimo,
+            'Implausibles': cubo > (maximo if umbral_maximo is None else umbral_maximo),
+            'Atípicos': atipico
+        }
+
+def Duplicados_estaciones(estaciones):
+    """Meses repetidos por estación y año en los archivos cargados (el cubo guarda un solo valor por mes)"""
+    claves = ['Estación', 'Año', 'Mes_num']
+    combinado = Combinar_estaciones(estaciones)
+    if combinado.empty:
+        combinado = pd.DataFrame(columns=claves)
+    repetidos = combinado.loc[combinado.duplicated(claves, keep=False), claves]
+    return repetidos.groupby(['Estación', 'Año']).size().rename('Duplicados')
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Matriz_calidad(cubo_regional, variable=VARIABLE_PREDETERMINADA, metodo='iqr', umbral_maximo=None, duplicados=None):
+    """Completitud, rachas de faltantes y banderas de calidad por estación y año
+
+    duplicados es el conteo de Duplicados_estaciones para los archivos cargados.
+    """
+    estaciones, años, cubo = cubo_regional
+    if not len(estaciones):
+        return pd.DataFrame()
+
+    faltante = np.isnan(cubo)
+    calidad = pd.DataFrame({
+        'Estación': np.repeat(estaciones, len(años)),
+        'Año': np.tile(años, len(estaciones)),
+        'Meses con datos': (~faltante).sum(axis=2).ravel(),
+        'Racha faltante máxima': _Racha_maxima(faltante).ravel()
+    })
+    calidad['Completitud'] = calidad['Meses con datos'] / 12
+    calidad['Duplicados'] = 0 if duplicados is None else calidad.join(duplicados, on=['Estación', 'Año'])['Duplicados'].fillna(0).astype(int)
+    for bandera, mascara in Marcar_calidad_cubo(cubo, variable, metodo, umbral_maximo=umbral_maximo).items():
+        calidad[bandera] = mascara.sum(axis=2).ravel()
+    columnas_banderas = ['Duplicados', 'Negativos', 'Implausibles', 'Atípicos']
+
+    # Solo se reportan los años dentro del período de registro de cada estación
+    con_datos = ~faltante.all(axis=2)
+    posicion = np.arange(len(años))
+    primero = con_datos.argmax(axis=1)[:, None]
+    ultimo = len(años) - 1 - con_datos[:, ::-1].argmax(axis=1)[:, None]
+    calidad = calidad[((posicion >= primero) & (posicion <= ultimo) & con_datos.any(axis=1)[:, None]).ravel()]
+
+    columnas = ['Estación', 'Año', 'Meses con datos', 'Completitud', 'Racha faltante máxima'] + columnas_banderas
+    return calidad[columnas].reset_index(drop=True)
+
+# --- CORRELACIÓN ENTRE ESTACIONES ---
+
+def Anomalias_mensuales_cubo(cubo, base=None, estandarizar=False):
+    """Anomalías mensuales (estaciones × meses) respecto a la media de cada mes en cada estación
+
+    base es una máscara booleana sobre el eje de años con el período de referencia;
+    si una estación no tiene datos en ese período se usa su registro completo.
+    """
+    with np.errstate(invalid='ignore'):
+        media = np.nanmean(cubo, axis=1, keepdims=True)
+        desviacion = np.nanstd(cubo, axis=1, ddof=1, keepdims=True)
+        if base is not None and base.any():
+            referencia = cubo[:, base]
+            media = np.where(np.isnan(referencia).all(axis=1, keepdims=True), media, np.nanmean(referencia, axis=1, keepdims=True))
+            desviacion = np.where(
+                (~np.isnan(referencia)).sum(axis=1, keepdims=True) < 2,
+                desviacion,
+                np.nanstd(referencia, axis=1, ddof=1, keepdims=True)
+            )
+
+    anomalias = cubo - media
+    if estandarizar:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            anomalias = np.where(desviacion > 0, anomalias / desviacion, 0.0)
+    return anomalias.reshape(len(cubo), -1)
+
+def _Rangos_con_faltantes(A):
+    """Rangos promedio por fila ignorando los NaN (los faltantes quedan como NaN)"""
+    rangos = pd.DataFrame(A.T).rank(method='average').to_numpy().T
+    return np.where(np.isnan(A), np.nan, rangos)
+
+def Correlacion_enmascarada(A, minimo_comun=24):
+    """Correlación de Pearson entre filas usando solo los meses comunes de cada par
+
+    Todas las sumas por par salen de un único producto matricial entre las
+    series (con ceros en los faltantes), sus cuadrados y la máscara de datos.
+    """
+    A = np.asarray(A, dtype=float)
+    k = len(A)
+    M = (~np.isnan(A)).astype(float)
+    Z = np.where(M > 0, A, 0.0)
+
+    productos = np.vstack([Z, Z * Z, M]) @ np.vstack([Z, M]).T
+    sxy, sx = productos[:k, :k], productos[:k, k:]
+    sxx = productos[k:2 * k, k:]
+    n = productos[2 * k:, k:]
+
+    # sx[i, j]: suma de la fila i en los meses comunes con la fila j
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sxy - sx * sx.T / n
+        var_i = sxx - sx ** 2 / n
+        var_j = var_i.T
+        r = cov / np.sqrt(var_i * var_j)
+
+    r = np.where(n >= minimo_comun, np.clip(r, -1, 1), np.nan)
+    return r, n.round().astype(int)
+
+@st.cache_data(show_spinner=False, max_entries=MAX_ENTRADAS_CACHE)
+def Correlacion_estaciones(cubo_regional, metodo='pearson', minimo_comun=24):
+    """Matriz de correlación de anomalías mensuales entre estaciones, con meses en común por par"""
+    estaciones, años, cubo = cubo_regional
+    if len(estaciones) < 2:
+        return None
+
+    anomalias = Anomalias_mensuales_cubo(cubo)
+    if metodo == 'spearman':
+        # Rangos sobre el registro completo de cada estación, no re-rankeados por par
+        anomalias = _Rangos_con_faltantes(anomalias)
+
+    r, n = Correlacion_enmascarada(anomalias, minimo_comun)
+
+    # Orden por agrupamiento jerárquico (distancia 1 - r) para el heatmap
+    orden = np.arange(len(estaciones))
+    if len(estaciones) > 2:
+        distancia = np.where(np.isfinite(r), 1 - r, 2.0)
+        distancia = (distancia + distancia.T) / 2
+        np.fill_diagonal(distancia, 0.0)
+        enlace = hierarchy.linkage(distancia[np.triu_indices(len(estaciones), 1)], method='average')
+        orden = hierarchy.leaves_list(enlace)
+
+    return {
+        'estaciones': [estaciones[i] for i in orden],
+        'r': r[np.ix_(orden, orden)],
+        'n': n[np.ix_(orden, orden)],
+        'metodo': metodo
+    }
+
+# --- EXPORTACIÓN ---
+
+def Para_exportar(df):
+    """Columnas float32 en doble precisión y redondeadas, para no exportar decimales espurios"""
+    columnas = df.select_dtypes('float32').columns
+    return df.astype({c: 'float64' for c in columnas}).round({c: 3 for c in columnas})
+
+def Generar_reporte_excel(filtered_df, period_df, metadata):
+    """Libro Excel con los datos filtrados, las estadísticas y los metadatos"""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        Para_exportar(filtered_df).to_excel(writer, sheet_name='Datos', index=False)
+        
+        if not filtered_df.empty:
+            monthly_stats = Para_exportar(Calcular_estadisticas_Mensuales(filtered_df))
+            annual_stats = Para_exportar(Calcular_estadisticas_anuales(period_df))
+            
+            writer.book.create_sheet('Estadísticas')
+            writer.sheets['Estadísticas'] = writer.book['Estadísticas']
+            
+            monthly_stats.to_excel(
+                writer, 
+                sheet_name='Estadísticas', 
+                startrow=0, 
+                index=False
+            )
+            
+            annual_stats.to_excel(
+                writer, 
+                sheet_name='Estadísticas', 
+                startrow=len(monthly_stats)+3, 
+                index=False
+            )
+        
+        metadata_list = []
+        for key, value in metadata.items():
+            if isinstance(value, dict):
+                metadata_list.append({"Clave": key, "Valor": ""})
+                for k, v in value.items():
+                    metadata_list.append({"Clave": f"  {k}", "Valor": v})
+            else:
+                metadata_list.append({"Clave": key, "Valor": value})
+        
+        pd.DataFrame(metadata_list).to_excel(
+            writer, 
+            sheet_name='Metadatos', 
+            index=False
+        )
+    
+    return output.getvalue()
+
+# Estilos del reporte HTML: se incluyen una sola vez por archivo
+ESTILOS_REPORTE = """
+body { font-family: Arial, sans-serif; color: #333333; margin: 0 auto; max-width: 1200px; padding: 20px; background: #f5f7fa; }
+h1 { color: #1e3d6b; border-bottom: 4px solid #00bfa5; padding-bottom: 8px; }
+h2 { color: #1e3d6b; margin-top: 40px; }
+table { border-collapse: collapse; margin: 10px 0; font-size: 13px; background: white; }
+th, td { border: 1px solid #dddddd; padding: 4px 8px; text-align: right; }
+th { background: #1e3d6b; color: white; }
+.figura { background: white; border-radius: 10px; margin: 15px 0; min-height: 450px; }
+.interpret-card { background: white; border-radius: 10px; padding: 15px; margin: 15px 0; border-left: 4px solid #1a5bb7; }
+.interpret-title { color: #1a5bb7; font-weight: bold; font-size: 18px; margin-bottom: 10px; }
+.key-term { font-weight: bold; color: #1a5bb7; background-color: rgba(26, 91, 183, 0.1); padding: 2px 5px; border-radius: 3px; }
+.divider { height: 1px; background: #e0e0e0; margin: 12px 0; }
+.highlight-tip { background: #f0f7ff; padding: 10px; border-radius: 5px; margin: 10px 0; border-left: 3px solid #1a5bb7; }
+"""
+
+@functools.lru_cache(maxsize=1)
+def _Plotly_js():
+    """Biblioteca plotly.js completa (se lee una vez por proceso)"""
+    return get_plotlyjs()
+
+def _Figura_json(fig, plantillas):
+    """JSON compacto de una figura sin su plantilla de estilo, que se guarda aparte una sola vez"""
+    figura = json.loads(fig.to_json())
+    plantilla = figura.get('layout', {}).pop('template', None)
+    clave = None
+    if plantilla is not None:
+        texto = json.dumps(plantilla, separators=(',', ':'))
+        clave = hashlib.sha1(texto.encode('utf-8')).hexdigest()[:10]
+        plantillas.setdefault(clave, texto)
+    return json.dumps(figura, separators=(',', ':')), clave
+
+def _Tabla_html(df):
+    """Tabla HTML de un DataFrame con los valores redondeados como en la exportación"""
+    return Para_exportar(df).to_html(index=False, na_rep='--', border=0)
+
+def Generar_reporte_html(nombre, metadata, filtered_df, periodo='Año calendario (Ene–Dic)'):
+    """Reporte HTML autocontenido de una estación: metadatos, gráficos, tablas e interpretación
+
+    Los gráficos van como JSON de Plotly; la biblioteca plotly.js, los estilos y
+    las plantillas de los gráficos se incluyen una sola vez en el archivo.
+    """
+    period_df = Aplicar_periodo(filtered_df, periodo)
+    var = Descripcion_variable(filtered_df)
+    annual = period_df.groupby('Año')[var['columna']].agg(Agregacion_anual(period_df))
+    ultimo_año = int(filtered_df['Año'].max())
+
+    secciones = [
+        ('distribucion_mensual', Grafica_distribucion_mensual(filtered_df, metadata), {}),
+        ('mapa_calor', Mapa_calor_mensual(filtered_df, metadata), {}),
+        ('violin', Grafico_violin_mensual(filtered_df, metadata), {}),
+        ('tendencia', Grafico_tendencia_anual(period_df, metadata), {}),
+        ('acumulado', Grafico_precipitacion_anual(period_df, metadata), {}),
+        ('comparacion', Grafica_comparacion_mensual(filtered_df, metadata, [ultimo_año]), {}),
+        ('anomalias', Grafica_anomalia_anual(period_df, metadata), {'avg_precip': annual.mean(), 'std_dev': annual.std(), 'unidad': var['unidad']}),
+        ('dispersion_anual', Grafica_dispercion_anual(period_df, metadata), {})
+    ]
+    if Agregacion_anual(filtered_df) != 'sum':
+        secciones = [seccion for seccion in secciones if seccion[0] != 'acumulado']
+
+    plantillas = {}
+    figuras = []
+    cuerpo = []
+    for i, (clave, fig, valores) in enumerate(secciones):
+        titulo, contenido, icono = Interpretacion(clave, var['nombre'], **valores)
+        figura, plantilla = _Figura_json(fig, plantillas)
+        figuras.append(f'{{"id":"fig{i}","plantilla":{json.dumps(plantilla)},"figura":{figura}}}')
+        cuerpo.append(
+            f'<h2>{html.escape(titulo)}</h2>\n<div class="figura" id="fig{i}"></div>\n'
+            f'<div class="interpret-card"><div class="interpret-title">{icono} {html.escape(titulo)}</div>'
+            f'<div class="interpret-content">{contenido}</div></div>'
+        )
+
+    ambito = metadata.get('Ámbito Político')
+    coordenadas = metadata.get('Coordenadas')
+    filas_metadata = {
+        'Estación': metadata.get('Estación', nombre),
+        'Variable': metadata.get('Variable', ''),
+        'Cuenca': metadata.get('Cuenca', ''),
+        'Ámbito político': ' / '.join(ambito.values()) if isinstance(ambito, dict) else (ambito or ''),
+        'Coordenadas': (
+            f"{coordenadas['Latitud']}, {coordenadas['Longitud']} ({coordenadas['Altitud']})"
+            if isinstance(coordenadas, dict) else ''
+        ),
+        'Período de registro': f"{int(filtered_df['Año'].min())} – {ultimo_año}",
+        'Agregación anual': periodo
+    }
+    tabla_metadata = ''.join(
+        f'<tr><th>{html.escape(k)}</th><td style="text-align:left">{html.escape(str(v))}</td></tr>'
+        for k, v in filas_metadata.items()
+    )
+
+    # '</' se escapa para que ningún texto de los datos cierre el bloque <script>
+    datos_js = (
+        'const PLANTILLAS={' + ','.join(f'"{k}":{v}' for k, v in plantillas.items()) + '};\n'
+        'const FIGURAS=[' + ',\n'.join(figuras) + '];'
+    ).replace('</', '<\\/')
+
+    return f"""<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="utf-8">
+<title>Reporte de {var['nombre']} - {html.escape(str(filas_metadata['Estación']))}</title>
+<style>{ESTILOS_REPORTE}</style>
+<script>{_Plotly_js()}</script>
+</head>
+<body>
+<h1>🌧️ Reporte de {var['nombre']} - {html.escape(str(filas_metadata['Estación']))}</h1>
+<table>{tabla_metadata}</table>
+{''.join(cuerpo)}
+<h2>Estadísticas Mensuales</h2>
+{_Tabla_html(Calcular_estadisticas_Mensuales(filtered_df))}
+<h2>Estadísticas Anuales</h2>
+{_Tabla_html(Calcular_estadisticas_anuales(period_df))}
+<h2>Estadísticas Estacionales</h2>
+{_Tabla_html(Calcular_estadisticas_estacionales(filtered_df))}
+<script>
+{datos_js}
+for (const f of FIGURAS) {{
+    if (f.plantilla) f.figura.layout.template = PLANTILLAS[f.plantilla];
+    Plotly.newPlot(f.id, f.figura.data, f.figura.layout, {{responsive: true}});
+}}
+</script>
+</body>
+</html>
+"""
+
+def _Reporte_html_estacion(nombre, metadata, data_df, periodo):
+    """Reporte de una estación en bytes (tarea independiente para los procesos de trabajo)"""
+    return nombre, Generar_reporte_html(nombre, metadata, data_df, periodo).encode('utf-8')
+
+def Generar_reportes_html(estaciones, periodo='Año calendario (Ene–Dic)', min_paralelo=2):
+    """Reportes HTML de varias estaciones en un archivo ZIP, generados en un grupo de procesos"""
+    nombres = list(estaciones)
+    metadatas = [estaciones[n][0] for n in nombres]
+    datos = [estaciones[n][1] for n in nombres]
+    periodos = [periodo] * len(nombres)
+
+    if len(nombres) >= min_paralelo:
+        modulo = _Modulo_trabajo()
+        with ProcessPoolExecutor(max_workers=min(len(nombres), os.cpu_count() or 1)) as executor:
+            reportes = list(executor.map(modulo._Reporte_html_estacion, nombres, metadatas, datos, periodos))
+    else:
+        reportes = list(map(_Reporte_html_estacion, nombres, metadatas, datos, periodos))
+
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archivo:
+        usados = set()
+        for nombre, contenido in reportes:
+            # Nombres distintos pueden coincidir al sanearse ('EST 1' y 'EST_1'): se numeran las repeticiones
+            seguro = base = re.sub(r'[^\w.-]+', '_', nombre)
+            indice = 2
+            while seguro in usados:
+                seguro = f"{base}_{indice}"
+                indice += 1
+            usados.add(seguro)
+            archivo.writestr(f"reporte_{seguro}.html", contenido)
+    return output.getvalue()
+
+# --- FUNCIONES DE GRÁFICOS ---
+def Descripcion_variable(data_df):
+    """Nombre, columna, unidad y agregado anual de la variable de los datos, para títulos y ejes"""
+    nombre = Variable_datos(data_df)
+    definicion = VARIABLES[nombre]
+    anual = f"{NOMBRES_AGREGACION[definicion['agregacion']]} anual"
+    return {
+        'nombre': nombre,
+        'columna': definicion['columna'],
+        'unidad': definicion['unidad'],
+        'anual': anual,
+        'eje_anual': f"{nombre} – {anual.lower()} ({definicion['unidad']})",
+        'eje_mensual': f"{nombre} mensual ({definicion['unidad']})"
+    }
+
+def Crear_figura(message):
+    """Crea una figura vacía con un mensaje"""
+    fig = go.Figure()
+    fig.add_annotation(
+        text=message,
+        xref="paper", yref="paper",
+        x=0.5, y=0.5, showarrow=False
+    )
+    fig.update_layout(
+        plot_bgcolor='white',
+        paper_bgcolor='grey'
+    )
+    return fig
+
+def Grafica_distribucion_mensual(data_df, metadata, intervalos=None):
+    """Gráfico de distribución mensual; con intervalos (Intervalos_mensuales) agrega barras de error"""
+    if data_df.empty:
+        return Crear_figura("No hay datos disponibles")
+    
+    try:
+        var = Descripcion_variable(data_df)
+        df_agg = data_df.groupby(['Mes_num', 'Mes'], observed=True)[var['columna']].agg(
+            ['mean', 'median', 'std', 'min', 'max']
+        ).reset_index()
+        
+        def barras_error(estadistico, columna):
+            if intervalos is None:
+                return None
+            ic = intervalos.reindex(df_agg['Mes_num'])
+            return dict(
+                type='data',
+                array=(ic[f'{estadistico} IC sup'] - df_agg[columna].to_numpy()).to_numpy(),
+                arrayminus=(df_agg[columna].to_numpy() - ic[f'{estadistico} IC inf']).to_numpy(),
+                thickness=1.5,
+                width=4
+            )
+        
+        fig = go.Figure()
+        
+        fig.add_trace(go.Box(
+            x=data_df['Mes'],
+            y=data_df[var['columna']],
+            name='Distribución',
+            boxpoints=False,
+            marker_color='#4a7cb1',
+            line_color='#1e3d6b',
+            fillcolor='rgba(74, 124, 177, 0.3)'
+        ))
+        
+        fig.add_trace(go.Scatter(
+            x=df_agg['Mes'],
+            y=df_agg['mean'],
+            mode='lines+markers',
+            name='Promedio',
+            line=dict(color='#ff8c00', width=3),
+            marker=dict(size=8),
+            error_y=barras_error('Promedio', 'mean'),
+            hovertemplate=f"<b>%{{x}}</b><br>Promedio: %{{y:.1f}} {var['unidad']}<extra></extra>"
+        ))
+        
+        fig.add_trace(go.Scatter(
+            x=df_agg['Mes'],
+            y=df_agg['median'],
+            mode='lines',
+            name='Mediana',
+            line=dict(color='#2ca02c', width=2, dash='dash'),
+            error_y=barras_error('Mediana', 'median'),
+            hovertemplate=f"<b>%{{x}}</b><br>Mediana: %{{y:.1f}} {var['unidad']}<extra></extra>"
+        ))
+        
+        fig.update_layout(
+            title=dict(
+                text=f'Distribución Mensual de {var["nombre"]}<br><sup>{metadata.get("Estación", "")}</sup>',
+                x=0.5,
+                xanchor='center',
+                font=dict(size=18, color='#1e3d6b')
+            ),
+            xaxis_title='Mes',
+            yaxis_title=var['columna'],
+            hovermode='x unified',
+            plot_bgcolor='white',
+            paper_bgcolor='grey',
+            font=dict(
+                family="Arial",
+                size=12,
+                color="#333333"
+            ),
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1,
+                font=dict(
+                    color="#333333",
+                    size=12
+                )
+            ),
+            margin=dict(l=50, r=50, t=100, b=50)
+        )
+        
+        return fig
+    
+    except Exception as e:
+        st.error(f"Error al generar gráfico de distribución: {str(e)}")
+        return Crear_figura("Error al generar gráfico")
+
+def Anotar_puntos_cambio(fig, segmentos, yref='y', unidad='mm'):
+    """Agrega a un gráfico anual las medias de cada tramo y líneas verticales en los puntos de cambio"""
+    if segmentos is None or segmentos.empty:
+        return fig
+
+    x, y = [], []
+    for _, tramo in segmentos.iterrows():
+        x += [tramo['Inicio'] - 0.5, tramo['Fin'] + 0.5, None]
+        y += [tramo['Media'], tramo['Media'], None]
+
+    fig.add_trace(go.Scatter(
+        x=x,
+        y=y,
+        mode='lines',
+        line=dict(color='#d73027', width=2),
+        name='Media por tramo',
+        yaxis=yref,
+        hovertemplate=f"Media del tramo: %{{y:.1f}} {unidad}<extra></extra>"
+    ))
+
+    for inicio in segmentos['Inicio'].iloc[1:]:
+        fig.add_vline(
+            x=inicio - 0.5,
+            line=dict(color='#d73027', width=1.5, dash='dot'),
+            annotation_text=f"Cambio {inicio}",
+            annotation_position="top left",
+            annotation_font=dict(color='#d73027', size=11)
+        )
+    return fig
+
+def Grafico_tendencia_anual(data_df, metadata, segmentos=None):
+    """Gráfico de tendencia anual"""
+    if data_df.empty:
+        return Crear_figura("No hay datos disponibles")
+    
+    try:
+        var = Descripcion_variable(data_df)
+        tendencia = Calcular_tendencia_anual(data_df)
+        if tendencia is None:
+            return Crear_figura("Datos insuficientes para análisis de tendencia")
+        
+        x = tendencia['x']
+        y = tendencia['y']
+        trend_line = tendencia['intercepto'] + tendencia['pendiente'] * x
+        
+        lowess = sm.nonparametric.lowess(y, x, frac=0.3) if len(x) > 5 else None
+        
+        r_value = tendencia['r']
+        y_err = tendencia['error_pendiente'] * np.sqrt(1/len(x) + (x - np.mean(x))**2 / np.sum((x - np.mean(x))**2))
+        
+        fig = go.Figure()
+        
+        fig.add_trace(go.Scatter(
+            x=np.concatenate([x, x[::-1]]),
+            y=np.concatenate([trend_line + 1.96*y_err, (trend_line - 1.96*y_err)[::-1]]),
+            fill='toself',
+            fillcolor='rgba(30, 61, 107, 0.2)',
+            line_color='rgba(255,255,255,0)',
+            name='Intervalo 95% confianza'
+        ))
+        
+        fig.add_trace(go.Scatter(
+            x=x,
+            y=y,
+            mode='markers',
+            marker=dict(size=10, color='#4a7cb1', line=dict(width=1, color='#1e3d6b')),
+            name=f"{var['nombre']} ({var['anual'].lower()})",
+            hovertemplate=f"<b>Año %{{x}}</b><br>{var['nombre']}: %{{y:.1f}} {var['unidad']}<extra></extra>"
+        ))
+        
+        fig.add_trace(go.Scatter(
+            x=x,
+            y=trend_line,
+            mode='lines',
+            line=dict(color='#ff8c00', width=3, dash='dash'),
+            name=f'Tendencia (R²={r_value**2:.2f})',
+            hovertemplate=f"<b>Año %{{x}}</b><br>Tendencia: %{{y:.1f}} {var['unidad']}<extra></extra>"
+        ))
+        
+        if lowess is not None:
+            fig.add_trace(go.Scatter(
+                x=lowess[:, 0],
+                y=lowess[:, 1],
+                mode='lines',
+                line=dict(color='#1e3d6b', width=3),
+                name='Tendencia suavizada',
+                hovertemplate=f"<b>Año %{{x:.0f}}</b><br>Tendencia suavizada: %{{y:.1f}} {var['unidad']}<extra></extra>"
+            ))
+        
+        Anotar_puntos_cambio(fig, segmentos, unidad=var['unidad'])
+        
+        fig.update_layout(
+            title=dict(
+                text=f'Tendencia Anual de {var["nombre"]}<br><sup>{metadata.get("Estación", "")}</sup>',
+                x=0.5,
+                xanchor='center',
+                font=dict(size=18, color='#1e3d6b')
+            ),
+            xaxis_title='Año',
+            yaxis_title=var['eje_anual'],
+            hovermode='x unified',
+            plot_bgcolor='white',
+            paper_bgcolor='grey',
+            font=dict(
+                family="Arial",
+                size=12,
+                color="#333333"
+            ),
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1,
+                font=dict(
+                    color="#333333",
+                    size=12
+                )
+            ),
+            margin=dict(l=50, r=50, t=100, b=50)
+        )
+        
+        return fig
+    
+    except Exception as e:
+        st.error(f"Error al generar gráfico de tendencia: {str(e)}")
+        return Crear_figura("Error al generar gráfico")
+
+def Mapa_calor_mensual(data_df, metadata):
+    """Heatmap de precipitación mensual por año"""
+    if data_df.empty:
+        return None
+    
+    try:
+        var = Descripcion_variable(data_df)
         # Crear pivot table solo con los meses disponibles
         pivot_df = data_df.pivot_table(
             index='Año',
             columns='Mes_num',
-            values='Precipitación (mm)',
+            values=var['columna'],
             aggfunc='mean'
         )
         
-        # Verificar si hay datos
-        if pivot_df.empty:
-            return None
+        # Verificar si hay datos
+        if pivot_df.empty:
+            return None
+        
+        # Mapeo de números de mes a nombres abreviados
+        month_map = {
+            1: 'Ene', 2: 'Feb', 3: 'Mar', 4: 'Abr', 
+            5: 'May', 6: 'Jun', 7: 'Jul', 8: 'Ago',
+            9: 'Set', 10: 'Oct', 11: 'Nov', 12: 'Dic'
+        }
+        
+        # Renombrar solo las columnas existentes
+        available_months = pivot_df.columns.tolist()
+        new_columns = [month_map.get(month, month) for month in available_months]
+        pivot_df.columns = new_columns
+        
+        # Ordenar por mes numérico (ya no es necesario ordenar alfabéticamente)
+        pivot_df = pivot_df[sorted(pivot_df.columns, key=lambda x: list(month_map.values()).index(x))]
+        
+        fig = px.imshow(
+            pivot_df,
+            labels=dict(x="Mes", y="Año", color=var['columna']),
+            color_continuous_scale='RdYlGn_r',
+            aspect='auto'
+        )
+        
+        fig.update_layout(
+            title=f'Patrón Mensual por Año - {metadata.get("Estación", "")}',
+            xaxis_title='Mes',
+            yaxis_title='Año',
+            plot_bgcolor='white',
+            paper_bgcolor='grey'
+        )
+        
+        return fig
+    
+    except Exception as e:
+        st.error(f"Error al generar el heatmap: {str(e)}")
+        return None
+
+
+
+def Grafica_dispercion_anual(data_df, metadata):
+    """Gráfico de dispersión de precipitación por año"""
+    if data_df.empty:
+        return Crear_figura("No hay datos disponibles")
+    
+    try:
+        var = Descripcion_variable(data_df)
+        annual_data = data_df.groupby('Año')[var['columna']].agg(Agregacion_anual(data_df)).reset_index()
+        
+        fig = px.scatter(
+            annual_data,
+            x='Año',
+            y=var['columna'],
+            trendline="lowess",
+            trendline_color_override="#FF7F0E",
+            labels={var['columna']: var['eje_anual']},
+            color_discrete_sequence=["#2ff310"]
+        )
+        
+        fig.update_traces(
+            hovertemplate=f"<b>Año:</b> %{{x}}<br><b>{var['nombre']}:</b> %{{y:.1f}} {var['unidad']}<extra></extra>",
+            marker=dict(size=10, opacity=0.8, line=dict(width=1, color='#1e3d6b'))
+        )
+        
+        fig.update_layout(
+            title=dict(
+                text=f'Dispersión de {var["nombre"]} Anual<br><sup>{metadata.get("Estación", "")}</sup>',
+                x=0.5,
+                xanchor='center',
+                font=dict(size=18, color='#1e3d6b')
+            ),
+            xaxis_title='Año',
+            yaxis_title=var['eje_anual'],
+            hovermode='x unified',
+            plot_bgcolor='white',
+            paper_bgcolor='grey',
+            font=dict(
+                family="Arial",
+                size=12,
+                color="#333333"
+            ),
+            showlegend=False,
+            margin=dict(l=50, r=50, t=100, b=50)
+        )
+        
+        return fig
+    
+    except Exception as e:
+        st.error(f"Error al generar gráfico de dispersión anual: {str(e)}")
+        return Crear_figura("Error al generar gráfico")
+
+def Grafica_dispercion_mensual(data_df, metadata):
+    """Gráfico de dispersión de precipitación por mes"""
+    if data_df.empty:
+        return Crear_figura("No hay datos disponibles")
+    
+    try:
+        var = Descripcion_variable(data_df)
+        month_order = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 
+                      'Jul', 'Ago', 'Set', 'Oct', 'Nov', 'Dic']
+        
+        fig = px.scatter(
+            data_df,
+            x='Mes',
+            y=var['columna'],
+            color='Mes',
+            category_orders={"Mes": month_order},
+            labels={var['columna']: var['eje_mensual']},
+            color_discrete_sequence=px.colors.qualitative.Pastel
+        )
+        
+        fig.update_traces(
+            hovertemplate=f"<b>Año:</b> %{{customdata}}<br><b>Mes:</b> %{{x}}<br><b>{var['nombre']}:</b> %{{y:.1f}} {var['unidad']}<extra></extra>",
+            customdata=data_df['Año'],
+            marker=dict(size=8, opacity=0.9, line=dict(width=1, color='#1e3d6b'))
+        )
+        
+        fig.update_layout(
+            title=dict(
+                text=f'Dispersión de {var["nombre"]} por Mes',
+                x=0.5,
+                xanchor='center',
+                font=dict(size=18, color='#1e3d6b')
+            ),
+            xaxis_title='Mes',
+            yaxis_title=var['eje_mensual'],
+            hovermode='closest',
+            plot_bgcolor='white',
+            paper_bgcolor='grey',
+            font=dict(
+                family="Arial",
+                size=12,
+                color="#333333"
+            ),
+            xaxis={'categoryorder': 'array', 'categoryarray': month_order},
+            legend=dict(
+                title_text='Mes',
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1,
+                font=dict(
+                    color="#333333",
+                    size=10
+                )
+            ),
+            margin=dict(l=50, r=50, t=100, b=50)
+        )
+        
+        
+        return fig
+    
+    except Exception as e:
+        st.error(f"Error al generar gráfico de dispersión mensual: {str(e)}")
+        return Crear_figura("Error al generar gráfico")
+
+def Grafico_precipitacion_anual(data_df, metadata, segmentos=None):
+    """Gráfico de precipitación acumulada anual"""
+    if data_df.empty:
+        return Crear_figura("No hay datos disponibles")
+    
+    try:
+        var = Descripcion_variable(data_df)
+        annual_cum = data_df.groupby('Año')[var['columna']].sum().reset_index()
+        
+        annual_cum = annual_cum.sort_values('Año')
+        annual_cum['Acumulado'] = annual_cum[var['columna']].cumsum()
+        
+        fig = go.Figure()
+        
+        fig.add_trace(go.Bar(
+            x=annual_cum['Año'],
+            y=annual_cum[var['columna']],
+            name=f"{var['nombre']} anual",
+            marker_color='#4a7cb1',
+            opacity=0.7,
+            hovertemplate=f"<b>Año %{{x}}</b><br>{var['nombre']}: %{{y:.1f}} {var['unidad']}<extra></extra>"
+        ))
+        
+        fig.add_trace(go.Scatter(
+            x=annual_cum['Año'],
+            y=annual_cum['Acumulado'],
+            mode='lines+markers',
+            name='Acumulado',
+            line=dict(color="#4dff00", width=3),
+            marker=dict(size=8),
+            yaxis='y2',
+            hovertemplate=f"<b>Año %{{x}}</b><br>Acumulado: %{{y:.1f}} {var['unidad']}<extra></extra>"
+        ))
+        
+        Anotar_puntos_cambio(fig, segmentos, unidad=var['unidad'])
+        
+        fig.update_layout(
+            title=dict(
+                text=f'{var["nombre"]} Anual y Acumulada<br><sup>{metadata.get("Estación", "")}</sup>',
+                x=0.5,
+                xanchor='center',
+                font=dict(size=18, color="#141466")
+            ),
+            xaxis_title='Año',
+            yaxis_title=var['eje_anual'],
+            yaxis2=dict(
+                title=f"{var['nombre']} acumulada ({var['unidad']})",
+                overlaying='y',
+                side='right'
+            ),
+            hovermode='x unified',
+            plot_bgcolor='white',
+            paper_bgcolor='grey',
+            font=dict(
+                family="Arial",
+                size=12,
+                color="#333333"
+            ),
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1,
+                font=dict(
+                    color="#333333",
+                    size=12
+                )
+            ),
+            margin=dict(l=50, r=50, t=100, b=50)
+        )
+        
+        return fig
+    
+    except Exception as e:
+        st.error(f"Error al generar gráfico de precipitación acumulada: {str(e)}")
+        return Crear_figura("Error al generar gráfico")
+
+def Grafico_violin_mensual(data_df, metadata):
+    """Gráfico de violín para distribución mensual"""
+    if data_df.empty:
+        return Crear_figura("No hay datos disponibles")
+    
+    try:
+        var = Descripcion_variable(data_df)
+        month_order = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 
+                      'Jul', 'Ago', 'Set', 'Oct', 'Nov', 'Dic']
+        
+        fig = px.violin(
+            data_df,
+            x='Mes',
+            y=var['columna'],
+            color='Mes',
+            category_orders={"Mes": month_order},
+            box=True,
+            points="all",
+            hover_data=['Año'],
+            labels={var['columna']: var['eje_mensual']},
+            color_discrete_sequence=px.colors.qualitative.Pastel
+        )
+        
+        fig.update_layout(
+            title=dict(
+                text=f'Distribución de {var["nombre"]} por Mes<br><sup>{metadata.get("Estación", "")}</sup>',
+                x=0.5,
+                xanchor='center',
+                font=dict(size=18, color='#1e3d6b')
+            ),
+            xaxis_title='Mes',
+            yaxis_title=var['eje_mensual'],
+            plot_bgcolor='white',
+            paper_bgcolor='grey',
+            font=dict(
+                family="Arial",
+                size=12,
+                color="#333333"
+            ),
+            showlegend=False,
+            margin=dict(l=50, r=50, t=100, b=50)
+        )
+        
+        fig.update_traces(
+            hovertemplate=f"<b>Mes:</b> %{{x}}<br><b>{var['nombre']}:</b> %{{y:.1f}} {var['unidad']}<extra></extra>",
+            hoveron="points+violins"
+        )
         
-        # Mapeo de números de mes a nombres abreviados
-        month_map = {
-            1: 'Ene', 2: 'Feb', 3: 'Mar', 4: 'Abr', 
-            5: 'May', 6: 'Jun', 7: 'Jul', 8: 'Ago',
-            9: 'Set', 10: 'Oct', 11: 'Nov', 12: 'Dic'
-        }
+        return fig
+    
+    except Exception as e:
+        st.error(f"Error al generar gráfico de violín: {str(e)}")
+        return Crear_figura("Error al generar gráfico")
+
+def Grafica_comparacion_mensual(data_df, metadata, selected_years, envolvente=None):
+    """Gráfico de uno o varios años sobre la envolvente climatológica mensual (percentiles y extremos)"""
+    if data_df.empty:
+        return Crear_figura("No hay datos disponibles")
+    
+    try:
+        var = Descripcion_variable(data_df)
+        if envolvente is None:
+            envolvente = Envolvente_climatologica(data_df)
+        meses = envolvente['Mes']
         
-        # Renombrar solo las columnas existentes
-        available_months = pivot_df.columns.tolist()
-        new_columns = [month_map.get(month, month) for month in available_months]
-        pivot_df.columns = new_columns
+        fig = go.Figure()
         
-        # Ordenar por mes numérico (ya no es necesario ordenar alfabéticamente)
-        pivot_df = pivot_df[sorted(pivot_df.columns, key=lambda x: list(month_map.values()).index(x))]
+        # Bandas de la más amplia a la más estrecha: cada una rellena hasta su borde superior
+        bandas = [
+            ('P0', 'P100', 'Mínimo – Máximo', 'rgba(30, 61, 107, 0.10)'),
+            ('P10', 'P90', 'P10 – P90', 'rgba(30, 61, 107, 0.18)'),
+            ('P25', 'P75', 'P25 – P75', 'rgba(30, 61, 107, 0.30)')
+        ]
+        for inferior, superior, nombre, color in bandas:
+            fig.add_trace(go.Scatter(
+                x=meses,
+                y=envolvente[superior],
+                mode='lines',
+                line=dict(width=0),
+                legendgroup=nombre,
+                showlegend=False,
+                hoverinfo='skip'
+            ))
+            fig.add_trace(go.Scatter(
+                x=meses,
+                y=envolvente[inferior],
+                mode='lines',
+                line=dict(width=0),
+                fill='tonexty',
+                fillcolor=color,
+                name=nombre,
+                legendgroup=nombre,
+                customdata=envolvente[superior],
+                hovertemplate=f"{nombre}: %{{y:.1f}} – %{{customdata:.1f}} {var['unidad']}<extra></extra>"
+            ))
         
-        fig = px.imshow(
-            pivot_df,
-            labels=dict(x="Mes", y="Año", color="Precipitación (mm)"),
-            color_continuous_scale='RdYlGn_r',
-            aspect='auto'
+        fig.add_trace(go.Scatter(
+            x=meses,
+            y=envolvente['P50'],
+            mode='lines',
+            name='Mediana histórica',
+            line=dict(color='#1e3d6b', width=2, dash='dot'),
+            hovertemplate=f"Mediana: %{{y:.1f}} {var['unidad']}<extra></extra>"
+        ))
+        
+        fig.add_trace(go.Scatter(
+            x=meses,
+            y=envolvente['Promedio'],
+            mode='lines',
+            name='Promedio histórico',
+            line=dict(color='#1e3d6b', width=3),
+            hovertemplate=f"Promedio: %{{y:.1f}} {var['unidad']}<extra></extra>"
+        ))
+        
+        colores = ['#ff8c00', '#d62728', '#2ca02c', '#9467bd', '#8c564b', '#e377c2']
+        for i, year in enumerate(selected_years):
+            year_data = data_df[data_df['Año'] == year].sort_values('Mes_num')
+            fig.add_trace(go.Scatter(
+                x=year_data['Mes'].astype(str),
+                y=year_data[var['columna']],
+                mode='lines+markers',
+                name=f'Año {year}',
+                line=dict(color=colores[i % len(colores)], width=3),
+                hovertemplate=f"Año {year}: %{{y:.1f}} {var['unidad']}<extra></extra>"
+            ))
+        
+        fig.update_layout(
+            title=dict(
+                text=f'Comparación Mensual<br><sup>{metadata.get("Estación", "")}</sup>',
+                x=0.5,
+                xanchor='center',
+                font=dict(size=18, color='#1e3d6b')
+            ),
+            xaxis_title='Mes',
+            yaxis_title=var['columna'],
+            xaxis=dict(categoryorder='array', categoryarray=list(meses)),
+            hovermode='x unified',
+            plot_bgcolor='white',
+            paper_bgcolor='grey',
+            font=dict(
+                family="Arial",
+                size=12,
+                color="#333333"
+            ),
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1,
+                font=dict(
+                    color="#333333",
+                    size=12
+                )
+            ),
+            margin=dict(l=50, r=50, t=100, b=50)
+        )
+        
+        return fig
+    
+    except Exception as e:
+        st.error(f"Error al generar gráfico de comparación mensual: {str(e)}")
+        return Crear_figura("Error al generar gráfico")
+
+def Grafica_anomalia_anual(data_df, metadata, normal=None, ventana_movil=5):
+    """Gráfico de anomalías anuales respecto al promedio filtrado o a una normal climatológica"""
+    if data_df.empty:
+        return Crear_figura("No hay datos disponibles")
+    
+    try:
+        var = Descripcion_variable(data_df)
+        annual_data = data_df.groupby('Año')[var['columna']].agg(Agregacion_anual(data_df)).reset_index()
+        if normal is not None and pd.notna(normal['total']):
+            avg_precip = normal['total']
+            reference_text = f"Normal {normal['inicio']}–{normal['fin']}: {avg_precip:.1f} {var['unidad']}"
+        else:
+            avg_precip = annual_data[var['columna']].mean()
+            reference_text = f"Promedio: {avg_precip:.1f} {var['unidad']}"
+        
+        annual_data['Anomalía'] = annual_data[var['columna']] - avg_precip
+        annual_data['Color'] = np.where(annual_data['Anomalía'] >= 0, '#4a7cb1', '#ff8c00')
+        
+        fig = go.Figure()
+        
+        fig.add_trace(go.Bar(
+            x=annual_data['Año'],
+            y=annual_data['Anomalía'],
+            marker_color=annual_data['Color'],
+            name='Anomalía',
+            hovertemplate=f"<b>Año %{{x}}</b><br>Anomalía: %{{y:.1f}} {var['unidad']}<extra></extra>"
+        ))
+        
+        if ventana_movil and len(annual_data) >= ventana_movil:
+            moving_avg = Media_movil_anual(annual_data, ventana_movil) - avg_precip
+            fig.add_trace(go.Scatter(
+                x=moving_avg.index,
+                y=moving_avg.values,
+                mode='lines',
+                name=f'Media móvil {ventana_movil} años',
+                line=dict(color='#1e3d6b', width=3),
+                hovertemplate=f"<b>Año %{{x}}</b><br>Media móvil {ventana_movil} años: %{{y:.1f}} {var['unidad']}<extra></extra>"
+            ))
+        
+        fig.add_hline(
+            y=0,
+            line_dash="dash",
+            line_color="#1e3d6b",
+            annotation_text=reference_text,
+            annotation_position="bottom right"
         )
         
         fig.update_layout(
-            title=f'Patrón Mensual por Año - {metadata.get("Estación", "")}',
+            title=dict(
+                text=f'Anomalías de {var["nombre"]} Anual<br><sup>{metadata.get("Estación", "")}</sup>',
+                x=0.5,
+                xanchor='center',
+                font=dict(size=18, color='#1e3d6b')
+            ),
+            xaxis_title='Año',
+            yaxis_title=f"Anomalía ({var['unidad']})",
+            plot_bgcolor='white',
+            paper_bgcolor='grey',
+            font=dict(
+                family="Arial",
+                size=12,
+                color="#333333"
+            ),
+            showlegend=False,
+            margin=dict(l=50, r=50, t=100, b=50)
+        )
+        
+        return fig
+    
+    except Exception as e:
+        st.error(f"Error al generar gráfico de anomalías: {str(e)}")
+        return Crear_figura("Error al generar gráfico")
+
+def Grafica_acumulados_moviles(moviles, metadata, year_range=None):
+    """Gráfico de totales móviles de varios meses"""
+    if moviles.empty:
+        return Crear_figura("No hay datos disponibles")
+
+    try:
+        var = Descripcion_variable(moviles)
+        if year_range is not None:
+            años = moviles['Fecha'].dt.year
+            moviles = moviles[(años >= year_range[0]) & (años <= year_range[1])]
+
+        colores = ['#4a7cb1', '#ff8c00', '#1e3d6b']
+        columnas = [c for c in moviles.columns if c.startswith('Acumulado')]
+
+        fig = go.Figure()
+
+        for i, columna in enumerate(columnas):
+            fig.add_trace(go.Scatter(
+                x=moviles['Fecha'],
+                y=moviles[columna],
+                mode='lines',
+                name=columna,
+                line=dict(color=colores[i % len(colores)], width=2),
+                hovertemplate=f"<b>%{{x|%b %Y}}</b><br>{columna}: %{{y:.1f}} {var['unidad']}<extra></extra>"
+            ))
+
+        fig.update_layout(
+            title=dict(
+                text=f'Acumulados Móviles de {var["nombre"]}<br><sup>{metadata.get("Estación", "")}</sup>',
+                x=0.5,
+                xanchor='center',
+                font=dict(size=18, color='#1e3d6b')
+            ),
+            xaxis_title='Fecha',
+            yaxis_title=f"{var['nombre']} acumulada ({var['unidad']})",
+            hovermode='x unified',
+            plot_bgcolor='white',
+            paper_bgcolor='grey',
+            font=dict(
+                family="Arial",
+                size=12,
+                color="#333333"
+            ),
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1,
+                font=dict(
+                    color="#333333",
+                    size=12
+                )
+            ),
+            margin=dict(l=50, r=50, t=100, b=50)
+        )
+
+        return fig
+
+    except Exception as e:
+        st.error(f"Error al generar gráfico de acumulados móviles: {str(e)}")
+        return Crear_figura("Error al generar gráfico")
+
+def Grafica_rachas(rachas, titulo, duracion_minima=2, year_range=None):
+    """Duración de las rachas secas (hacia abajo) y húmedas (hacia arriba) a lo largo del tiempo"""
+    if rachas.empty:
+        return Crear_figura("No hay datos disponibles")
+
+    try:
+        var = Descripcion_variable(rachas)
+        rachas = rachas[rachas['Duración (meses)'] >= duracion_minima]
+        if year_range is not None:
+            rachas = rachas[rachas['Inicio'].dt.year.between(*year_range)]
+        if rachas.empty:
+            return Crear_figura(f"No hay rachas de {duracion_minima} meses o más")
+
+        colores = {'Húmeda': '#4a7cb1', 'Seca': '#c0762c'}
+        fig = go.Figure()
+
+        for tipo, signo in (('Húmeda', 1), ('Seca', -1)):
+            eventos = rachas[rachas['Tipo'] == tipo]
+            if eventos.empty:
+                continue
+            # Cada barra cubre los meses de la racha en el eje de fechas
+            fin = eventos['Fin'] + pd.offsets.MonthBegin(1)
+            fig.add_trace(go.Bar(
+                x=eventos['Inicio'] + (fin - eventos['Inicio']) / 2,
+                y=signo * eventos['Duración (meses)'],
+                width=(fin - eventos['Inicio']).dt.total_seconds() * 1000,
+                name=f"Rachas {tipo.lower()}s",
+                marker=dict(
+                    color=colores[tipo],
+                    line=dict(width=0),
+                    opacity=np.where(eventos['Completa'], 0.9, 0.45)
+                ),
+                customdata=np.column_stack([
+                    eventos['Inicio'].dt.strftime('%b %Y'),
+                    eventos['Fin'].dt.strftime('%b %Y'),
+                    eventos['Duración (meses)'],
+                    eventos[var['columna']]
+                ]),
+                hovertemplate=(
+                    f"<b>Racha {tipo.lower()}</b><br>%{{customdata[0]}} – %{{customdata[1]}}<br>"
+                    f"Duración: %{{customdata[2]}} meses<br>{var['nombre']}: %{{customdata[3]:.1f}} {var['unidad']}<extra></extra>"
+                )
+            ))
+
+        fig.add_hline(y=0, line=dict(color='#333333', width=1))
+        fig.update_layout(
+            title=dict(
+                text=f'Duración de Rachas Secas y Húmedas<br><sup>{titulo}</sup>',
+                x=0.5,
+                xanchor='center',
+                font=dict(size=18, color='#1e3d6b')
+            ),
+            xaxis_title='Fecha',
+            yaxis_title='Duración (meses; secas en negativo)',
+            barmode='overlay',
+            bargap=0,
+            plot_bgcolor='white',
+            paper_bgcolor='grey',
+            font=dict(
+                family="Arial",
+                size=12,
+                color="#333333"
+            ),
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1,
+                font=dict(
+                    color="#333333",
+                    size=12
+                )
+            ),
+            margin=dict(l=50, r=50, t=100, b=50)
+        )
+
+        return fig
+
+    except Exception as e:
+        st.error(f"Error al generar gráfico de rachas: {str(e)}")
+        return Crear_figura("Error al generar gráfico")
+
+def Mapa_calor_anomalias(anomalias, metadata, tipo='z', year_range=None):
+    """Heatmap de anomalías mensuales estandarizadas con la anomalía del período como última columna"""
+    try:
+        clave, columna_anual = ('z', 'Puntaje z') if tipo == 'z' else ('porcentaje', '% de la normal')
+        month_map = {
+            1: 'Ene', 2: 'Feb', 3: 'Mar', 4: 'Abr',
+            5: 'May', 6: 'Jun', 7: 'Jul', 8: 'Ago',
+            9: 'Set', 10: 'Oct', 11: 'Nov', 12: 'Dic'
+        }
+
+        tabla = anomalias[clave].rename(columns=month_map)
+        tabla['Período'] = anomalias['anual'][columna_anual].reindex(tabla.index)
+        if year_range is not None:
+            tabla = tabla.loc[(tabla.index >= year_range[0]) & (tabla.index <= year_range[1])]
+
+        if tabla.empty or tabla.isna().all().all():
+            return Crear_figura("No hay datos disponibles")
+
+        if tipo == 'z':
+            escala = dict(zmid=0, zmin=-3, zmax=3)
+            titulo_color = 'Puntaje z'
+            formato = '%{z:.2f}'
+        else:
+            escala = dict(zmid=100, zmin=0, zmax=200)
+            titulo_color = '% de la normal'
+            formato = '%{z:.0f}%'
+
+        fig = go.Figure(go.Heatmap(
+            z=tabla.to_numpy(),
+            x=tabla.columns,
+            y=tabla.index,
+            colorscale='RdBu',
+            colorbar=dict(title=titulo_color),
+            hovertemplate=f"<b>%{{x}} %{{y}}</b><br>{titulo_color}: {formato}<extra></extra>",
+            **escala
+        ))
+
+        fig.update_layout(
+            title=dict(
+                text=f'Anomalías Estandarizadas<br><sup>{metadata.get("Estación", "")}</sup>',
+                x=0.5,
+                xanchor='center',
+                font=dict(size=18, color='#1e3d6b')
+            ),
             xaxis_title='Mes',
             yaxis_title='Año',
             plot_bgcolor='white',
-            paper_bgcolor='grey'
+            paper_bgcolor='grey',
+            font=dict(
+                family="Arial",
+                size=12,
+                color="#333333"
+            ),
+            margin=dict(l=50, r=50, t=100, b=50)
         )
-        
+
         return fig
-    
-    except Exception as e:
-        st.error(f"Error al generar el heatmap: {str(e)}")
-        return None
 
+    except Exception as e:
+        st.error(f"Error al generar el heatmap de anomalías: {str(e)}")
+        return Crear_figura("Error al generar gráfico")
 
+def Grafica_estacionalidad(indices, metadata):
+    """Evolución anual de los índices de estacionalidad y de la temporada de lluvias"""
+    if indices.empty:
+        return Crear_figura("Datos insuficientes para índices de estacionalidad")
 
-def Grafica_dispercion_anual(data_df, metadata):
-    """Gráfico de dispersión de precipitación por año"""
-    if data_df.empty:
-        return Crear_figura("No hay datos disponibles")
-    
     try:
-        annual_data = data_df.groupby('Año')['Precipitación (mm)'].sum().reset_index()
-        
-        fig = px.scatter(
-            annual_data,
-            x='Año',
-            y='Precipitación (mm)',
-            trendline="lowess",
-            trendline_color_override="#FF7F0E",
-            labels={'Precipitación (mm)': 'Precipitación Total Anual (mm)'},
-            color_discrete_sequence=["#2ff310"]
+        month_order = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun',
+                      'Jul', 'Ago', 'Set', 'Oct', 'Nov', 'Dic']
+
+        fig = make_subplots(
+            rows=2, cols=1,
+            shared_xaxes=True,
+            vertical_spacing=0.08,
+            specs=[[{"secondary_y": True}], [{}]]
         )
-        
-        fig.update_traces(
-            hovertemplate="<b>Año:</b> %{x}<br><b>Precipitación:</b> %{y:.1f} mm<extra></extra>",
-            marker=dict(size=10, opacity=0.8, line=dict(width=1, color='#1e3d6b'))
+
+        fig.add_trace(go.Scatter(
+            x=indices['Año'],
+            y=indices['Índice de estacionalidad'],
+            mode='lines+markers',
+            name='Índice de estacionalidad (SI)',
+            line=dict(color='#4a7cb1', width=2),
+            hovertemplate="<b>Año %{x}</b><br>SI: %{y:.2f}<extra></extra>"
+        ), row=1, col=1)
+
+        fig.add_trace(go.Scatter(
+            x=indices['Año'],
+            y=indices['PCI'],
+            mode='lines+markers',
+            name='Concentración (PCI)',
+            line=dict(color='#ff8c00', width=2),
+            hovertemplate="<b>Año %{x}</b><br>PCI: %{y:.1f}<extra></extra>"
+        ), row=1, col=1, secondary_y=True)
+
+        for columna, color, simbolo in [
+            ('Inicio de lluvias', '#2ca02c', 'triangle-up'),
+            ('Centroide (mes)', '#1e3d6b', 'circle'),
+            ('Fin de lluvias', '#d62728', 'triangle-down')
+        ]:
+            fig.add_trace(go.Scatter(
+                x=indices['Año'],
+                y=indices[columna],
+                mode='markers' if columna != 'Centroide (mes)' else 'lines+markers',
+                name=columna,
+                marker=dict(size=8, color=color, symbol=simbolo),
+                line=dict(color=color, width=1),
+                hovertemplate=f"<b>Año %{{x}}</b><br>{columna}: %{{y:.1f}}<extra></extra>"
+            ), row=2, col=1)
+
+        fig.update_yaxes(title_text='SI', row=1, col=1)
+        fig.update_yaxes(title_text='PCI', row=1, col=1, secondary_y=True)
+        fig.update_yaxes(
+            title_text='Mes',
+            tickvals=list(range(1, 13)),
+            ticktext=month_order,
+            range=[0.5, 12.5],
+            row=2, col=1
         )
-        
+        fig.update_xaxes(title_text='Año', row=2, col=1)
+
         fig.update_layout(
             title=dict(
-                text=f'Dispersión de Precipitación Anual<br><sup>{metadata.get("Estación", "")}</sup>',
+                text=f'Evolución de la Estacionalidad<br><sup>{metadata.get("Estación", "")}</sup>',
                 x=0.5,
                 xanchor='center',
                 font=dict(size=18, color='#1e3d6b')
             ),
-            xaxis_title='Año',
-            yaxis_title='Precipitación Total Anual (mm)',
+            height=650,
             hovermode='x unified',
             plot_bgcolor='white',
             paper_bgcolor='grey',
@@ -696,50 +4135,75 @@ def Grafica_dispercion_anual(data_df, metadata):
                 size=12,
                 color="#333333"
             ),
-            showlegend=False,
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1,
+                font=dict(
+                    color="#333333",
+                    size=12
+                )
+            ),
             margin=dict(l=50, r=50, t=100, b=50)
         )
-        
+
         return fig
-    
+
     except Exception as e:
-        st.error(f"Error al generar gráfico de dispersión anual: {str(e)}")
+        st.error(f"Error al generar gráfico de estacionalidad: {str(e)}")
         return Crear_figura("Error al generar gráfico")
 
-def Grafica_dispercion_mensual(data_df, metadata):
-    """Gráfico de dispersión de precipitación por mes"""
-    if data_df.empty:
+def Grafica_doble_masa(doble_masa, seleccion, variable=VARIABLE_PREDETERMINADA):
+    """Gráfico de curvas de doble masa con los quiebres detectados"""
+    if doble_masa is None or not seleccion:
         return Crear_figura("No hay datos disponibles")
-    
+
     try:
-        month_order = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 
-                      'Jul', 'Ago', 'Set', 'Oct', 'Nov', 'Dic']
-        
-        fig = px.scatter(
-            data_df,
-            x='Mes',
-            y='Precipitación (mm)',
-            color='Mes',
-            category_orders={"Mes": month_order},
-            labels={'Precipitación (mm)': 'Precipitación Mensual (mm)'},
-            color_discrete_sequence=px.colors.qualitative.Pastel
-        )
-        
-        fig.update_traces(
-            hovertemplate="<b>Año:</b> %{customdata}<br><b>Mes:</b> %{x}<br><b>Precipitación:</b> %{y:.1f} mm<extra></extra>",
-            customdata=data_df['Año'],
-            marker=dict(size=8, opacity=0.9, line=dict(width=1, color='#1e3d6b'))
-        )
-        
+        unidad = VARIABLES[variable]['unidad']
+        curvas = doble_masa['curvas']
+        resumen = doble_masa['resumen'].set_index('Estación')
+        colores = px.colors.qualitative.Plotly
+
+        fig = go.Figure()
+
+        for i, estacion in enumerate(seleccion):
+            curva = curvas[curvas['Estación'] == estacion]
+            color = colores[i % len(colores)]
+
+            fig.add_trace(go.Scatter(
+                x=curva['Acumulado referencia'],
+                y=curva['Acumulado estación'],
+                mode='lines+markers',
+                name=estacion,
+                line=dict(color=color, width=2),
+                marker=dict(size=5),
+                customdata=curva['Año'],
+                hovertemplate=f"<b>Año %{{customdata}}</b><br>Referencia: %{{x:.0f}} {unidad}<br>Estación: %{{y:.0f}} {unidad}<extra></extra>"
+            ))
+
+            año_quiebre = resumen.loc[estacion, 'Año de quiebre']
+            if resumen.loc[estacion, 'Quiebre significativo'] and pd.notna(año_quiebre):
+                punto = curva[curva['Año'] == año_quiebre]
+                fig.add_trace(go.Scatter(
+                    x=punto['Acumulado referencia'],
+                    y=punto['Acumulado estación'],
+                    mode='markers',
+                    marker=dict(size=14, color=color, symbol='x', line=dict(width=2, color='#1e3d6b')),
+                    name=f'Quiebre {estacion} ({año_quiebre})',
+                    hovertemplate=f"<b>Quiebre {año_quiebre}</b><br>Razón de pendientes: {resumen.loc[estacion, 'Razón de pendientes']:.2f}<extra></extra>"
+                ))
+
         fig.update_layout(
             title=dict(
-                text=f'Dispersión de Precipitación por Mes',
+                text='Curvas de Doble Masa<br><sup>Estación vs promedio de estaciones vecinas</sup>',
                 x=0.5,
                 xanchor='center',
                 font=dict(size=18, color='#1e3d6b')
             ),
-            xaxis_title='Mes',
-            yaxis_title='Precipitación Mensual (mm)',
+            xaxis_title=f'{variable} acumulada de referencia ({unidad})',
+            yaxis_title=f'{variable} acumulada de la estación ({unidad})',
             hovermode='closest',
             plot_bgcolor='white',
             paper_bgcolor='grey',
@@ -748,9 +4212,7 @@ def Grafica_dispercion_mensual(data_df, metadata):
                 size=12,
                 color="#333333"
             ),
-            xaxis={'categoryorder': 'array', 'categoryarray': month_order},
             legend=dict(
-                title_text='Mes',
                 orientation="h",
                 yanchor="bottom",
                 y=1.02,
@@ -758,67 +4220,113 @@ def Grafica_dispercion_mensual(data_df, metadata):
                 x=1,
                 font=dict(
                     color="#333333",
-                    size=10
+                    size=12
                 )
             ),
             margin=dict(l=50, r=50, t=100, b=50)
         )
-        
-        
+
         return fig
-    
+
     except Exception as e:
-        st.error(f"Error al generar gráfico de dispersión mensual: {str(e)}")
+        st.error(f"Error al generar gráfico de doble masa: {str(e)}")
         return Crear_figura("Error al generar gráfico")
 
-def Grafico_precipitacion_anual(data_df, metadata):
-    """Gráfico de precipitación acumulada anual"""
-    if data_df.empty:
+def Mapa_calor_completitud(calidad):
+    """Heatmap estación × año de la completitud de los datos"""
+    if calidad.empty:
         return Crear_figura("No hay datos disponibles")
-    
+
     try:
-        annual_cum = data_df.groupby('Año')['Precipitación (mm)'].sum().reset_index()
-        
-        annual_cum = annual_cum.sort_values('Año')
-        annual_cum['Acumulado'] = annual_cum['Precipitación (mm)'].cumsum()
-        
+        completitud = calidad.pivot(index='Estación', columns='Año', values='Completitud')
+        problemas = calidad.assign(
+            Texto=lambda d: (
+                "Meses: " + d['Meses con datos'].astype(str) +
+                "<br>Racha faltante: " + d['Racha faltante máxima'].astype(str) +
+                "<br>Duplicados: " + d['Duplicados'].astype(str) +
+                "<br>Negativos/Implausibles: " + (d['Negativos'] + d['Implausibles']).astype(str) +
+                "<br>Atípicos: " + d['Atípicos'].astype(str)
+            )
+        ).pivot(index='Estación', columns='Año', values='Texto')
+
+        fig = go.Figure(go.Heatmap(
+            z=completitud.to_numpy(),
+            x=completitud.columns,
+            y=completitud.index,
+            text=problemas.reindex_like(completitud).to_numpy(),
+            zmin=0,
+            zmax=1,
+            colorscale='RdYlGn',
+            colorbar=dict(title='Completitud', tickformat='.0%'),
+            hovertemplate="<b>%{y} - %{x}</b><br>Completitud: %{z:.0%}<br>%{text}<extra></extra>"
+        ))
+
+        fig.update_layout(
+            title=dict(
+                text='Completitud de Datos por Estación y Año',
+                x=0.5,
+                xanchor='center',
+                font=dict(size=18, color='#1e3d6b')
+            ),
+            xaxis_title='Año',
+            yaxis_title='Estación',
+            plot_bgcolor='white',
+            paper_bgcolor='grey',
+            font=dict(
+                family="Arial",
+                size=12,
+                color="#333333"
+            ),
+            height=max(350, 25 * len(completitud) + 150),
+            margin=dict(l=50, r=50, t=100, b=50)
+        )
+
+        return fig
+
+    except Exception as e:
+        st.error(f"Error al generar el mapa de completitud: {str(e)}")
+        return Crear_figura("Error al generar gráfico")
+
+def Grafica_componentes_principales(eof, modo):
+    """Serie temporal de la componente principal de un modo EOF con su media móvil de 12 meses"""
+    if eof is None:
+        return Crear_figura("No hay datos disponibles")
+
+    try:
+        componentes = eof['componentes']
+        indice = int(modo.split()[-1]) - 1
+        varianza = eof['varianza'][indice]
+
         fig = go.Figure()
-        
+
         fig.add_trace(go.Bar(
-            x=annual_cum['Año'],
-            y=annual_cum['Precipitación (mm)'],
-            name='Precipitación anual',
-            marker_color='#4a7cb1',
-            opacity=0.7,
-            hovertemplate="<b>Año %{x}</b><br>Precipitación: %{y:.1f} mm<extra></extra>"
+            x=componentes['Fecha'],
+            y=componentes[modo],
+            name=f'PC {indice + 1}',
+            marker_color=np.where(componentes[modo] >= 0, '#4a7cb1', '#d73027'),
+            hovertemplate="<b>%{x|%b %Y}</b><br>Amplitud: %{y:.2f}<extra></extra>"
         ))
-        
+
         fig.add_trace(go.Scatter(
-            x=annual_cum['Año'],
-            y=annual_cum['Acumulado'],
-            mode='lines+markers',
-            name='Acumulado',
-            line=dict(color="#4dff00", width=3),
-            marker=dict(size=8),
-            yaxis='y2',
-            hovertemplate="<b>Año %{x}</b><br>Acumulado: %{y:.1f} mm<extra></extra>"
+            x=componentes['Fecha'],
+            y=componentes[modo].rolling(12, center=True, min_periods=6).mean(),
+            mode='lines',
+            name='Media móvil 12 meses',
+            line=dict(color='#1e3d6b', width=2),
+            hovertemplate="<b>%{x|%b %Y}</b><br>Media móvil: %{y:.2f}<extra></extra>"
         ))
-        
+
         fig.update_layout(
             title=dict(
-                text=f'Precipitación Anual y Acumulada<br><sup>{metadata.get("Estación", "")}</sup>',
+                text=f'Componente Principal {indice + 1}<br><sup>{varianza:.1%} de la varianza explicada</sup>',
                 x=0.5,
                 xanchor='center',
-                font=dict(size=18, color="#141466")
-            ),
-            xaxis_title='Año',
-            yaxis_title='Precipitación Anual (mm)',
-            yaxis2=dict(
-                title='Precipitación Acumulada (mm)',
-                overlaying='y',
-                side='right'
+                font=dict(size=18, color='#1e3d6b')
             ),
+            xaxis_title='Fecha',
+            yaxis_title='Amplitud (desviaciones estándar)',
             hovermode='x unified',
+            bargap=0,
             plot_bgcolor='white',
             paper_bgcolor='grey',
             font=dict(
@@ -839,44 +4347,69 @@ def Grafico_precipitacion_anual(data_df, metadata):
             ),
             margin=dict(l=50, r=50, t=100, b=50)
         )
-        
+
         return fig
-    
+
     except Exception as e:
-        st.error(f"Error al generar gráfico de precipitación acumulada: {str(e)}")
+        st.error(f"Error al generar gráfico de componentes principales: {str(e)}")
         return Crear_figura("Error al generar gráfico")
 
-def Grafico_violin_mensual(data_df, metadata):
-    """Gráfico de violín para distribución mensual"""
-    if data_df.empty:
+def Grafica_regimenes(regionalizacion):
+    """Climatologías mensuales de las estaciones superpuestas y coloreadas por grupo de régimen"""
+    if regionalizacion is None:
         return Crear_figura("No hay datos disponibles")
-    
+
     try:
-        month_order = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 
-                      'Jul', 'Ago', 'Set', 'Oct', 'Nov', 'Dic']
-        
-        fig = px.violin(
-            data_df,
-            x='Mes',
-            y='Precipitación (mm)',
-            color='Mes',
-            category_orders={"Mes": month_order},
-            box=True,
-            points="all",
-            hover_data=['Año'],
-            labels={'Precipitación (mm)': 'Precipitación Mensual (mm)'},
-            color_discrete_sequence=px.colors.qualitative.Pastel
-        )
-        
+        asignacion = regionalizacion['asignacion'].dropna(subset=['Grupo'])
+        climatologias = regionalizacion['climatologias']
+        regimenes = regionalizacion['regimenes']
+        colores = px.colors.qualitative.Plotly
+        meses = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Set', 'Oct', 'Nov', 'Dic']
+
+        fig = go.Figure()
+
+        # Estaciones individuales en una sola traza por grupo (separadas con None)
+        for grupo in regimenes.index:
+            miembros = asignacion.loc[asignacion['Grupo'] == grupo, 'Estación']
+            valores = climatologias.loc[miembros].to_numpy()
+            x = np.tile(meses + [None], len(valores))
+            y = np.hstack([valores, np.full((len(valores), 1), np.nan)]).ravel()
+            fig.add_trace(go.Scatter(
+                x=x,
+                y=y,
+                mode='lines',
+                line=dict(color=colores[(grupo - 1) % len(colores)], width=1),
+                opacity=0.25,
+                name=f'Estaciones grupo {grupo}',
+                legendgroup=str(grupo),
+                showlegend=False,
+                hoverinfo='skip'
+            ))
+
+        for grupo in regimenes.index:
+            regimen = asignacion.loc[asignacion['Grupo'] == grupo, 'Régimen'].iloc[0]
+            n = int((asignacion['Grupo'] == grupo).sum())
+            fig.add_trace(go.Scatter(
+                x=meses,
+                y=regimenes.loc[grupo],
+                mode='lines+markers',
+                line=dict(color=colores[(grupo - 1) % len(colores)], width=3),
+                marker=dict(size=7),
+                name=f'Grupo {grupo}: {regimen} ({n} est.)',
+                legendgroup=str(grupo),
+                hovertemplate=f"<b>Grupo {grupo} - %{{x}}</b><br>Promedio: %{{y:.1f}} mm<extra></extra>"
+            ))
+
         fig.update_layout(
             title=dict(
-                text=f'Distribución de Precipitación por Mes<br><sup>{metadata.get("Estación", "")}</sup>',
+                text='Regímenes Pluviométricos<br><sup>Climatología mensual promedio por grupo</sup>',
                 x=0.5,
                 xanchor='center',
                 font=dict(size=18, color='#1e3d6b')
             ),
             xaxis_title='Mes',
-            yaxis_title='Precipitación Mensual (mm)',
+            yaxis_title='Precipitación media (mm)',
+            hovermode='x unified',
             plot_bgcolor='white',
             paper_bgcolor='grey',
             font=dict(
@@ -884,60 +4417,114 @@ def Grafico_violin_mensual(data_df, metadata):
                 size=12,
                 color="#333333"
             ),
-            showlegend=False,
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1,
+                font=dict(
+                    color="#333333",
+                    size=12
+                )
+            ),
             margin=dict(l=50, r=50, t=100, b=50)
         )
-        
-        fig.update_traces(
-            hovertemplate="<b>Mes:</b> %{x}<br><b>Precipitación:</b> %{y:.1f} mm<extra></extra>",
-            hoveron="points+violins"
-        )
-        
+
         return fig
-    
+
     except Exception as e:
-        st.error(f"Error al generar gráfico de violín: {str(e)}")
+        st.error(f"Error al generar gráfico de regímenes: {str(e)}")
         return Crear_figura("Error al generar gráfico")
 
-def Grafica_anomalia_anual(data_df, metadata):
-    """Gráfico de anomalías anuales"""
-    if data_df.empty:
+def Mapa_calor_correlacion(correlacion):
+    """Heatmap de la matriz de correlación entre estaciones, ordenada por agrupamiento"""
+    if correlacion is None:
         return Crear_figura("No hay datos disponibles")
-    
+
     try:
-        annual_data = data_df.groupby('Año')['Precipitación (mm)'].sum().reset_index()
-        avg_precip = annual_data['Precipitación (mm)'].mean()
-        
-        annual_data['Anomalía'] = annual_data['Precipitación (mm)'] - avg_precip
-        annual_data['Color'] = np.where(annual_data['Anomalía'] >= 0, '#4a7cb1', '#ff8c00')
-        
-        fig = go.Figure()
-        
-        fig.add_trace(go.Bar(
-            x=annual_data['Año'],
-            y=annual_data['Anomalía'],
-            marker_color=annual_data['Color'],
-            name='Anomalía',
-            hovertemplate="<b>Año %{x}</b><br>Anomalía: %{y:.1f} mm<extra></extra>"
+        estaciones = correlacion['estaciones']
+        metodo = 'Spearman' if correlacion['metodo'] == 'spearman' else 'Pearson'
+
+        fig = go.Figure(go.Heatmap(
+            z=correlacion['r'],
+            x=estaciones,
+            y=estaciones,
+            customdata=correlacion['n'],
+            zmin=-1,
+            zmax=1,
+            colorscale='RdBu',
+            colorbar=dict(title='r'),
+            hovertemplate="<b>%{y} - %{x}</b><br>r: %{z:.2f}<br>Meses en común: %{customdata}<extra></extra>"
         ))
-        
-        fig.add_hline(
-            y=0,
-            line_dash="dash",
-            line_color="#1e3d6b",
-            annotation_text=f"Promedio: {avg_precip:.1f} mm",
-            annotation_position="bottom right"
+
+        fig.update_layout(
+            title=dict(
+                text=f'Correlación de Anomalías Mensuales ({metodo})<br><sup>Estaciones ordenadas por similitud</sup>',
+                x=0.5,
+                xanchor='center',
+                font=dict(size=18, color='#1e3d6b')
+            ),
+            plot_bgcolor='white',
+            paper_bgcolor='grey',
+            font=dict(
+                family="Arial",
+                size=12,
+                color="#333333"
+            ),
+            yaxis=dict(autorange='reversed'),
+            height=max(400, 25 * len(estaciones) + 200),
+            margin=dict(l=50, r=50, t=100, b=50)
         )
-        
+
+        return fig
+
+    except Exception as e:
+        st.error(f"Error al generar la matriz de correlación: {str(e)}")
+        return Crear_figura("Error al generar gráfico")
+
+def Grafica_piramide(tabla, resolucion, nivel, variable='Precipitación'):
+    """Series de una resolución de la pirámide de agregados, una línea por estación o región"""
+    series = [c for c in tabla.columns if c not in ('Período', 'Fecha')]
+    if tabla.empty or not series:
+        return Crear_figura("No hay datos disponibles")
+
+    try:
+        colores = px.colors.qualitative.Plotly
+        definicion = VARIABLES[variable]
+        unidad = definicion['unidad']
+        agregado = NOMBRES_AGREGACION[definicion['agregacion']]
+        etiquetas_y = {
+            'Mensual': f'{variable} mensual ({unidad})',
+            'Estacional': f'{agregado} estacional ({unidad})',
+            'Anual': f'{agregado} anual ({unidad})',
+            'Decadal': f'Promedio de la década del {agregado.lower()} anual ({unidad})'
+        }
+
+        fig = go.Figure()
+
+        for i, serie in enumerate(series):
+            fig.add_trace(go.Scatter(
+                x=tabla['Fecha'],
+                y=tabla[serie],
+                customdata=tabla['Período'],
+                mode='lines+markers' if resolucion == 'Decadal' else 'lines',
+                name=str(serie),
+                connectgaps=False,
+                line=dict(color=colores[i % len(colores)], width=2),
+                hovertemplate=f"<b>%{{customdata}}</b><br>{serie}: %{{y:.1f}} {unidad}<extra></extra>"
+            ))
+
         fig.update_layout(
             title=dict(
-                text=f'Anomalías de Precipitación Anual<br><sup>{metadata.get("Estación", "")}</sup>',
+                text=f'{variable} {resolucion} por {nivel}',
                 x=0.5,
                 xanchor='center',
                 font=dict(size=18, color='#1e3d6b')
             ),
-            xaxis_title='Año',
-            yaxis_title='Anomalía (mm)',
+            xaxis_title='Fecha',
+            yaxis_title=etiquetas_y[resolucion],
+            hovermode='x unified',
             plot_bgcolor='white',
             paper_bgcolor='grey',
             font=dict(
@@ -945,14 +4532,24 @@ def Grafica_anomalia_anual(data_df, metadata):
                 size=12,
                 color="#333333"
             ),
-            showlegend=False,
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="right",
+                x=1,
+                font=dict(
+                    color="#333333",
+                    size=12
+                )
+            ),
             margin=dict(l=50, r=50, t=100, b=50)
         )
-        
+
         return fig
-    
+
     except Exception as e:
-        st.error(f"Error al generar gráfico de anomalías: {str(e)}")
+        st.error(f"Error al generar gráfico de agregados: {str(e)}")
         return Crear_figura("Error al generar gráfico")
 
 def Ubicacion(metadata):
@@ -1017,82 +4614,738 @@ def Ubicacion(metadata):
     except Exception as e:
         st.error(f"Error al generar el mapa: {str(e)}")
 
-def MostrarMetada(metadata):
-    """Muestra los metadatos de la estación en la barra lateral"""
-    st.markdown(f"""
-        <div class="station-info">
-            <h3>{metadata.get('Estación', 'Estación Desconocida')}</h3>
-            <div class="station-info-grid">
-                <div class="info-item">
-                    <div class="info-label">Ubicación</div>
-                    <div class="info-value">
-                        {metadata.get('Ámbito Político', {}).get('Departamento', '')} / 
-                        {metadata.get('Ámbito Político', {}).get('Provincia', '')} / 
-                        {metadata.get('Ámbito Político', {}).get('Distrito', '')}
-                    </div>
-                </div>
-                <div class="info-item">
-                    <div class="info-label">Coordenadas</div>
-                    <div class="info-value">
-                        Lat: {metadata.get('Coordenadas', {}).get('Latitud', '--')}<br>
-                        Lon: {metadata.get('Coordenadas', {}).get('Longitud', '--')}<br>
-                        Alt: {metadata.get('Coordenadas', {}).get('Altitud', '--')}
-                    </div>
-                </div>
-                <div class="info-item">
-                    <div class="info-label">Variable</div>
-                    <div class="info-value">{metadata.get('Variable', '')}</div>
-                </div>
-                <div class="info-item">
-                    <div class="info-label">Cuenca</div>
-                    <div class="info-value">{metadata.get('Cuenca', '')}</div>
-                </div>
-                <div class="info-item">
-                    <div class="info-label">Operador</div>
-                    <div class="info-value">{metadata.get('Operador', '')}</div>
-                </div>
-                <div class="info-item">
-                    <div class="info-label">Período de Datos</div>
-                    <div class="info-value">{metadata.get('Periodo', 'Desconocido')}</div>
-                </div>
-            </div>
-        </div>
-    """, unsafe_allow_html=True)
+def MostrarMetada(metadata):
+    """Muestra los metadatos de la estación en la barra lateral"""
+    st.markdown(f"""
+        <div class="station-info">
+            <h3>{metadata.get('Estación', 'Estación Desconocida')}</h3>
+            <div class="station-info-grid">
+                <div class="info-item">
+                    <div class="info-label">Ubicación</div>
+                    <div class="info-value">
+                        {metadata.get('Ámbito Político', {}).get('Departamento', '')} / 
+                        {metadata.get('Ámbito Político', {}).get('Provincia', '')} / 
+                        {metadata.get('Ámbito Político', {}).get('Distrito', '')}
+                    </div>
+                </div>
+                <div class="info-item">
+                    <div class="info-label">Coordenadas</div>
+                    <div class="info-value">
+                        Lat: {metadata.get('Coordenadas', {}).get('Latitud', '--')}<br>
+                        Lon: {metadata.get('Coordenadas', {}).get('Longitud', '--')}<br>
+                        Alt: {metadata.get('Coordenadas', {}).get('Altitud', '--')}
+                    </div>
+                </div>
+                <div class="info-item">
+                    <div class="info-label">Variable</div>
+                    <div class="info-value">{metadata.get('Variable', '')}</div>
+                </div>
+                <div class="info-item">
+                    <div class="info-label">Cuenca</div>
+                    <div class="info-value">{metadata.get('Cuenca', '')}</div>
+                </div>
+                <div class="info-item">
+                    <div class="info-label">Operador</div>
+                    <div class="info-value">{metadata.get('Operador', '')}</div>
+                </div>
+                <div class="info-item">
+                    <div class="info-label">Período de Datos</div>
+                    <div class="info-value">{metadata.get('Periodo', 'Desconocido')}</div>
+                </div>
+            </div>
+        </div>
+    """, unsafe_allow_html=True)
+
+def Mostrar_resumen_barra_lateral(filtered_df):
+    """Muestra estadísticas resumen en la barra lateral"""
+    st.markdown("### Resumen Estadístico")
+    
+    if not filtered_df.empty:
+        total_years = filtered_df['Año'].nunique()
+        var = Descripcion_variable(filtered_df)
+        avg_precip = filtered_df[var['columna']].mean()
+        max_precip = filtered_df[var['columna']].max()
+        min_precip = filtered_df[var['columna']].min()
+        data_coverage = len(filtered_df) / (total_years * 12)
+        
+        st.markdown(f"""
+            <div class="metric-card">
+                <div class="metric-title">Años de Datos</div>
+                <div class="metric-value">{total_years}</div>
+            </div>
+            <div class="metric-card">
+                <div class="metric-title">Cobertura de Datos</div>
+                <div class="metric-value">{data_coverage:.0%}</div>
+            </div>
+            <div class="metric-card">
+                <div class="metric-title">{var['nombre']} Promedio</div>
+                <div class="metric-value">{avg_precip:.1f} {var['unidad']}</div>
+            </div>
+            <div class="metric-card">
+                <div class="metric-title">Máxima Registrada</div>
+                <div class="metric-value">{max_precip:.1f} {var['unidad']}</div>
+            </div>
+            <div class="metric-card">
+                <div class="metric-title">Mínima Registrada</div>
+                <div class="metric-value">{min_precip:.1f} {var['unidad']}</div>
+            </div>
+        """, unsafe_allow_html=True)
+
+def Cronometrado(funcion):
+    """Registra en la sesión la duración de la última ejecución de un panel"""
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            st.session_state.setdefault('tiempos', {})[funcion.__name__] = time.perf_counter() - inicio
+    return envoltura
+
+def Mostrar_cache_barra_lateral(cache):
+    """Uso de la caché de estaciones compartida entre sesiones"""
+    metricas = cache.metricas()
+    with st.sidebar.expander("🗄️ CACHÉ COMPARTIDA"):
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Estaciones", metricas['Estaciones'])
+            st.metric("Aciertos", f"{metricas['Tasa de aciertos']:.0%}")
+        with col2:
+            st.metric("Memoria", f"{metricas['Memoria (MB)']:.1f} MB")
+            st.metric("Desalojos", metricas['Desalojos'])
+        st.caption(
+            f"{metricas['Aciertos']} aciertos, {metricas['Fallos']} fallos; "
+            f"presupuesto {metricas['Presupuesto (MB)']:.0f} MB"
+        )
+
+def Mostrar_memoria_barra_lateral():
+    """Memoria ocupada por la sesión frente a su presupuesto"""
+    memoria = Memoria_sesion()
+    if memoria.empty:
+        return
+    propia = memoria.loc[memoria['Tipo'] != 'Compartido', 'MB'].sum()
+    with st.sidebar.expander("💾 MEMORIA DE LA SESIÓN"):
+        st.metric(
+            "Memoria propia",
+            f"{propia:.1f} MB",
+            help=f"Presupuesto de artefactos: {PRESUPUESTO_SESION_MB:.0f} MB (CUENCAS_SESION_MB)"
+        )
+        st.dataframe(
+            memoria.style.format({'MB': '{:.2f}'}),
+            hide_index=True,
+            use_container_width=True
+        )
+        descartados = st.session_state.get('artefactos_descartados', 0)
+        if descartados:
+            st.caption(f"{descartados} artefactos descartados por el presupuesto")
+
+def Mostrar_tiempos_barra_lateral():
+    """Duración de la última ejecución completa y de cada panel que se recalcula por separado"""
+    tiempos = st.session_state.get('tiempos', {})
+    if not tiempos:
+        return
+    with st.sidebar.expander("⏱️ TIEMPOS DE EJECUCIÓN"):
+        st.dataframe(
+            pd.DataFrame({
+                'Panel': list(tiempos),
+                'Segundos': list(tiempos.values())
+            }).style.format({'Segundos': '{:.3f}'}),
+            hide_index=True,
+            use_container_width=True
+        )
+
+def Panel_trabajo(trabajo_id, formato=None):
+    """Progreso y resultados de un trabajo en segundo plano; solo se consulta periódicamente mientras está activo"""
+    estado = Gestor_trabajos_compartido().estado(trabajo_id)
+    if estado['estado'] in ('pendiente', 'en curso'):
+        _Progreso_trabajo(trabajo_id, formato)
+        return
+
+    if estado['estado'] == 'desconocido':
+        st.info("El trabajo ya no está disponible; recargue la página para calcularlo de nuevo")
+        return
+
+    texto = _Texto_trabajo(estado)
+    if estado['estado'] in ('cancelado', 'error'):
+        if estado['estado'] == 'cancelado':
+            st.warning(f"{texto}. Trabajo cancelado")
+        else:
+            st.error(f"{texto}. Error: {estado['error']}")
+        # Al olvidarlo en la sesión, la nueva ejecución lo vuelve a enviar (el gestor no reutiliza estos trabajos)
+        if st.button("Volver a calcular", key=f'reiniciar_{trabajo_id}'):
+            propios = st.session_state.get('trabajos', {})
+            st.session_state['trabajos'] = {c: t for c, t in propios.items() if t != trabajo_id}
+            st.rerun(scope='app')
+    else:
+        st.caption(texto)
+    _Resultados_trabajo(estado, formato)
+
+@st.fragment(run_every=1.0)
+def _Progreso_trabajo(trabajo_id, formato):
+    """Barra de progreso y resultados parciales; se refresca sin recargar la página"""
+    gestor = Gestor_trabajos_compartido()
+    estado = gestor.estado(trabajo_id)
+    if estado['estado'] not in ('pendiente', 'en curso'):
+        # Trabajo concluido: una última ejecución completa lo dibuja fuera del fragmento y deja de consultar
+        st.rerun(scope='app')
+
+    col1, col2 = st.columns([5, 1])
+    with col1:
+        st.progress(estado['progreso'], text=_Texto_trabajo(estado))
+    with col2:
+        if st.button("Cancelar", key=f'cancelar_{trabajo_id}'):
+            gestor.cancelar(trabajo_id)
+            st.rerun(scope='app')
+    _Resultados_trabajo(estado, formato)
+
+def _Texto_trabajo(estado):
+    return f"{estado['nombre']}: {estado['completadas']}/{estado['total']} ({estado['estado']}, {estado['duracion']:.1f} s)"
+
+def _Resultados_trabajo(estado, formato):
+    parciales = [r for r in estado['resultados'] if r is not None]
+    if parciales:
+        tabla = pd.DataFrame(parciales)
+        st.dataframe(tabla.style.format(formato, na_rep='--') if formato else tabla, use_container_width=True)
+
+@st.fragment
+@Cronometrado
+def Panel_comparacion_mensual(filtered_df, metadata):
+    """Comparación de uno o varios años contra la envolvente histórica; cambiar los años solo recalcula este panel"""
+    years = sorted(filtered_df['Año'].unique(), reverse=True)
+    selected_years = st.multiselect(
+        "Seleccione los años a comparar",
+        options=years,
+        default=years[:1],
+        max_selections=6,
+        key='year_selector'
+    )
+
+    # La envolvente depende solo de los filtros: se reutiliza al cambiar los años
+    envolvente = Envolvente_climatologica(filtered_df)
+    fig = Grafica_comparacion_mensual(filtered_df, metadata, sorted(selected_years), envolvente)
+    st.plotly_chart(fig, use_container_width=True)
+    show_interpretation(*Interpretacion('comparacion', Variable_datos(filtered_df)))
+
+@st.fragment
+@Cronometrado
+def Panel_mapa_cuenca(piramide, coordenadas, estaciones, variable=VARIABLE_PREDETERMINADA):
+    """Mapa de estaciones de la cuenca coloreado por el estadístico elegido"""
+    st.markdown("<div class='plot-title'>Mapa de Estaciones</div>", unsafe_allow_html=True)
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        # Las opciones no dependen de la unidad para conservar la elección al cambiar de variable
+        unidad = VARIABLES[variable]['unidad']
+        estadisticos = {'promedio': f'Promedio anual ({unidad})', 'tendencia': f'Tendencia ({unidad}/año)', 'completitud': 'Completitud'}
+        estadistico_mapa = estadisticos[st.selectbox(
+            "ESTADÍSTICO A REPRESENTAR",
+            options=list(estadisticos),
+            format_func=estadisticos.get,
+            key='mapa_estadistico'
+        )]
+    with col2:
+        agrupar_mapa = st.checkbox(
+            "Agrupar estaciones cercanas",
+            value=len(estaciones) > 50,
+            key='mapa_agrupar'
+        )
+    # Los mapas de EOF y regímenes leen la misma opción: al cambiarla se redibuja la página completa
+    agrupar_previo = st.session_state.get('mapa_agrupar_previo', agrupar_mapa)
+    st.session_state['mapa_agrupar_previo'] = agrupar_mapa
+    if agrupar_previo != agrupar_mapa:
+        st.rerun(scope='app')
+
+    estadisticos_estaciones = Estadisticos_estaciones(piramide, unidad)
+    puntos_mapa = tuple(
+        (nombre, *coordenadas.get(nombre, (np.nan, np.nan)), float(valor))
+        for nombre, valor in zip(
+            estadisticos_estaciones['Estación'],
+            estadisticos_estaciones[estadistico_mapa]
+        )
+    )
+    mapa_html = Mapa_cuenca_html(puntos_mapa, estadistico_mapa, agrupar_mapa)
+    if mapa_html is None:
+        st.warning("No se encontraron coordenadas en los metadatos")
+    else:
+        components.html(mapa_html, height=520)
+
+@st.fragment
+@Cronometrado
+def Panel_calidad(cubo_regional, variable=VARIABLE_PREDETERMINADA, duplicados=None):
+    """Heatmap y resumen de calidad de datos con su propio criterio de atípicos"""
+    st.markdown("<div class='plot-title'>Calidad y Completitud de Datos</div>", unsafe_allow_html=True)
+    metodo_atipicos = st.radio(
+        "CRITERIO DE VALORES ATÍPICOS",
+        options=['iqr', 'zscore'],
+        format_func=lambda m: "Rango intercuartílico (3×IQR)" if m == 'iqr' else "Puntaje z mensual (|z| > 3)",
+        horizontal=True,
+        key='calidad_metodo'
+    )
+    calidad = Matriz_calidad(cubo_regional, variable, metodo_atipicos, duplicados=duplicados)
+    fig_calidad = Mapa_calor_completitud(calidad)
+    st.plotly_chart(fig_calidad, use_container_width=True)
+
+    if not calidad.empty:
+        resumen_calidad = calidad.groupby('Estación').agg(**{
+            'Años': ('Año', 'size'),
+            'Completitud media': ('Completitud', 'mean'),
+            'Años completos': ('Meses con datos', lambda m: int((m == 12).sum())),
+            'Racha faltante máxima': ('Racha faltante máxima', 'max'),
+            'Duplicados': ('Duplicados', 'sum'),
+            'Negativos': ('Negativos', 'sum'),
+            'Implausibles': ('Implausibles', 'sum'),
+            'Atípicos': ('Atípicos', 'sum')
+        }).reset_index()
+        st.dataframe(
+            resumen_calidad.style.format({'Completitud media': '{:.0%}'}),
+            use_container_width=True
+        )
+    show_interpretation(
+    "Calidad de los Datos",
+    """
+    <div class="highlight-tip">
+        Resume la disponibilidad y consistencia de los registros antes de cualquier análisis.
+    </div>
+
+    <ul>
+        <li><span class="key-term">Completitud:</span> Fracción de los 12 meses con dato en cada año</li>
+        <li><span class="key-term">Racha faltante:</span> Mayor número de meses consecutivos sin dato en el año</li>
+        <li><span class="key-term">Duplicados:</span> Meses registrados más de una vez (filas de año repetidas)</li>
+        <li><span class="key-term">Negativos/Implausibles:</span> Valores fuera del rango físico de la variable (en precipitación, &lt; 0 mm o &gt; 1500 mm mensuales)</li>
+        <li><span class="key-term">Atípicos:</span> Valores extremos respecto al mismo mes de la estación</li>
+    </ul>
+
+    <div class="divider"></div>
+
+    <div class="highlight-tip" style="background:#e8f5e9;border-left:3px solid #4caf50;">
+        <strong>Tip:</strong> Use el filtro de mínimo de meses por año en la barra lateral para descartar años incompletos.
+    </div>
+    """,
+    icon="🧹"
+)
+
+@st.fragment
+@Cronometrado
+def Panel_rachas(cubo_regional, variable, clave, titulo='', year_range=None):
+    """Rachas secas y húmedas con su propio criterio de umbral; con varias estaciones muestra el resumen de todas"""
+    st.markdown("<div class='plot-title'>Rachas Secas y Húmedas</div>", unsafe_allow_html=True)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        tipo_umbral = st.radio(
+            "CRITERIO DE MES SECO / HÚMEDO",
+            options=list(TIPOS_UMBRAL_RACHAS),
+            format_func=TIPOS_UMBRAL_RACHAS.get,
+            key=f'{clave}_tipo'
+        )
+    with col2:
+        if tipo_umbral == 'percentil':
+            seco, humedo = st.slider(
+                "PERCENTILES SECO Y HÚMEDO",
+                min_value=5,
+                max_value=95,
+                value=(20, 80),
+                step=5,
+                key=f'{clave}_percentiles'
+            )
+        else:
+            unidad = VARIABLES[variable]['unidad']
+            seco = st.number_input(f"SECO: MENOS DE ({unidad})", min_value=0.0, value=10.0, step=5.0, key=f'{clave}_seco_mm')
+            humedo = st.number_input(f"HÚMEDO: MÁS DE ({unidad})", min_value=0.0, value=100.0, step=10.0, key=f'{clave}_humedo_mm')
+    with col3:
+        duracion_minima = st.slider(
+            "DURACIÓN MÍNIMA (MESES)",
+            min_value=1,
+            max_value=12,
+            value=2,
+            key=f'{clave}_duracion'
+        )
+
+    rachas = Rachas(cubo_regional, variable, tipo_umbral, float(seco), float(humedo))
+    resumen = Resumen_rachas(rachas, cubo_regional, duracion_minima, year_range)
+    estaciones = list(resumen['Estación'].unique()) if not resumen.empty else []
+
+    if len(estaciones) > 1:
+        st.dataframe(
+            resumen.style.format({
+                'Racha más larga (meses)': '{:.0f}',
+                'Duración media (meses)': '{:.1f}',
+                'Inicio de la más larga': lambda f: f.strftime('%b %Y') if pd.notna(f) else '--',
+                'Eventos por década': '{:.1f}',
+                'Período de retorno (años)': '{:.1f}'
+            }, na_rep='--'),
+            hide_index=True,
+            use_container_width=True
+        )
+        estacion = st.selectbox("ESTACIÓN A GRAFICAR", options=estaciones, key=f'{clave}_estacion')
+        titulo = estacion
+        rachas = rachas[rachas['Estación'] == estacion]
+    elif estaciones:
+        columnas = st.columns(4)
+        for (tipo, fila), columna in zip(resumen.set_index('Tipo').iterrows(), columnas[::2]):
+            with columna:
+                st.metric(
+                    f"Racha {tipo.lower()} más larga",
+                    f"{fila['Racha más larga (meses)']:.0f} meses" if pd.notna(fila['Racha más larga (meses)']) else "--",
+                    help=f"Inicio: {fila['Inicio de la más larga']:%b %Y}" if pd.notna(fila['Inicio de la más larga']) else None
+                )
+        for (tipo, fila), columna in zip(resumen.set_index('Tipo').iterrows(), columnas[1::2]):
+            with columna:
+                st.metric(
+                    f"Rachas {tipo.lower()}s",
+                    f"{fila['Eventos']} eventos",
+                    help=(
+                        f"{fila['Eventos por década']:.1f} por década; una cada {fila['Período de retorno (años)']:.1f} años"
+                        if fila['Eventos'] else None
+                    )
+                )
+
+    fig_rachas = Grafica_rachas(rachas, titulo, duracion_minima, year_range)
+    st.plotly_chart(fig_rachas, use_container_width=True, key=f'{clave}_grafica')
+    show_interpretation(
+    "Rachas de Meses Secos y Húmedos",
+    """
+    <div class="highlight-tip">
+        Identifica períodos de meses consecutivos por debajo (secos) o por encima (húmedos) de un umbral.
+    </div>
+
+    <ul>
+        <li><span class="key-term">Percentil:</span> Umbral propio de cada mes calendario y estación (un mes seco lo es para su época del año)</li>
+        <li><span class="key-term">Umbral fijo:</span> Milímetros absolutos; en la temporada seca casi todos los meses serán secos</li>
+        <li><span class="key-term">Barras:</span> Cada racha ocupa los meses que dura; las secas hacia abajo</li>
+        <li><span class="key-term">Barras tenues:</span> Rachas cortadas por meses faltantes o por el borde del registro (su duración real puede ser mayor)</li>
+        <li><span class="key-term">Período de retorno:</span> Años con datos divididos entre el número de rachas de la duración mínima</li>
+    </ul>
+
+    <div class="divider"></div>
+
+    <div class="highlight-tip" style="background:#fff8e1;border-left:3px solid #ffc107">
+        <strong>Nota:</strong> Se usa el registro completo (sin el filtro de meses) para no romper la continuidad de las rachas.
+    </div>
+    """,
+    icon="⏳"
+)
+
+@st.fragment
+@Cronometrado
+def Panel_doble_masa(cubo_regional, coordenadas, variable=VARIABLE_PREDETERMINADA):
+    """Curvas de doble masa con selección de vecinas y estaciones a graficar"""
+    estaciones = cubo_regional[0]
+    st.markdown("<div class='plot-title'>Análisis de Doble Masa</div>", unsafe_allow_html=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        n_vecinos = st.slider(
+            "ESTACIONES VECINAS DE REFERENCIA (0 = todas)",
+            min_value=0,
+            max_value=len(estaciones) - 1,
+            value=0,
+            key='doble_masa_vecinos'
+        )
+    with col2:
+        seleccion_doble_masa = st.multiselect(
+            "ESTACIONES A GRAFICAR",
+            options=list(estaciones),
+            default=list(estaciones)[:6],
+            key='doble_masa_seleccion'
+        )
+
+    doble_masa = Analisis_doble_masa(cubo_regional, coordenadas, n_vecinos or None)
+    fig_doble_masa = Grafica_doble_masa(doble_masa, seleccion_doble_masa, variable)
+    st.plotly_chart(fig_doble_masa, use_container_width=True)
+
+    if doble_masa is not None:
+        st.dataframe(
+            doble_masa['resumen'].style.format({
+                'Pendiente global': '{:.3f}',
+                'Pendiente antes': '{:.3f}',
+                'Pendiente después': '{:.3f}',
+                'Razón de pendientes': '{:.2f}',
+                'p': '{:.3f}'
+            }, na_rep='--'),
+            use_container_width=True
+        )
+    show_interpretation(
+    "Curvas de Doble Masa",
+    f"""
+    <div class="highlight-tip">
+        Compara la {variable.lower()} acumulada de cada estación con la acumulada de una serie de referencia regional.
+    </div>
+
+    <ul>
+        <li><span class="key-term">Referencia:</span> Promedio anual de las demás estaciones (o de las vecinas más cercanas)</li>
+        <li><span class="key-term">Recta única:</span> Registro consistente con la región</li>
+        <li><span class="key-term">Quiebre (✕):</span> Año en que cambia la pendiente de la curva</li>
+        <li><span class="key-term">Razón de pendientes:</span> Factor para ajustar el tramo anterior al régimen actual</li>
+    </ul>
+
+    <div class="divider"></div>
+
+    <strong>Criterio de quiebre significativo:</strong>
+    <ul>
+        <li>Prueba F de dos tramos con p &lt; 0.05</li>
+        <li>Cambio de pendiente de al menos 10%</li>
+        <li>Al menos 5 años a cada lado del quiebre</li>
+    </ul>
+
+    <div class="highlight-tip" style="background:#fff8e1;border-left:3px solid #ffc107">
+        <strong>Nota:</strong> Solo se usan años completos (12 meses) y sin aplicar los filtros de la barra lateral.
+    </div>
+    """,
+    icon="⚖️"
+)
+
+@st.fragment
+@Cronometrado
+def Panel_correlacion(cubo_regional):
+    """Matriz de correlación entre estaciones con selección del método"""
+    st.markdown("<div class='plot-title'>Correlación entre Estaciones</div>", unsafe_allow_html=True)
+    metodo_correlacion = st.radio(
+        "MÉTODO DE CORRELACIÓN",
+        options=['pearson', 'spearman'],
+        format_func=str.capitalize,
+        horizontal=True,
+        key='correlacion_metodo'
+    )
+    correlacion = Correlacion_estaciones(cubo_regional, metodo_correlacion)
+    fig_correlacion = Mapa_calor_correlacion(correlacion)
+    st.plotly_chart(fig_correlacion, use_container_width=True)
+    show_interpretation(
+    "Correlación entre Estaciones",
+    """
+    <div class="highlight-tip">
+        Mide qué tan parecidas son las variaciones mensuales de cada par de estaciones.
+    </div>
+
+    <ul>
+        <li><span class="key-term">Anomalías:</span> Se resta la media de cada mes para no correlacionar solo el ciclo estacional</li>
+        <li><span class="key-term">Pearson:</span> Relación lineal; sensible a meses extremos</li>
+        <li><span class="key-term">Spearman:</span> Relación por rangos; más robusta ante valores atípicos</li>
+        <li><span class="key-term">Meses en común:</span> Cada par usa solo los meses con dato en ambas estaciones (mínimo 24)</li>
+    </ul>
+
+    <div class="divider"></div>
+
+    <strong>Análisis recomendado:</strong>
+    <ul>
+        <li>Los bloques de colores intensos agrupan estaciones con un mismo régimen</li>
+        <li>Una estación con correlación baja frente a sus vecinas puede tener problemas de registro</li>
+        <li>Las mejores vecinas (r alto) son candidatas para rellenar datos faltantes</li>
+    </ul>
+    """,
+    icon="🔗"
+)
+
+@st.fragment
+@Cronometrado
+def Panel_eof(cubo_regional, coordenadas):
+    """Mapa de cargas y componente principal del modo EOF elegido"""
+    estaciones = cubo_regional[0]
+    st.markdown("<div class='plot-title'>Modos de Variabilidad (EOF)</div>", unsafe_allow_html=True)
+    if len(estaciones) < 3:
+        st.info("El análisis EOF requiere al menos tres estaciones")
+    else:
+        col1, col2 = st.columns(2)
+        with col1:
+            base_eof = st.selectbox(
+                "PERÍODO BASE DE LAS ANOMALÍAS",
+                options=['Registro completo'] + list(NORMALES_OMM),
+                key='eof_periodo_base'
+            )
+        inicio_eof, fin_eof = NORMALES_OMM.get(base_eof, (None, None))
+        eof = Analisis_EOF(cubo_regional, inicio_eof, fin_eof)
+
+        if eof is None:
+            st.warning("No hay suficientes meses con datos simultáneos para el análisis EOF")
+        else:
+            with col2:
+                modo_eof = st.selectbox(
+                    "MODO",
+                    options=list(eof['cargas'].columns[1:]),
+                    format_func=lambda m: f"{m} ({eof['varianza'][int(m.split()[-1]) - 1]:.1%})",
+                    key='eof_modo'
+                )
+
+            puntos_eof = tuple(
+                (nombre, *coordenadas.get(nombre, (np.nan, np.nan)), float(valor))
+                for nombre, valor in zip(eof['cargas']['Estación'], eof['cargas'][modo_eof])
+            )
+            mapa_eof = Mapa_cuenca_html(puntos_eof, f'Carga {modo_eof}', st.session_state.get('mapa_agrupar', False))
+            if mapa_eof is not None:
+                components.html(mapa_eof, height=450)
+
+            fig_eof = Grafica_componentes_principales(eof, modo_eof)
+            st.plotly_chart(fig_eof, use_container_width=True)
+            st.caption(f"{eof['meses']} meses con datos en al menos la mitad de las estaciones")
+    show_interpretation(
+    "Funciones Ortogonales Empíricas",
+    """
+    <div class="highlight-tip">
+        Descompone las anomalías mensuales de todas las estaciones en patrones espaciales independientes.
+    </div>
+
+    <ul>
+        <li><span class="key-term">Carga (mapa):</span> Peso de cada estación en el modo; mismo signo = varían juntas</li>
+        <li><span class="key-term">Componente principal:</span> Evolución en el tiempo de la intensidad del modo</li>
+        <li><span class="key-term">Varianza explicada:</span> Fracción de la variabilidad regional que captura el modo</li>
+    </ul>
+
+    <div class="divider"></div>
+
+    <strong>Análisis recomendado:</strong>
+    <ul>
+        <li>EOF 1 con cargas del mismo signo: variabilidad común de toda la cuenca</li>
+        <li>EOF 2 con cargas de signo opuesto: contraste entre sectores (por ejemplo norte-sur o alto-bajo)</li>
+        <li>Compare los años extremos de la componente con eventos ENSO conocidos</li>
+    </ul>
+
+    <div class="highlight-tip" style="background:#fff8e1;border-left:3px solid #ffc107">
+        <strong>Nota:</strong> Las anomalías se estandarizan por estación y mes para que las estaciones más lluviosas no dominen los modos.
+    </div>
+    """,
+    icon="🧭"
+)
+
+@st.fragment
+@Cronometrado
+def Panel_regimenes(cubo_regional, coordenadas):
+    """Grupos de régimen pluviométrico en el mapa y sus climatologías superpuestas"""
+    estaciones = cubo_regional[0]
+    st.markdown("<div class='plot-title'>Regímenes Pluviométricos</div>", unsafe_allow_html=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        # Con dos estaciones solo cabe un agrupamiento y el deslizador no tendría rango
+        if len(estaciones) >= 3:
+            n_grupos = st.slider(
+                "NÚMERO DE GRUPOS",
+                min_value=2,
+                max_value=min(10, len(estaciones)),
+                value=3,
+                key='regimen_grupos'
+            )
+        else:
+            n_grupos = 2
+            st.caption("Con dos estaciones se forman dos grupos")
+    with col2:
+        metodo_grupos = st.radio(
+            "MÉTODO DE AGRUPAMIENTO",
+            options=['kmeans', 'jerarquico'],
+            format_func=lambda m: "K-medias" if m == 'kmeans' else "Jerárquico (Ward)",
+            horizontal=True,
+            key='regimen_metodo'
+        )
+
+    regionalizacion = Regionalizar_estaciones(cubo_regional, n_grupos, metodo_grupos)
+    if regionalizacion is None:
+        st.warning("No hay suficientes estaciones con climatología completa para agrupar")
+    else:
+        asignacion = regionalizacion['asignacion']
+        puntos_grupos = tuple(
+            (nombre, *coordenadas.get(nombre, (np.nan, np.nan)), float(grupo) if pd.notna(grupo) else np.nan)
+            for nombre, grupo in zip(asignacion['Estación'], asignacion['Grupo'])
+        )
+        mapa_grupos = Mapa_cuenca_html(puntos_grupos, 'Grupo', st.session_state.get('mapa_agrupar', False))
+        if mapa_grupos is not None:
+            components.html(mapa_grupos, height=450)
+
+        fig_regimenes = Grafica_regimenes(regionalizacion)
+        st.plotly_chart(fig_regimenes, use_container_width=True)
+        st.dataframe(
+            asignacion.style.format({
+                'Promedio anual (mm)': '{:.1f}',
+                'Coef. variación anual': '{:.2f}',
+                'Índice de estacionalidad': '{:.2f}'
+            }, na_rep='--'),
+            use_container_width=True
+        )
+    show_interpretation(
+    "Regímenes Pluviométricos",
+    """
+    <div class="highlight-tip">
+        Agrupa las estaciones con climatologías mensuales y variabilidad similares.
+    </div>
+
+    <ul>
+        <li><span class="key-term">Características:</span> Reparto mensual de la lluvia, total anual, variabilidad interanual e índice de estacionalidad</li>
+        <li><span class="key-term">Unimodal:</span> Una sola temporada de lluvias</li>
+        <li><span class="key-term">Bimodal:</span> Dos máximos de lluvia en el año</li>
+        <li><span class="key-term">Árido:</span> Menos de 250 mm anuales en promedio</li>
+    </ul>
+
+    <div class="divider"></div>
+
+    <strong>Análisis recomendado:</strong>
+    <ul>
+        <li>Elija como representativa la estación más completa de cada grupo</li>
+        <li>Grupos dispersos en el mapa pueden indicar efectos de altitud u orientación</li>
+        <li>Compare K-medias y Ward: los grupos estables entre métodos son más confiables</li>
+    </ul>
+    """,
+    icon="🗺️"
+)
+
+@st.fragment
+@Cronometrado
+def Panel_piramide(piramides, variable='Precipitación'):
+    """Series y tabla de la pirámide de agregados en la resolución y el nivel espacial elegidos"""
+    st.markdown("<div class='plot-title'>Agregados por Escala</div>", unsafe_allow_html=True)
+    if not piramides:
+        st.info("No hay agregados disponibles")
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        resolucion = st.radio(
+            "RESOLUCIÓN TEMPORAL",
+            options=list(RESOLUCIONES),
+            index=2,
+            horizontal=True,
+            key='piramide_resolucion'
+        )
+    with col2:
+        nivel = st.radio(
+            "NIVEL ESPACIAL",
+            options=list(NIVELES_ESPACIALES),
+            horizontal=True,
+            key='piramide_nivel'
+        )
+
+    tabla = Tabla_piramide(piramides[nivel], resolucion)
+    series = [c for c in tabla.columns if c not in ('Período', 'Fecha')]
+    seleccion = st.multiselect(
+        "SERIES A MOSTRAR",
+        options=series,
+        default=series[:8],
+        key=f'piramide_series_{nivel}'
+    )
+    tabla = tabla[['Período', 'Fecha'] + seleccion].dropna(subset=seleccion, how='all')
+
+    st.plotly_chart(Grafica_piramide(tabla, resolucion, nivel, variable), use_container_width=True)
+    with st.expander("Ver tabla de agregados"):
+        st.dataframe(
+            tabla.drop(columns='Fecha').set_index('Período').style.format('{:.1f}', na_rep='--'),
+            use_container_width=True
+        )
+    show_interpretation(
+    "Agregados por Escala",
+    """
+    <div class="highlight-tip">
+        Totales precalculados al cargar las estaciones para cambiar de escala sin recalcular desde los datos mensuales.
+    </div>
 
-def Mostrar_resumen_barra_lateral(filtered_df):
-    """Muestra estadísticas resumen en la barra lateral"""
-    st.markdown("### Resumen Estadístico")
-    
-    if not filtered_df.empty:
-        total_years = filtered_df['Año'].nunique()
-        avg_precip = filtered_df['Precipitación (mm)'].mean()
-        max_precip = filtered_df['Precipitación (mm)'].max()
-        min_precip = filtered_df['Precipitación (mm)'].min()
-        total_precip = filtered_df['Precipitación (mm)'].sum()
-        data_coverage = len(filtered_df) / (total_years * 12)
-        
-        st.markdown(f"""
-            <div class="metric-card">
-                <div class="metric-title">Años de Datos</div>
-                <div class="metric-value">{total_years}</div>
-            </div>
-            <div class="metric-card">
-                <div class="metric-title">Cobertura de Datos</div>
-                <div class="metric-value">{data_coverage:.0%}</div>
-            </div>
-            <div class="metric-card">
-                <div class="metric-title">Precipitación Promedio</div>
-                <div class="metric-value">{avg_precip:.1f} mm</div>
-            </div>
-            <div class="metric-card">
-                <div class="metric-title">Máxima Registrada</div>
-                <div class="metric-value">{max_precip:.1f} mm</div>
-            </div>
-            <div class="metric-card">
-                <div class="metric-title">Mínima Registrada</div>
-                <div class="metric-value">{min_precip:.1f} mm</div>
-            </div>
-        """, unsafe_allow_html=True)
+    <ul>
+        <li><span class="key-term">Estacional:</span> Totales de DEF, MAM, JJA y SON; DEF se rotula con el año de enero</li>
+        <li><span class="key-term">Anual y decadal:</span> Solo años con los 12 meses; una década requiere al menos 5 años completos</li>
+        <li><span class="key-term">Cuenca y departamento:</span> Promedio de las estaciones con dato en cada período</li>
+    </ul>
+
+    <div class="divider"></div>
+
+    <strong>Análisis recomendado:</strong>
+    <ul>
+        <li>Use la escala decadal para ver cambios de largo plazo sin el ruido interanual</li>
+        <li>Un salto en la serie regional puede deberse a la entrada o salida de estaciones</li>
+    </ul>
+    """,
+    icon="🧮"
+)
 
 def mostrar_mensaje_bienvenida():
     # CSS para dar estilo
@@ -1138,6 +5391,263 @@ def mostrar_mensaje_bienvenida():
     </div>
     """, unsafe_allow_html=True)
 
+# Textos de interpretación de los gráficos, compartidos por la aplicación y el reporte HTML
+INTERPRETACIONES = {
+    'distribucion_mensual': (
+        "Distribución Mensual de {variable}",
+        """
+    <div class="highlight-tip">
+        Este gráfico combina múltiples medidas estadísticas para mostrar la variabilidad mensual.
+    </div>
+    
+    <ul>
+        <li><span class="key-term">Cajas:</span> Representan el rango entre el 25° y 75° percentil (Q1-Q3)</li>
+        <li><span class="key-term">Línea central:</span> Mediana (50° percentil) de los datos históricos</li>
+        <li><span class="key-term">Bigotes:</span> Extienden hasta 1.5×IQR (rango intercuartílico)</li>
+        <li><span class="key-term">Puntos:</span> Valores atípicos extremos fuera del rango de bigotes</li>
+        <li><span class="key-term">Línea naranja:</span> Promedio histórico mensual</li>
+    </ul>
+    
+    <div class="divider"></div>
+    
+    <strong>Análisis recomendado:</strong>
+    <ul>
+        <li>Busque meses con cajas altas (alta variabilidad interanual)</li>
+        <li>Compare mediana vs promedio para identificar sesgos</li>
+        <li>Meses con muchos puntos atípicos pueden indicar eventos extremos</li>
+        <li>La diferencia entre bigotes superiores/inferiores muestra asimetría</li>
+    </ul>
+    """,
+        "📅"
+    ),
+    'mapa_calor': (
+        "Patrón Temporal - Mapa de Calor",
+        """
+    <div class="highlight-tip">
+        Visualización matricial que codifica los valores mensuales de {variable} en colores para identificar patrones.
+    </div>
+    
+    <ul>
+        <li><span class="key-term">Eje Y:</span> Años (orden cronológico descendente)</li>
+        <li><span class="key-term">Eje X:</span> Meses (orden estacional)</li>
+        <li><span class="key-term">Escala de color:</span> Azul (bajo) → Rojo (alto)</li>
+        <li><span class="key-term">Celdas vacías:</span> Datos faltantes en ese período</li>
+    </ul>
+    
+    <div class="divider"></div>
+    
+    <strong>Patrones clave:</strong>
+    <ul>
+        <li>Columnas uniformes: Estacionalidad consistente</li>
+        <li>Filas atípicas: Años con comportamiento anómalo</li>
+        <li>Transiciones bruscas: Cambios rápidos entre estaciones</li>
+        <li>Bloques de color: Períodos prolongados por encima o por debajo de lo habitual</li>{notas_precipitacion}
+    </ul>
+    """,
+        "🌡️"
+    ),
+    'violin': (
+        "Distribución de Probabilidad por Mes",
+        """
+    <div class="highlight-tip">
+        Muestra la densidad de probabilidad estimada junto con los datos reales.
+    </div>
+    
+    <ul>
+        <li><span class="key-term">Ancho del violín:</span> Frecuencia relativa de valores</li>
+        <li><span class="key-term">Puntos internos:</span> Observaciones individuales</li>
+        <li><span class="key-term">Caja blanca:</span> Rango intercuartílico (25°-75° percentil)</li>
+        <li><span class="key-term">Punto central:</span> Mediana de los datos</li>
+    </ul>
+    
+    <div class="divider"></div>
+    
+    <strong>Interpretación avanzada:</strong>
+    <ul>
+        <li>Violines bimodales: Dos regímenes climáticos distintos</li>
+        <li>Colas largas: Presencia de valores extremos</li>
+        <li>Asimetría: Mayor concentración de valores en un rango</li>
+        <li>Violines estrechos: Baja variabilidad interanual</li>
+    </ul>
+    """,
+        "🎻"
+    ),
+    'tendencia': (
+        "Tendencia Anual de {variable}",
+        """
+    <div class="highlight-tip">
+        Análisis de cambios a largo plazo con modelo lineal y suavizado.
+    </div>
+    
+    <ul>
+        <li><span class="key-term">Puntos azules:</span> Valor anual observado de {variable}</li>
+        <li><span class="key-term">Línea naranja:</span> Tendencia lineal (R² muestra bondad de ajuste)</li>
+        <li><span class="key-term">Área sombreada:</span> Intervalo de confianza del 95%</li>
+        <li><span class="key-term">Línea azul:</span> Suavizado LOWESS (tendencia no paramétrica)</li>
+    </ul>
+    
+    <div class="divider"></div>
+    
+    <strong>Indicadores clave:</strong>
+    <ul>
+        <li><span class="key-term">Pendiente positiva:</span> Aumento promedio por año, en la unidad de la variable</li>
+        <li><span class="key-term">R² > 0.5:</span> Tendencia estadísticamente significativa</li>
+        <li><span class="key-term">Divergencia líneas:</span> Comportamiento no lineal</li>
+        <li><span class="key-term">Años fuera del IC:</span> Eventos extremos</li>
+    </ul>
+    """,
+        "📈"
+    ),
+    'acumulado': (
+        "Acumulado Histórico de {variable}",
+        """
+    <div class="highlight-tip">
+        Muestra la contribución progresiva de cada año al total histórico.
+    </div>
+    
+    <ul>
+        <li><span class="key-term">Barras azules:</span> Total anual de {variable} (eje izquierdo)</li>
+        <li><span class="key-term">Línea verde:</span> Acumulado progresivo (eje derecho)</li>
+        <li><span class="key-term">Pendiente:</span> Tasa de acumulación anual</li>
+    </ul>
+    
+    <div class="divider"></div>
+    
+    <strong>Análisis recomendado:</strong>
+    <ul>
+        <li>Periodos planos: Años consecutivos con totales bajos</li>
+        <li>Cambios de pendiente: Alteraciones en el régimen de {variable}</li>
+        <li>Comparar altura de barras: Años altos vs bajos</li>{notas_precipitacion}
+        <li>El último punto muestra el total acumulado histórico</li>
+    </ul>
+    """,
+        "📉"
+    ),
+    'comparacion': (
+        "Comparación Mensual: Años vs Histórico",
+        """
+    <div class="highlight-tip">
+        Contrasta el comportamiento de los años seleccionados contra la distribución histórica de cada mes.
+    </div>
+    
+    <ul>
+        <li><span class="key-term">Línea azul:</span> Promedio histórico mensual (todos los años); la punteada es la mediana</li>
+        <li><span class="key-term">Bandas:</span> Rango intercuartílico (P25–P75), P10–P90 y extremos históricos (mínimo–máximo)</li>
+        <li><span class="key-term">Líneas de color:</span> Datos de cada año seleccionado</li>
+        <li><span class="key-term">Marcadores:</span> Valores mensuales reales</li>
+    </ul>
+    
+    <div class="divider"></div>
+    
+    <strong>Análisis recomendado:</strong>
+    <ul>
+        <li>Meses fuera de la banda P10–P90 son excepcionales para esa época del año</li>
+        <li>Patrones consistentes arriba/abajo del promedio indican años anómalos en su conjunto</li>{notas_precipitacion}
+        <li>Note si la forma estacional (picos/valles) coincide con el histórico</li>
+    </ul>
+    
+    <div class="highlight-tip" style="background:#fff8e1;border-left:3px solid #ffc107">
+        <strong>Nota:</strong> Un año puede ser normal en promedio pero tener meses extremos.
+    </div>
+    """,
+        "🔀"
+    ),
+    'anomalias': (
+        "Anomalías Anuales",
+        """
+    <div class="highlight-tip">
+        Desviaciones respecto al promedio histórico ({avg_precip:.1f} {unidad}) ± {std_dev:.1f} {unidad}.
+    </div>
+    
+    <ul>
+        <li><span class="key-term">Barras azules:</span> Años por encima de lo normal (> +1σ)</li>
+        <li><span class="key-term">Barras naranjas:</span> Años por debajo de lo normal (< -1σ)</li>
+        <li><span class="key-term">Línea cero:</span> Promedio histórico o normal climatológica (referencia)</li>
+        <li><span class="key-term">Línea azul:</span> Media móvil de 5 años de las anomalías</li>
+        <li><span class="key-term">Escala:</span> Desviaciones estándar (σ = {std_dev:.1f} {unidad})</li>
+    </ul>
+    
+    <div class="divider"></div>
+    
+    <strong>Clasificación de eventos:</strong>
+    <ul>
+        <li><span class="key-term">Moderado:</span> ±1σ a ±2σ (colores claros)</li>
+        <li><span class="key-term">Severo:</span> ±2σ a ±3σ (colores medios)</li>
+        <li><span class="key-term">Extremo:</span> > ±3σ (colores intensos)</li>
+    </ul>
+    """,
+        "⚠️"
+    ),
+    'dispersion_anual': (
+        "Dispersión Anual de {variable}",
+        """
+    <div class="highlight-tip">
+        Muestra la variabilidad interanual y tendencia no lineal.
+    </div>
+    
+    <ul>
+        <li><span class="key-term">Puntos verdes:</span> Valores anuales observados</li>
+        <li><span class="key-term">Línea naranja:</span> Tendencia suavizada (LOWESS)</li>
+        <li><span class="key-term">Eje Y:</span> Valor anual de la variable (total, promedio o extremo según la variable)</li>
+    </ul>
+    
+    <div class="divider"></div>
+    
+    <strong>Qué observar:</strong>
+    <ul>
+        <li>Años agrupados en un rango estrecho = Baja variabilidad</li>
+        <li>Puntos alejados de la tendencia = Eventos atípicos</li>
+        <li>Cambios en la pendiente de la línea = Cambios de régimen</li>
+    </ul>
+    """,
+        "🌐"
+    ),
+    'dispersion_mensual': (
+        "Dispersión Mensual por Año",
+        """
+    <div class="highlight-tip">
+        Visualiza todos los valores mensuales para detectar patrones y anomalías.
+    </div>
+    
+    <ul>
+        <li><span class="key-term">Eje X:</span> Meses (orden estacional)</li>
+        <li><span class="key-term">Eje Y:</span> Valor mensual de la variable</li>
+        <li><span class="key-term">Color:</span> Diferencia entre meses</li>
+        <li><span class="key-term">Transparencia:</span> Frecuencia de valores similares</li>
+    </ul>
+    
+    <div class="divider"></div>
+    
+    <strong>Patrones clave:</strong>
+    <ul>
+        <li>Nubes de puntos densas = Valores frecuentes</li>
+        <li>Puntos aislados superiores = Valores extremos altos</li>{notas_precipitacion}
+        <li>Huecos en la distribución = Valores meteorológicamente improbables</li>
+    </ul>
+    """,
+        "🔍"
+    )
+}
+
+# Lecturas propias de la lluvia (años húmedos/secos): solo se añaden para la precipitación
+NOTAS_PRECIPITACION = {
+    'mapa_calor': "\n        <li>Bloques de meses bajos en la estación lluviosa: Sequías prolongadas</li>",
+    'acumulado': "\n        <li>Periodos planos y barras bajas: Años secos; barras altas: Años húmedos</li>",
+    'comparacion': "\n        <li>Meses consistentemente arriba/abajo del promedio indican años húmedos/secos</li>",
+    'dispersion_mensual': "\n        <li>Puntos aislados superiores = Eventos lluviosos extremos</li>"
+}
+
+def Interpretacion(clave, variable=VARIABLE_PREDETERMINADA, **valores):
+    """Título, contenido e ícono de un texto de interpretación para la variable; los valores completan los campos del contenido"""
+    titulo, contenido, icono = INTERPRETACIONES[clave]
+    notas = NOTAS_PRECIPITACION.get(clave, '') if variable == 'Precipitación' else ''
+    # En el título el nombre va como en el registro; dentro del texto, en minúsculas
+    return (
+        titulo.format(variable=variable),
+        contenido.format(variable=variable.lower(), notas_precipitacion=notas, **valores),
+        icono
+    )
+
 # Función para mostrar cuadros de interpretación
 def show_interpretation(title, content, icon="ℹ️"):
     st.markdown(f"""
@@ -1235,6 +5745,7 @@ def show_interpretation(title, content, icon="📊"):
     """, unsafe_allow_html=True)
 # --- FUNCIÓN PRINCIPAL ---
 def main():
+    inicio_ejecucion = time.perf_counter()
     # Configurar página y estilos
     setup_page()
     apply_custom_styles()
@@ -1346,23 +5857,102 @@ def main():
 """, unsafe_allow_html=True)
 
     
-    # Carga de archivo
-    uploaded_file = st.file_uploader(
-        "📤 CARGAR ARCHIVO EXCEL CON DATOS MENSUALES", 
+    # Carga de archivos (una estación por archivo)
+    uploaded_files = st.file_uploader(
+        "📤 CARGAR ARCHIVOS EXCEL CON DATOS MENSUALES", 
         type=['xlsx'],
-        help="Suba un archivo Excel con datos mensuales de precipitación en formato estándar ANA"
+        accept_multiple_files=True,
+        help="Suba uno o varios archivos Excel con datos mensuales de precipitación en formato estándar ANA"
     )
     
-    if uploaded_file is not None:
+    # Red nacional en disco: solo se leen las estaciones y años elegidos
+    cubo_disco = None
+    if CARPETA_CUBO:
+        try:
+            cubo_disco = Cubo_disco_compartido(CARPETA_CUBO)
+        except (OSError, ValueError, KeyError) as e:
+            st.warning(f"No se pudo abrir el cubo de la red en {CARPETA_CUBO}: {e}")
+    seleccion_cubo, años_cubo = Seleccion_cubo_barra_lateral(cubo_disco) if cubo_disco is not None else ([], None)
+    
+    if uploaded_files or seleccion_cubo:
         try:
             # Procesamiento de datos
-            df = pd.read_excel(uploaded_file, header=None)
-            metadata = Extraer_Metadata(df)
-            data_df = Extracion_datos_mensuales(df)
+            cache = Cache_estaciones_compartida()
+            estaciones = {}
+            huellas = {}
+            piramides = {}
+            # Huellas y pirámides se guardan por estación y variable
+            # Del cubo en disco solo se guarda la variable de cada estación: sus filas se leen al analizarlas
+            en_cubo = {}
+            for nombre in seleccion_cubo:
+                variable = cubo_disco.variable(nombre)
+                huella = cubo_disco.huella(nombre, años_cubo)
+                piramide = cache.agregado(huella, 'Pirámide', cubo_disco.piramide, nombre, años_cubo)
+                if piramide is None or np.isnan(piramide['Mensual']).all():
+                    continue
+                en_cubo[nombre] = variable
+                huellas[nombre] = {variable: huella}
+                piramides[nombre] = {variable: piramide}
+            for uploaded_file in uploaded_files or []:
+                contenido = uploaded_file.getvalue()
+                metadata, data_df = cache.obtener(contenido)
+                if data_df.empty:
+                    st.warning(f"El archivo {uploaded_file.name} no contiene datos mensuales válidos")
+                    continue
+                variable = Variable_datos(data_df)
+                nombre = metadata.get('Estación') or uploaded_file.name
+                if nombre in en_cubo and variable not in huellas[nombre]:
+                    # Otra variable de una estación del cubo: su fila pasa a un DataFrame para unir ambas columnas
+                    variable_cubo = en_cubo.pop(nombre)
+                    estaciones[nombre] = Estacion_cubo(cubo_disco, nombre, años_cubo, huellas[nombre][variable_cubo], cache)
+                if nombre in estaciones and variable not in huellas[nombre]:
+                    # Otra variable de una estación ya cargada: una columna más en los mismos datos
+                    estaciones[nombre] = (estaciones[nombre][0], Unir_variables(estaciones[nombre][1], data_df))
+                else:
+                    if nombre in huellas:
+                        nombre = f"{nombre} ({uploaded_file.name})"
+                    estaciones[nombre] = (metadata, data_df)
+                    huellas[nombre], piramides[nombre] = {}, {}
+                huellas[nombre][variable] = cache.huella(contenido)
+                # Pirámide de agregados: se calcula una vez por archivo y queda junto a sus datos
+                piramides[nombre][variable] = cache.agregado(huellas[nombre][variable], 'Pirámide', Piramide_estacion, data_df)
             
-            if not data_df.empty:
+            if huellas:
                 # --- BARRA LATERAL ---
                 with st.sidebar:
+                    # Selección de la variable: el resto de la aplicación solo ve las estaciones que la registran
+                    variables = [v for v in VARIABLES if any(v in h for h in huellas.values())]
+                    if len(variables) > 1:
+                        variable = st.selectbox("VARIABLE", options=variables, key='variable_seleccionada')
+                    else:
+                        variable = variables[0]
+                    estaciones = {
+                        nombre: (meta, Seleccionar_variable(datos, variable))
+                        for nombre, (meta, datos) in estaciones.items()
+                        if variable in huellas[nombre]
+                    }
+                    seleccion_variable = [nombre for nombre, v in en_cubo.items() if v == variable]
+                    metadatas = {nombre: cubo_disco.metadata(nombre) for nombre in seleccion_variable}
+                    metadatas.update((nombre, meta) for nombre, (meta, _) in estaciones.items())
+                    huellas = {nombre: huellas[nombre][variable] for nombre in metadatas}
+                    piramides = {nombre: piramides[nombre][variable] for nombre in metadatas}
+                    # Acumulados, estacionalidad, rachas secas/húmedas, doble masa y regímenes solo tienen sentido en variables que se suman
+                    acumulable = VARIABLES[variable]['agregacion'] == 'sum'
+                    
+                    # Selección de la estación a analizar
+                    if len(metadatas) > 1:
+                        estacion_actual = st.selectbox(
+                            "ESTACIÓN A ANALIZAR",
+                            options=list(metadatas),
+                            key='estacion_seleccionada'
+                        )
+                    else:
+                        estacion_actual = next(iter(metadatas))
+                    if estacion_actual in estaciones:
+                        metadata, data_df = estaciones[estacion_actual]
+                    else:
+                        metadata, data_df = Estacion_cubo(cubo_disco, estacion_actual, años_cubo, huellas[estacion_actual], cache)
+                    
                     # Mostrar metadatos de la estación
                     MostrarMetada(metadata)
                     
@@ -1384,12 +5974,53 @@ def main():
                                 'Jul', 'Ago', 'Set', 'Oct', 'Nov', 'Dic']
                     )
                     
+                    min_months = st.slider(
+                        "MÍNIMO DE MESES CON DATOS POR AÑO",
+                        min_value=0,
+                        max_value=12,
+                        value=0,
+                        help="Excluye los años con menos meses registrados"
+                    )
+                    
+                    exclude_flagged = st.checkbox(
+                        "EXCLUIR VALORES NEGATIVOS O IMPLAUSIBLES",
+                        value=False
+                    )
+                    
                     # Aplicar filtros
-                    filtered_df = data_df[
-                        (data_df['Año'] >= year_range[0]) & 
-                        (data_df['Año'] <= year_range[1]) &
-                        (data_df['Mes'].isin(selected_months))
-                    ]
+                    filtered_df = Filtrar_datos(data_df, year_range, selected_months, min_months, exclude_flagged)
+                    
+                    selected_period = st.selectbox(
+                        "PERÍODO DE AGREGACIÓN ANUAL",
+                        options=list(DEFINICIONES_PERIODO),
+                        help="Define cómo se agrupan los meses en los gráficos y tablas anuales"
+                    )
+                    period_df = Aplicar_periodo(filtered_df, selected_period)
+                    
+                    with st.expander("INTERVALOS DE CONFIANZA"):
+                        mostrar_intervalos = st.checkbox(
+                            "Calcular intervalos bootstrap",
+                            value=False,
+                            key='mostrar_intervalos',
+                            help="Intervalos percentil del promedio, la mediana y la desviación, remuestreando los años"
+                        )
+                        nivel_confianza = st.select_slider(
+                            "NIVEL DE CONFIANZA",
+                            options=[0.80, 0.90, 0.95, 0.99],
+                            value=0.95,
+                            format_func=lambda x: f"{x:.0%}",
+                            key='nivel_confianza'
+                        )
+                        n_replicas = st.select_slider(
+                            "RÉPLICAS",
+                            options=[200, 500, 1000, 2000, 5000],
+                            value=1000,
+                            key='replicas_bootstrap'
+                        )
+                    intervalos_mensuales = Intervalos_mensuales(filtered_df, n_replicas, nivel_confianza) if mostrar_intervalos else None
+                    Registrar_memoria('Datos de la estación', data_df, compartido=True)
+                    Registrar_memoria('Datos filtrados', filtered_df)
+                    Registrar_memoria('Datos por período', period_df)
                     
                     # Mostrar estadísticas resumen
                     Mostrar_resumen_barra_lateral(filtered_df)
@@ -1397,7 +6028,7 @@ def main():
                 # --- CONTENIDO PRINCIPAL ---
                 if len(filtered_df) > 0:
                     # Pestañas para diferentes visualizaciones
-                    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8 = st.tabs([
+                    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs([
                         "📊 Visión General", 
                         "📈 Tendencia Anual", 
                         "🌧️ Patrón Mensual",
@@ -1405,7 +6036,8 @@ def main():
                         "📊 Dispersión",  
                         "📋 Estadísticas",
                         "🗺️ Ubicación",
-                        "📥 Datos"
+                        "📥 Datos",
+                        "🏞️ Cuenca"
                     ])
                     
                     with tab1:
@@ -1414,342 +6046,380 @@ def main():
                         col1, col2 = st.columns(2)
                         with col1:
                             st.markdown("<div class='plot-title'>Distribución Mensual</div>", unsafe_allow_html=True)
-                            fig_dist = Grafica_distribucion_mensual(filtered_df, metadata)
+                            fig_dist = Grafica_distribucion_mensual(filtered_df, metadata, intervalos_mensuales)
                             st.plotly_chart(fig_dist, use_container_width=True)
-                            show_interpretation(
-    "Distribución Mensual de Precipitación",
-    """
-    <div class="highlight-tip">
-        Este gráfico combina múltiples medidas estadísticas para mostrar la variabilidad mensual.
-    </div>
-    
-    <ul>
-        <li><span class="key-term">Cajas:</span> Representan el rango entre el 25° y 75° percentil (Q1-Q3)</li>
-        <li><span class="key-term">Línea central:</span> Mediana (50° percentil) de los datos históricos</li>
-        <li><span class="key-term">Bigotes:</span> Extienden hasta 1.5×IQR (rango intercuartílico)</li>
-        <li><span class="key-term">Puntos:</span> Valores atípicos extremos fuera del rango de bigotes</li>
-        <li><span class="key-term">Línea naranja:</span> Promedio histórico mensual</li>
-    </ul>
-    
-    <div class="divider"></div>
-    
-    <strong>Análisis recomendado:</strong>
-    <ul>
-        <li>Busque meses con cajas altas (alta variabilidad interanual)</li>
-        <li>Compare mediana vs promedio para identificar sesgos</li>
-        <li>Meses con muchos puntos atípicos pueden indicar eventos extremos</li>
-        <li>La diferencia entre bigotes superiores/inferiores muestra asimetría</li>
-    </ul>
-    """,
-    icon="📅"
-)
+                            show_interpretation(*Interpretacion('distribucion_mensual', variable))
                         
                         with col2:
                             st.markdown("<div class='plot-title'>Heatmap Mensual</div>", unsafe_allow_html=True)
                             fig_heat = Mapa_calor_mensual(filtered_df, metadata)
                             st.plotly_chart(fig_heat, use_container_width=True)
-                            show_interpretation(
-    "Patrón Temporal - Mapa de Calor",
-    """
-    <div class="highlight-tip">
-        Visualización matricial que codifica valores de precipitación en colores para identificar patrones.
-    </div>
-    
-    <ul>
-        <li><span class="key-term">Eje Y:</span> Años (orden cronológico descendente)</li>
-        <li><span class="key-term">Eje X:</span> Meses (orden estacional)</li>
-        <li><span class="key-term">Escala de color:</span> Azul (bajo) → Rojo (alto)</li>
-        <li><span class="key-term">Celdas vacías:</span> Datos faltantes en ese período</li>
-    </ul>
-    
-    <div class="divider"></div>
-    
-    <strong>Patrones clave:</strong>
-    <ul>
-        <li>Columnas uniformes: Estacionalidad consistente</li>
-        <li>Filas atípicas: Años con comportamiento anómalo</li>
-        <li>Transiciones bruscas: Cambios rápidos entre estaciones</li>
-        <li>Bloques de color: Períodos húmedos/secos prolongados</li>
-    </ul>
-    """,
-    icon="🌡️"
-)
+                            show_interpretation(*Interpretacion('mapa_calor', variable))
                         
                         st.markdown("<div class='plot-title'>Distribución Detallada por Mes</div>", unsafe_allow_html=True)
                         fig_violin = Grafico_violin_mensual(filtered_df, metadata)
                         st.plotly_chart(fig_violin, use_container_width=True)
-                        show_interpretation(
-    "Distribución de Probabilidad por Mes",
-    """
-    <div class="highlight-tip">
-        Muestra la densidad de probabilidad estimada junto con los datos reales.
-    </div>
-    
-    <ul>
-        <li><span class="key-term">Ancho del violín:</span> Frecuencia relativa de valores</li>
-        <li><span class="key-term">Puntos internos:</span> Observaciones individuales</li>
-        <li><span class="key-term">Caja blanca:</span> Rango intercuartílico (25°-75° percentil)</li>
-        <li><span class="key-term">Punto central:</span> Mediana de los datos</li>
-    </ul>
-    
-    <div class="divider"></div>
-    
-    <strong>Interpretación avanzada:</strong>
-    <ul>
-        <li>Violines bimodales: Dos regímenes climáticos distintos</li>
-        <li>Colas largas: Presencia de valores extremos</li>
-        <li>Asimetría: Mayor concentración de valores en un rango</li>
-        <li>Violines estrechos: Baja variabilidad interanual</li>
-    </ul>
-    """,
-    icon="🎻"
-)
+                        show_interpretation(*Interpretacion('violin', variable))
                     
                     with tab2:
                         st.markdown("<div class='plot-title'>Tendencia Anual</div>", unsafe_allow_html=True)
-                        fig_trend = Grafico_tendencia_anual(filtered_df, metadata)
+                        mostrar_cambios = st.checkbox(
+                            "Mostrar puntos de cambio (PELT)",
+                            value=True,
+                            key='mostrar_cambios'
+                        )
+                        cambios = Puntos_de_cambio(period_df) if mostrar_cambios else None
+                        segmentos_anuales = cambios['anual'] if cambios is not None else None
+                        fig_trend = Grafico_tendencia_anual(period_df, metadata, segmentos_anuales)
                         st.plotly_chart(fig_trend, use_container_width=True)
-                        show_interpretation(
-    "Tendencia de Precipitación Anual",
+                        show_interpretation(*Interpretacion('tendencia', variable))
+                        
+                        if acumulable:
+                            st.markdown(f"<div class='plot-title'>{variable} Acumulada</div>", unsafe_allow_html=True)
+                            fig_cum = Grafico_precipitacion_anual(period_df, metadata, segmentos_anuales)
+                            st.plotly_chart(fig_cum, use_container_width=True)
+                            show_interpretation(*Interpretacion('acumulado', variable))
+
+                        if cambios is not None:
+                            st.markdown("<div class='plot-title'>Puntos de Cambio</div>", unsafe_allow_html=True)
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                st.markdown(f"**Serie anual ({VARIABLES[variable]['unidad']})**")
+                                st.dataframe(
+                                    cambios['anual'].style.format({'Media': '{:.1f}', 'Desviación': '{:.1f}'}, na_rep='--'),
+                                    use_container_width=True
+                                )
+                            with col2:
+                                st.markdown("**Anomalías mensuales (z)**")
+                                st.dataframe(
+                                    cambios['mensual'].style.format({
+                                        'Inicio': lambda f: f.strftime('%m/%Y'),
+                                        'Fin': lambda f: f.strftime('%m/%Y'),
+                                        'Media': '{:.2f}',
+                                        'Desviación': '{:.2f}'
+                                    }, na_rep='--'),
+                                    use_container_width=True
+                                )
+                            show_interpretation(
+    "Puntos de Cambio",
     """
     <div class="highlight-tip">
-        Análisis de cambios a largo plazo con modelo lineal y suavizado.
+        Divide la serie en tramos con media y varianza propias (método PELT con penalización BIC).
     </div>
     
     <ul>
-        <li><span class="key-term">Puntos azules:</span> Precipitación anual observada</li>
-        <li><span class="key-term">Línea naranja:</span> Tendencia lineal (R² muestra bondad de ajuste)</li>
-        <li><span class="key-term">Área sombreada:</span> Intervalo de confianza del 95%</li>
-        <li><span class="key-term">Línea azul:</span> Suavizado LOWESS (tendencia no paramétrica)</li>
+        <li><span class="key-term">Línea roja:</span> Media de cada tramo en los gráficos anuales</li>
+        <li><span class="key-term">Línea punteada:</span> Primer año del nuevo régimen</li>
+        <li><span class="key-term">Serie mensual:</span> Anomalías estandarizadas por mes, tramos de al menos 24 meses</li>
     </ul>
     
     <div class="divider"></div>
     
-    <strong>Indicadores clave:</strong>
+    <strong>Análisis recomendado:</strong>
     <ul>
-        <li><span class="key-term">Pendiente positiva:</span> Aumento promedio de {X} mm/año</li>
-        <li><span class="key-term">R² > 0.5:</span> Tendencia estadísticamente significativa</li>
-        <li><span class="key-term">Divergencia líneas:</span> Comportamiento no lineal</li>
-        <li><span class="key-term">Años fuera del IC:</span> Eventos extremos</li>
+        <li>Contraste los años de cambio con el historial de la estación (reubicación, cambio de instrumento)</li>
+        <li>Un cambio simultáneo en varias estaciones sugiere una causa climática</li>
+        <li>Solo se usan períodos completos según el período de agregación elegido</li>
     </ul>
     """,
-    icon="📈"
+    icon="✂️"
 )
-                        
-                        st.markdown("<div class='plot-title'>Precipitación Acumulada</div>", unsafe_allow_html=True)
-                        fig_cum = Grafico_precipitacion_anual(filtered_df, metadata)
-                        st.plotly_chart(fig_cum, use_container_width=True)
+
+                        st.markdown("<div class='plot-title'>Homogeneidad de la Serie</div>", unsafe_allow_html=True)
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            usar_montecarlo = st.checkbox(
+                                "Calcular p-valores por Monte-Carlo",
+                                value=False,
+                                key='homogeneidad_mc'
+                            )
+                        with col2:
+                            n_simulaciones = st.number_input(
+                                "Número de simulaciones",
+                                min_value=199,
+                                max_value=9999,
+                                value=999,
+                                step=100,
+                                disabled=not usar_montecarlo,
+                                key='homogeneidad_simulaciones'
+                            )
+
+                        reporte_homogeneidad = Reporte_homogeneidad(
+                            filtered_df,
+                            n_simulaciones if usar_montecarlo else 0,
+                            periodo=selected_period
+                        )
+                        if not reporte_homogeneidad.empty:
+                            st.dataframe(
+                                reporte_homogeneidad.style.format({
+                                    'Pettitt K': '{:.0f}',
+                                    'Pettitt p': '{:.3f}',
+                                    'SNHT T0': '{:.2f}',
+                                    'SNHT p': '{:.3f}',
+                                    'Buishand R/√n': '{:.2f}',
+                                    'Buishand p': '{:.3f}',
+                                    'Von Neumann N': '{:.2f}',
+                                    'Von Neumann p': '{:.3f}'
+                                }, na_rep='--'),
+                                use_container_width=True
+                            )
                         show_interpretation(
-    "Acumulado Histórico de Precipitación",
+    "Pruebas de Homogeneidad",
     """
     <div class="highlight-tip">
-        Muestra la contribución progresiva de cada año al total histórico.
+        Verifica si la serie tiene quiebres (reubicaciones, cambio de instrumento) antes de interpretar la tendencia.
     </div>
-    
+
     <ul>
-        <li><span class="key-term">Barras azules:</span> Precipitación anual (eje izquierdo)</li>
-        <li><span class="key-term">Línea verde:</span> Acumulado progresivo (eje derecho)</li>
-        <li><span class="key-term">Pendiente:</span> Tasa de acumulación anual</li>
+        <li><span class="key-term">Pettitt:</span> Prueba no paramétrica de cambio en la mediana</li>
+        <li><span class="key-term">SNHT:</span> Detecta saltos en la media, sensible cerca de los extremos</li>
+        <li><span class="key-term">Buishand:</span> Rango de sumas acumuladas, sensible a quiebres centrales</li>
+        <li><span class="key-term">Von Neumann:</span> Compara diferencias sucesivas con la varianza (no localiza el quiebre)</li>
+        <li><span class="key-term">Quiebre:</span> Primer año del nuevo régimen</li>
     </ul>
-    
+
     <div class="divider"></div>
-    
-    <strong>Análisis recomendado:</strong>
+
+    <strong>Clasificación (α = 0.05):</strong>
     <ul>
-        <li>Periodos planos: Años secos consecutivos</li>
-        <li>Cambios de pendiente: Alteraciones en el régimen pluviométrico</li>
-        <li>Comparar altura de barras: Años húmedos vs secos</li>
-        <li>El último punto muestra el total acumulado histórico</li>
+        <li><span class="key-term">Útil:</span> Rechaza como máximo una prueba</li>
+        <li><span class="key-term">Dudosa:</span> Rechazan dos pruebas</li>
+        <li><span class="key-term">Sospechosa:</span> Rechazan tres o cuatro pruebas</li>
     </ul>
+
+    <div class="highlight-tip" style="background:#fff8e1;border-left:3px solid #ffc107">
+        <strong>Nota:</strong> El total anual solo considera años con los 12 meses registrados.
+    </div>
     """,
-    icon="📉"
+    icon="🧪"
 )
-                    
+
                     with tab3:
                         st.markdown("<div class='plot-title'>Comparación Mensual</div>", unsafe_allow_html=True)
                         
-                        selected_year = st.selectbox(
-                            "Seleccione un año para comparar",
-                            options=sorted(filtered_df['Año'].unique(), reverse=True),
-                            key='year_selector'
-                        )
-                        
-                        year_data = filtered_df[filtered_df['Año'] == selected_year]
-                        monthly_stats = Calcular_estadisticas_Mensuales(filtered_df)
-                        
-                        fig = go.Figure()
-                        
-                        fig.add_trace(go.Scatter(
-                            x=monthly_stats['Mes'],
-                            y=monthly_stats['Promedio'],
-                            mode='lines',
-                            name='Promedio histórico',
-                            line=dict(color='#1e3d6b', width=3)
-                        ))
-                        
-                        fig.add_trace(go.Scatter(
-                            x=year_data['Mes'],
-                            y=year_data['Precipitación (mm)'],
-                            mode='lines+markers',
-                            name=f'Año {selected_year}',
-                            line=dict(color='#ff8c00', width=3)
-                        ))
+                        Panel_comparacion_mensual(filtered_df, metadata)
                         
-                        fig.update_layout(
-                            title=dict(
-                                text=f'Comparación Mensual<br><sup>{metadata.get("Estación", "")}</sup>',
-                                x=0.5,
-                                xanchor='center',
-                                font=dict(size=18, color='#1e3d6b')
-                            ),
-                            xaxis_title='Mes',
-                            yaxis_title='Precipitación (mm)',
-                            plot_bgcolor='white',
-                            paper_bgcolor='grey',
-                            font=dict(
-                                family="Arial",
-                                size=12,
-                                color="#333333"
-                            ),
-                            legend=dict(
-                                orientation="h",
-                                yanchor="bottom",
-                                y=1.02,
-                                xanchor="right",
-                                x=1,
-                                font=dict(
-                                    color="#333333",
-                                    size=12
-                                )
-                            ),
-                            margin=dict(l=50, r=50, t=100, b=50)
-                        )
-                        
-                        st.plotly_chart(fig, use_container_width=True)
-                        show_interpretation(
-    "Comparación Mensual: Año vs Histórico",
+                        if not acumulable:
+                            st.info("Los índices de estacionalidad se calculan solo para variables acumulables (precipitación, evaporación)")
+                        else:
+                            st.markdown("<div class='plot-title'>Estacionalidad</div>", unsafe_allow_html=True)
+                            seasonality = Detectar_patrones_estacionales(filtered_df)
+                            seasonal_indices, seasonal_summary = Indices_estacionalidad(filtered_df)
+                            
+                            if seasonal_summary is not None and not np.isfinite(seasonal_summary['si']):
+                                st.info("Los índices de estacionalidad de la climatología necesitan los 12 meses; incluya todos los meses en MESES A INCLUIR")
+                            elif seasonal_summary is not None:
+                                month_map = {
+                                    1: 'Ene', 2: 'Feb', 3: 'Mar', 4: 'Abr', 
+                                    5: 'May', 6: 'Jun', 7: 'Jul', 8: 'Ago',
+                                    9: 'Set', 10: 'Oct', 11: 'Nov', 12: 'Dic'
+                                }
+                                regime = Clasificar_estacionalidad(seasonal_summary['si'])
+                                centroid_month = month_map[int(np.floor(seasonal_summary['centroide'] + 0.5))]
+                                
+                                col1, col2, col3, col4 = st.columns(4)
+                                with col1:
+                                    st.metric("Índice de estacionalidad (SI)", f"{seasonal_summary['si']:.2f}", help=regime)
+                                with col2:
+                                    st.metric("Concentración (PCI)", f"{seasonal_summary['pci']:.1f}")
+                                with col3:
+                                    st.metric("Centroide de lluvias", centroid_month)
+                                with col4:
+                                    st.metric(
+                                        "Inicio / fin de lluvias",
+                                        f"{month_map[int(seasonal_summary['inicio'])]} / {month_map[int(seasonal_summary['fin'])]}"
+                                    )
+                                
+                                if seasonality is not None:
+                                    st.caption(
+                                        f"Régimen: {regime}. "
+                                        f"Meses lluviosos: {', '.join(month_map[m] for m in seasonality['meses_lluviosos']) or '--'}. "
+                                        f"Meses secos: {', '.join(month_map[m] for m in seasonality['meses_secos']) or '--'}. "
+                                        f"Consistencia del patrón: {seasonality['consistencia']:.0%}."
+                                    )
+                            
+                            fig_season = Grafica_estacionalidad(seasonal_indices, metadata)
+                            st.plotly_chart(fig_season, use_container_width=True)
+                            show_interpretation(
+    "Índices de Estacionalidad",
     """
     <div class="highlight-tip">
-        Contrasta el comportamiento de un año específico contra el promedio histórico.
+        Cuantifica qué tan concentrada está la lluvia en el año y cuándo ocurre la temporada húmeda.
     </div>
     
     <ul>
-        <li><span class="key-term">Línea azul:</span> Promedio histórico mensual (todos los años)</li>
-        <li><span class="key-term">Línea naranja:</span> Datos del año seleccionado ({selected_year})</li>
-        <li><span class="key-term">Marcadores:</span> Valores mensuales reales</li>
+        <li><span class="key-term">SI (Walsh y Lawler):</span> 0 = lluvia uniforme; &gt; 1 = la mayor parte en 3 meses o menos</li>
+        <li><span class="key-term">PCI (Oliver):</span> &lt; 10 uniforme, 11–15 moderado, 16–20 irregular, &gt; 20 fuertemente concentrado</li>
+        <li><span class="key-term">Centroide:</span> Mes medio de la lluvia (promedio circular de los meses)</li>
+        <li><span class="key-term">Inicio / fin:</span> Mes tras el mínimo y mes del máximo de la acumulación de anomalías</li>
     </ul>
     
     <div class="divider"></div>
     
     <strong>Análisis recomendado:</strong>
     <ul>
-        <li>Busque meses donde la línea naranja se desvíe significativamente de la azul</li>
-        <li>Patrones consistentes arriba/abajo del promedio indican años húmedos/secos</li>
-        <li>Note si la forma estacional (picos/valles) coincide con el histórico</li>
+        <li>Un aumento del SI o PCI indica lluvias más concentradas en pocos meses</li>
+        <li>Desplazamientos del inicio de lluvias afectan la campaña agrícola</li>
+        <li>Solo se consideran años con los 12 meses registrados, iniciando en el mes más seco</li>
     </ul>
-    
-    <div class="highlight-tip" style="background:#fff8e1;border-left:3px solid #ffc107">
-        <strong>Nota:</strong> Un año puede ser normal en promedio pero tener meses extremos.
-    </div>
     """,
-    icon="🔀"
+    icon="🗓️"
 )
                     with tab4:
                         st.markdown("<div class='plot-title'>Anomalías Anuales</div>", unsafe_allow_html=True)
-                        fig_anom = Grafica_anomalia_anual(filtered_df, metadata)
+                        
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            reference_option = st.selectbox(
+                                "PERÍODO DE REFERENCIA",
+                                options=['Años filtrados (promedio)'] + list(NORMALES_OMM) + ['Personalizado (30 años)'],
+                                key='periodo_referencia'
+                            )
+                        
+                        normal = None
+                        if reference_option != 'Años filtrados (promedio)':
+                            if reference_option in NORMALES_OMM:
+                                base_start, base_end = NORMALES_OMM[reference_option]
+                            else:
+                                last_start = max_year - 29
+                                with col2:
+                                    if last_start > min_year:
+                                        base_start = st.slider(
+                                            "INICIO DE LA VENTANA DE REFERENCIA",
+                                            min_value=min_year,
+                                            max_value=last_start,
+                                            value=last_start,
+                                            key='inicio_referencia'
+                                        )
+                                    else:
+                                        # Con 30 años exactos la ventana es el registro completo y no hay nada que deslizar
+                                        base_start = min_year
+                                        if max_year - min_year + 1 < 30:
+                                            st.info("El registro tiene menos de 30 años; se usa el período completo")
+                                base_end = base_start + 29
+                            
+                            # La normal se calcula sobre todo el registro, no sobre los años filtrados
+                            normal = Normal_climatologica(data_df, base_start, base_end, selected_period)
+                            if not normal['valida']:
+                                st.warning(
+                                    f"La normal {base_start}–{base_end} solo tiene {normal['años']} períodos completos "
+                                    f"(la OMM recomienda al menos el 80% de los años)"
+                                )
+                        
+                        fig_anom = Grafica_anomalia_anual(period_df, metadata, normal=normal)
                         st.plotly_chart(fig_anom, use_container_width=True)
                         
                         # Calcular estadísticas para el texto dinámico
-                        avg_precip = filtered_df.groupby('Año')['Precipitación (mm)'].sum().mean()
-                        std_dev = filtered_df.groupby('Año')['Precipitación (mm)'].sum().std()
+                        if normal is not None and pd.notna(normal['total']):
+                            avg_precip = normal['total']
+                            std_dev = normal['desviacion']
+                        else:
+                            annual_values = period_df.groupby('Año')[Columna_valor(period_df)].agg(Agregacion_anual(period_df))
+                            avg_precip = annual_values.mean()
+                            std_dev = annual_values.std()
 
+                        show_interpretation(*Interpretacion('anomalias', variable, avg_precip=avg_precip, std_dev=std_dev, unidad=VARIABLES[variable]['unidad']))
+                        
+                        st.markdown("<div class='plot-title'>Anomalías Estandarizadas</div>", unsafe_allow_html=True)
+                        # Sin normal seleccionada, la base fija es el registro completo (no depende del filtro de años)
+                        base_normal = normal if normal is not None else Normal_climatologica(
+                            data_df, min_year, max_year, selected_period
+                        )
+                        anomaly_type = st.radio(
+                            "TIPO DE ANOMALÍA",
+                            options=['z', 'porcentaje'],
+                            format_func=lambda t: "Puntaje z" if t == 'z' else "% de la normal",
+                            horizontal=True,
+                            key='tipo_anomalia'
+                        )
+                        standardized = Anomalias_estandarizadas(data_df, base_normal, selected_period)
+                        fig_std_anom = Mapa_calor_anomalias(standardized, metadata, anomaly_type, year_range)
+                        st.plotly_chart(fig_std_anom, use_container_width=True)
                         show_interpretation(
-    "Anomalías de Precipitación Anual",
+    "Anomalías Estandarizadas por Mes",
     f"""
     <div class="highlight-tip">
-        Desviaciones respecto al promedio histórico ({avg_precip:.1f} mm) ± {std_dev:.1f} mm.
+        Cada celda compara el mes con su propia normal {base_normal['inicio']}–{base_normal['fin']}, eliminando el efecto de la estacionalidad.
     </div>
     
     <ul>
-        <li><span class="key-term">Barras azules:</span> Exceso de precipitación (> +1σ)</li>
-        <li><span class="key-term">Barras naranjas:</span> Déficit de precipitación (< -1σ)</li>
-        <li><span class="key-term">Línea cero:</span> Promedio histórico (referencia)</li>
-        <li><span class="key-term">Escala:</span> Desviaciones estándar (σ = {std_dev:.1f} mm)</li>
+        <li><span class="key-term">Puntaje z:</span> (valor − media base) / desviación base del mismo mes</li>
+        <li><span class="key-term">% de la normal:</span> Valor como porcentaje del promedio base del mes</li>
+        <li><span class="key-term">Columna Período:</span> Anomalía del total del período seleccionado</li>
+        <li><span class="key-term">Azul / Rojo:</span> Más húmedo / más seco que lo normal</li>
     </ul>
     
     <div class="divider"></div>
     
-    <strong>Clasificación de eventos:</strong>
+    <strong>Clasificación del puntaje z:</strong>
     <ul>
-        <li><span class="key-term">Moderado:</span> ±1σ a ±2σ (colores claros)</li>
-        <li><span class="key-term">Severo:</span> ±2σ a ±3σ (colores medios)</li>
-        <li><span class="key-term">Extremo:</span> > ±3σ (colores intensos)</li>
+        <li><span class="key-term">|z| &lt; 1:</span> Condición normal</li>
+        <li><span class="key-term">1 ≤ |z| &lt; 2:</span> Moderadamente húmedo o seco</li>
+        <li><span class="key-term">|z| ≥ 2:</span> Extremadamente húmedo o seco</li>
     </ul>
+    
+    <div class="highlight-tip" style="background:#fff8e1;border-left:3px solid #ffc107">
+        <strong>Nota:</strong> En meses muy secos el % de la normal puede ser extremo con pocos milímetros de diferencia.
+    </div>
     """,
-    icon="⚠️"
+    icon="🧮"
 )
-                    
-                    with tab5:
-                        st.markdown("<div class='plot-title'>Dispersión Anual</div>", unsafe_allow_html=True)
-                        fig_scatter_year = Grafica_dispercion_anual(filtered_df, metadata)
-                        st.plotly_chart(fig_scatter_year, use_container_width=True)
-                        show_interpretation(
-    "Dispersión de Precipitación Anual",
+                        
+                        if acumulable:
+                            st.markdown("<div class='plot-title'>Acumulados Móviles</div>", unsafe_allow_html=True)
+                            rolling_totals = cache.agregado(
+                                huellas[estacion_actual], 'Acumulados móviles', Acumulados_moviles, data_df
+                            )
+                            fig_rolling = Grafica_acumulados_moviles(rolling_totals, metadata, year_range)
+                            st.plotly_chart(fig_rolling, use_container_width=True)
+                            show_interpretation(
+    "Precipitación Acumulada en Ventanas Móviles",
     """
     <div class="highlight-tip">
-        Muestra la variabilidad interanual y tendencia no lineal.
+        Suma la precipitación de los últimos 3, 6 y 12 meses para cada mes del registro.
     </div>
     
     <ul>
-        <li><span class="key-term">Puntos verdes:</span> Valores anuales observados</li>
-        <li><span class="key-term">Línea naranja:</span> Tendencia suavizada (LOWESS)</li>
-        <li><span class="key-term">Eje Y:</span> Precipitación total anual (mm)</li>
+        <li><span class="key-term">3 meses:</span> Condiciones estacionales de corto plazo</li>
+        <li><span class="key-term">6 meses:</span> Déficit o exceso de la temporada de lluvias</li>
+        <li><span class="key-term">12 meses:</span> Balance hídrico anual continuo (sin cortes de año calendario)</li>
+        <li><span class="key-term">Huecos:</span> Ventanas con algún mes faltante no se calculan</li>
     </ul>
     
     <div class="divider"></div>
     
-    <strong>Qué observar:</strong>
+    <strong>Análisis recomendado:</strong>
     <ul>
-        <li>Años agrupados en un rango estrecho = Baja variabilidad</li>
-        <li>Puntos alejados de la tendencia = Eventos atípicos</li>
-        <li>Cambios en la pendiente de la línea = Cambios de régimen</li>
+        <li>Descensos prolongados del acumulado de 12 meses indican sequías</li>
+        <li>Compare picos del acumulado de 3 meses entre años húmedos y secos</li>
     </ul>
     """,
-    icon="🌐"
+    icon="🔄"
 )
+                        
+                        if acumulable:
+                            Panel_rachas(
+                                Cubo_estaciones(data_df.assign(Estación=estacion_actual)),
+                                variable,
+                                'rachas',
+                                metadata.get('Estación', estacion_actual),
+                                year_range
+                            )
+                    
+                    with tab5:
+                        st.markdown("<div class='plot-title'>Dispersión Anual</div>", unsafe_allow_html=True)
+                        fig_scatter_year = Grafica_dispercion_anual(period_df, metadata)
+                        st.plotly_chart(fig_scatter_year, use_container_width=True)
+                        show_interpretation(*Interpretacion('dispersion_anual', variable))
                         st.markdown("<div class='plot-title'>Dispersión Mensual</div>", unsafe_allow_html=True)
                         fig_scatter_month = Grafica_dispercion_mensual(filtered_df, metadata)
                         st.plotly_chart(fig_scatter_month, use_container_width=True)
-                        show_interpretation(
-    "Dispersión Mensual por Año",
-    """
-    <div class="highlight-tip">
-        Visualiza todos los valores mensuales para detectar patrones y anomalías.
-    </div>
-    
-    <ul>
-        <li><span class="key-term">Eje X:</span> Meses (orden estacional)</li>
-        <li><span class="key-term">Eje Y:</span> Precipitación mensual (mm)</li>
-        <li><span class="key-term">Color:</span> Diferencia entre meses</li>
-        <li><span class="key-term">Transparencia:</span> Frecuencia de valores similares</li>
-    </ul>
-    
-    <div class="divider"></div>
-    
-    <strong>Patrones clave:</strong>
-    <ul>
-        <li>Nubes de puntos densas = Valores frecuentes</li>
-        <li>Puntos aislados superiores = Eventos extremos lluviosos</li>
-        <li>Huecos en la distribución = Valores meteorológicamente improbables</li>
-    </ul>
-    """,
-    icon="🔍"
-)
+                        show_interpretation(*Interpretacion('dispersion_mensual', variable))
                     with tab6:
                         st.markdown("### Estadísticas Detalladas")
                         
                         st.markdown("#### Por Mes")
-                        monthly_stats = Calcular_estadisticas_Mensuales(filtered_df)
+                        monthly_stats = Calcular_estadisticas_Mensuales(filtered_df, mostrar_intervalos, n_replicas, nivel_confianza)
                         st.dataframe(
                             monthly_stats.style
                                 .background_gradient(subset=['Promedio', 'Máximo'], cmap='Blues')
@@ -1758,18 +6428,22 @@ def main():
                                     'Mediana': '{:.1f}',
                                     'Desviación': '{:.1f}',
                                     'Mínimo': '{:.1f}',
-                                    'Máximo': '{:.1f}'
-                                }),
+                                    'Máximo': '{:.1f}',
+                                    **{c: '{:.1f}' for c in monthly_stats.columns if ' IC ' in c}
+                                }, na_rep='--'),
                             use_container_width=True
                         )
+                        if mostrar_intervalos:
+                            st.caption(f"Intervalos bootstrap al {nivel_confianza:.0%} con {n_replicas} réplicas (semilla fija)")
                         
-                        st.markdown("#### Por Año")
-                        annual_stats = Calcular_estadisticas_anuales(filtered_df)
+                        st.markdown(f"#### Por Año ({selected_period})")
+                        annual_stats = Calcular_estadisticas_anuales(period_df)
+                        columna_anual = annual_stats.columns[1]
                         st.dataframe(
                             annual_stats.style
-                                .background_gradient(subset=['Total Anual', 'Máximo Mensual'], cmap='Blues')
+                                .background_gradient(subset=[columna_anual, 'Máximo Mensual'], cmap='Blues')
                                 .format({
-                                    'Total Anual': '{:.1f}',
+                                    columna_anual: '{:.1f}',
                                     'Promedio Mensual': '{:.1f}',
                                     'Mediana Mensual': '{:.1f}',
                                     'Variabilidad': '{:.1f}',
@@ -1778,6 +6452,33 @@ def main():
                                 }),
                             use_container_width=True
                         )
+                        
+                        if mostrar_intervalos:
+                            st.markdown(f"##### {columna_anual} del período con intervalos de confianza")
+                            st.dataframe(
+                                Intervalos_totales_anuales(period_df, n_replicas, nivel_confianza).style.format({
+                                    'Valor': '{:.1f}',
+                                    'IC inf': '{:.1f}',
+                                    'IC sup': '{:.1f}'
+                                }, na_rep='--'),
+                                hide_index=True,
+                                use_container_width=True
+                            )
+                        
+                        st.markdown("#### Por Estación del Año")
+                        seasonal_stats = Calcular_estadisticas_estacionales(filtered_df)
+                        st.dataframe(
+                            seasonal_stats.style
+                                .background_gradient(subset=['Promedio'], cmap='Blues')
+                                .format({
+                                    'Promedio': '{:.1f}',
+                                    'Mediana': '{:.1f}',
+                                    'Desviación': '{:.1f}',
+                                    'Mínimo': '{:.1f}',
+                                    'Máximo': '{:.1f}'
+                                }, na_rep='--'),
+                            use_container_width=True
+                        )
                         show_interpretation(
     "Interpretación de Estadísticas",
     """
@@ -1799,6 +6500,7 @@ def main():
         <li><span class="key-term">Total Anual:</span> Comparar con promedio histórico</li>
         <li><span class="key-term">Variabilidad:</span> Consistencia entre meses</li>
         <li><span class="key-term">Máximo Mensual:</span> Eventos extremos registrados</li>
+        <li><span class="key-term">Período:</span> El año puede ser calendario, hidrológico (Set–Ago) o una estación; los que cruzan el fin de año se rotulan con el año en que terminan</li>
     </ul>
     
     <div class="highlight-tip" style="background:#e8f5e9;border-left:3px solid #4caf50;">
@@ -1843,49 +6545,15 @@ def main():
                         st.dataframe(filtered_df, use_container_width=True)
                         
                         try:
-                            output = io.BytesIO()
-                            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                                filtered_df.to_excel(writer, sheet_name='Datos', index=False)
-                                
-                                if not filtered_df.empty:
-                                    monthly_stats = Calcular_estadisticas_Mensuales(filtered_df)
-                                    annual_stats = Calcular_estadisticas_anuales(filtered_df)
-                                    
-                                    writer.book.create_sheet('Estadísticas')
-                                    writer.sheets['Estadísticas'] = writer.book['Estadísticas']
-                                    
-                                    monthly_stats.to_excel(
-                                        writer, 
-                                        sheet_name='Estadísticas', 
-                                        startrow=0, 
-                                        index=False
-                                    )
-                                    
-                                    annual_stats.to_excel(
-                                        writer, 
-                                        sheet_name='Estadísticas', 
-                                        startrow=len(monthly_stats)+3, 
-                                        index=False
-                                    )
-                                
-                                metadata_list = []
-                                for key, value in metadata.items():
-                                    if isinstance(value, dict):
-                                        metadata_list.append({"Clave": key, "Valor": ""})
-                                        for k, v in value.items():
-                                            metadata_list.append({"Clave": f"  {k}", "Valor": v})
-                                    else:
-                                        metadata_list.append({"Clave": key, "Valor": value})
-                                
-                                pd.DataFrame(metadata_list).to_excel(
-                                    writer, 
-                                    sheet_name='Metadatos', 
-                                    index=False
-                                )
+                            reporte = Artefacto_sesion(
+                                'Reporte Excel',
+                                (huellas[estacion_actual], Huella_datos(filtered_df), selected_period),
+                                Generar_reporte_excel, filtered_df, period_df, metadata
+                            )
                             
                             st.download_button(
                                 label="📥 DESCARGAR REPORTE COMPLETO",
-                                data=output.getvalue(),
+                                data=reporte,
                                 file_name=f"reporte_precipitacion_{metadata.get('Estación', 'estacion')}.xlsx",
                                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                             )
@@ -1893,8 +6561,113 @@ def main():
                         except Exception as e:
                             st.error(f"Error al generar el reporte: {str(e)}")
                             st.warning("Por favor verifique que los datos no estén vacíos y tengan el formato correcto.")
+
+                        # Reportes HTML: se generan solo a pedido porque incluyen plotly.js
+                        st.markdown("### Reportes HTML")
+                        clave_html = (huellas[estacion_actual], Huella_datos(filtered_df), selected_period)
+                        if st.button("📄 PREPARAR REPORTE HTML DE LA ESTACIÓN", key='preparar_reporte_html'):
+                            with st.spinner("Generando reporte..."):
+                                Artefacto_sesion(
+                                    'Reporte HTML', clave_html,
+                                    Generar_reporte_html, estacion_actual, metadata, filtered_df, selected_period
+                                )
+                        reporte_html = Artefacto_guardado('Reporte HTML', clave_html)
+                        if reporte_html is not None:
+                            st.download_button(
+                                label="📥 DESCARGAR REPORTE HTML",
+                                data=reporte_html,
+                                file_name=f"reporte_precipitacion_{metadata.get('Estación', 'estacion')}.html",
+                                mime="text/html"
+                            )
+                        
+                        if len(metadatas) > 1:
+                            clave_reportes = (tuple(huellas.items()), selected_period)
+                            if st.button("📦 PREPARAR REPORTES HTML DE TODAS LAS ESTACIONES", key='preparar_reportes_html'):
+                                with st.spinner(f"Generando {len(metadatas)} reportes en paralelo..."):
+                                    # Las estaciones del cubo en disco se leen de sus filas solo al generar los reportes
+                                    todas = {
+                                        nombre: estaciones[nombre] if nombre in estaciones
+                                        else Estacion_cubo(cubo_disco, nombre, años_cubo, huellas[nombre], cache)
+                                        for nombre in metadatas
+                                    }
+                                    Artefacto_sesion(
+                                        'Reportes HTML', clave_reportes,
+                                        Generar_reportes_html, todas, selected_period
+                                    )
+                            reportes_html = Artefacto_guardado('Reportes HTML', clave_reportes)
+                            if reportes_html is not None:
+                                st.download_button(
+                                    label="📥 DESCARGAR REPORTES HTML (ZIP)",
+                                    data=reportes_html,
+                                    file_name="reportes_precipitacion.zip",
+                                    mime="application/zip"
+                                )
+                            st.caption("Los reportes de todas las estaciones usan el registro completo de cada una y el período de agregación elegido")
+
+                    with tab9:
+                        st.markdown("### Análisis Regional de la Cuenca")
+                        # Cubo estaciones × años × 12: las filas del cubo en disco se copian sin pasar por un DataFrame largo
+                        cubo_regional = Artefacto_sesion(
+                            'Cubo regional',
+                            tuple(huellas.items()),
+                            Cubo_regional, estaciones, cubo_disco, seleccion_variable, años_cubo
+                        )
+                        coordenadas = {
+                            nombre: (meta['Coordenadas']['Latitud'], meta['Coordenadas']['Longitud'])
+                            for nombre, meta in metadatas.items()
+                            if isinstance(meta.get('Coordenadas'), dict)
+                        }
+
+                        piramides_regionales = Artefacto_sesion(
+                            'Pirámides regionales',
+                            tuple(huellas.items()),
+                            Piramides_regionales, metadatas, piramides
+                        )
+
+                        Panel_mapa_cuenca(piramides_regionales.get('Estación'), coordenadas, list(metadatas), variable)
+
+                        Panel_piramide(piramides_regionales, variable)
+
+                        duplicados = Artefacto_sesion(
+                            'Duplicados',
+                            tuple(huellas.items()),
+                            Duplicados_estaciones, estaciones
+                        )
+                        Panel_calidad(cubo_regional, variable, duplicados)
+
+                        if acumulable:
+                            Panel_rachas(cubo_regional, variable, 'rachas_cuenca')
+
+                        if len(cubo_regional[0]) < 2:
+                            st.info("Cargue dos o más estaciones para habilitar el análisis regional")
+                        else:
+                            if acumulable:
+                                Panel_doble_masa(cubo_regional, coordenadas, variable)
+
+                            st.markdown("<div class='plot-title'>Puntos de Cambio por Estación</div>", unsafe_allow_html=True)
+                            # Se calcula en segundo plano: el resto de la página sigue disponible
+                            trabajo_cambios = Trabajo_sesion(
+                                ('cambios_cuenca', tuple(huellas.items())),
+                                "Puntos de cambio por estación",
+                                _Modulo_trabajo()._Fila_cambios,
+                                Tareas_cambios_cuenca, cubo_regional, variable
+                            )
+                            Panel_trabajo(trabajo_cambios)
+                            st.caption("Método PELT sobre los totales anuales completos y las anomalías mensuales estandarizadas de cada estación")
+
+                            Panel_correlacion(cubo_regional)
+
+                            Panel_eof(cubo_regional, coordenadas)
+
+                            if acumulable:
+                                Panel_regimenes(cubo_regional, coordenadas)
+
+                    st.session_state.setdefault('tiempos', {})['Ejecución completa'] = time.perf_counter() - inicio_ejecucion
+                    Mostrar_tiempos_barra_lateral()
+                    Mostrar_cache_barra_lateral(cache)
+                    Mostrar_memoria_barra_lateral()
             else:
-                st.warning("El archivo no contiene datos válidos de precipitación")
+                st.warning("Los archivos no contienen datos válidos de precipitación")
         except Exception as e:
             st.error(f"Error al procesar el archivo: {str(e)}")
             st.error(traceback.format_exc())
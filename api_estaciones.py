@@ -0,0 +1,241 @@
+"""Servicio HTTP local con las estadísticas de las estaciones del tablero (ana5.py)
+
+Lee los Excel de una carpeta con el mismo código que usa la aplicación y
+expone los resultados en JSON o, para respuestas voluminosas, como stream
+Arrow IPC.
+
+Uso:
+    python api_estaciones.py CARPETA [--host 127.0.0.1] [--puerto 8765]
+
+Rutas (GET):
+    /estaciones                      Lista de estaciones cargadas
+    /estaciones/<id>/serie           Datos mensuales filtrados
+    /estaciones/<id>/mensual         Calcular_estadisticas_Mensuales
+    /estaciones/<id>/anual           Calcular_estadisticas_anuales
+    /estaciones/<id>/tendencia       Calcular_tendencia_anual
+
+Parámetros (los mismos filtros de la barra lateral):
+    desde, hasta          Rango de años
+    meses                 Números de mes separados por coma (1,2,12)
+    min_meses             Mínimo de meses con datos por año
+    excluir_marcados      1 para excluir valores negativos o implausibles
+    periodo               Período de agregación anual (ver DEFINICIONES_PERIODO)
+    formato               json (predeterminado) o arrow; también vale Accept: application/vnd.apache.arrow.stream
+"""
+
+import os
+import io
+import sys
+import glob
+import json
+import hashlib
+import argparse
+import functools
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import ana5
+
+TIPO_JSON = 'application/json; charset=utf-8'
+TIPO_ARROW = 'application/vnd.apache.arrow.stream'
+RECURSOS = ('serie', 'mensual', 'anual', 'tendencia')
+MESES = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Set', 'Oct', 'Nov', 'Dic']
+PERIODO_CALENDARIO = 'Año calendario (Ene–Dic)'
+
+def Cargar_catalogo(carpeta):
+    """Lee todos los Excel de la carpeta; el identificador de cada estación es el nombre del archivo"""
+    catalogo = {}
+    for ruta in sorted(glob.glob(os.path.join(carpeta, '*.xlsx'))):
+        # Un archivo ilegible no debe impedir que el servicio arranque con los demás
+        try:
+            with open(ruta, 'rb') as archivo:
+                contenido = archivo.read()
+            metadata, data_df = ana5.Cargar_estacion(contenido)
+        except Exception as e:
+            print(f"No se pudo leer {ruta}: {type(e).__name__}: {e}", file=sys.stderr)
+            continue
+        if data_df.empty:
+            print(f"Sin datos válidos: {ruta}", file=sys.stderr)
+            continue
+        catalogo[os.path.splitext(os.path.basename(ruta))[0]] = {
+            'metadata': metadata,
+            'datos': data_df,
+            'huella': hashlib.sha1(contenido).hexdigest()
+        }
+    return catalogo
+
+def Leer_filtros(consulta):
+    """Filtros normalizados (hashables) a partir de la cadena de consulta"""
+    def valor(nombre, defecto=None):
+        return consulta.get(nombre, [defecto])[0]
+
+    try:
+        desde = int(valor('desde', -9999))
+        hasta = int(valor('hasta', 9999))
+        meses = tuple(sorted({int(m) for m in valor('meses', '').split(',') if m.strip()})) or tuple(range(1, 13))
+        min_meses = int(valor('min_meses', 0))
+    except ValueError:
+        raise ValueError("desde, hasta, meses y min_meses deben ser enteros")
+
+    if not all(1 <= m <= 12 for m in meses):
+        raise ValueError("Los meses deben estar entre 1 y 12")
+
+    periodo = valor('periodo', PERIODO_CALENDARIO)
+    if periodo not in ana5.DEFINICIONES_PERIODO:
+        raise ValueError(f"Período desconocido; opciones: {', '.join(ana5.DEFINICIONES_PERIODO)}")
+
+    excluir = str(valor('excluir_marcados', '0')).lower() in ('1', 'true', 'si', 'sí')
+    return (desde, hasta), meses, min_meses, excluir, periodo
+
+def Calcular_recurso(estacion, recurso, filtros):
+    """Mismo flujo que main(): filtros de la barra lateral, período de agregación y estadísticas"""
+    year_range, meses, min_meses, excluir, periodo = filtros
+    filtered_df = ana5.Filtrar_datos(estacion['datos'], year_range, [MESES[m - 1] for m in meses], min_meses, excluir)
+    period_df = ana5.Aplicar_periodo(filtered_df, periodo)
+
+    if recurso == 'serie':
+        return filtered_df
+    if recurso == 'mensual':
+        return ana5.Calcular_estadisticas_Mensuales(filtered_df)
+    if recurso == 'anual':
+        return ana5.Calcular_estadisticas_anuales(period_df)
+
+    tendencia = ana5.Calcular_tendencia_anual(period_df) or {}
+    return {clave: valor for clave, valor in tendencia.items() if clave not in ('x', 'y')}
+
+def A_json(resultado):
+    """Serializa un DataFrame (lista de registros) o un diccionario, con NaN como null"""
+    if isinstance(resultado, pd.DataFrame):
+        return ana5.Para_exportar(resultado).to_json(orient='records', date_format='iso', force_ascii=False).encode('utf-8')
+
+    def limpio(valor):
+        if isinstance(valor, (np.integer, np.floating)):
+            valor = valor.item()
+        return None if isinstance(valor, float) and not np.isfinite(valor) else valor
+
+    return json.dumps({clave: limpio(valor) for clave, valor in resultado.items()}, ensure_ascii=False).encode('utf-8')
+
+def A_arrow(resultado, filas_por_lote=65536):
+    """Serializa un DataFrame como stream Arrow IPC en lotes"""
+    if not isinstance(resultado, pd.DataFrame):
+        resultado = pd.DataFrame([resultado])
+    tabla = pa.Table.from_pandas(resultado, preserve_index=False)
+    salida = io.BytesIO()
+    with pa.ipc.new_stream(salida, tabla.schema) as escritor:
+        for lote in tabla.to_batches(max_chunksize=filas_por_lote):
+            escritor.write_batch(lote)
+    return salida.getvalue()
+
+def Etiqueta(huella, recurso, filtros, formato):
+    """ETag de una respuesta: depende solo del contenido del archivo y de la consulta normalizada"""
+    return '"' + hashlib.sha1(repr((huella, recurso, filtros, formato)).encode('utf-8')).hexdigest() + '"'
+
+class Manejador(BaseHTTPRequestHandler):
+    """Atiende las rutas GET; ThreadingHTTPServer usa un hilo por solicitud"""
+
+    catalogo = {}
+    server_version = 'CuencasAPI/1.0'
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _respuesta(ident, recurso, filtros, formato):
+        """Cuerpo ya serializado; las solicitudes repetidas no recalculan nada"""
+        resultado = Calcular_recurso(Manejador.catalogo[ident], recurso, filtros)
+        return A_arrow(resultado) if formato == 'arrow' else A_json(resultado)
+
+    def do_GET(self):
+        partes = urlsplit(self.path)
+        ruta = [p for p in partes.path.split('/') if p]
+        consulta = parse_qs(partes.query)
+
+        try:
+            if ruta == ['estaciones']:
+                self._listar()
+            elif len(ruta) == 3 and ruta[0] == 'estaciones' and ruta[2] in RECURSOS:
+                if ruta[1] not in self.catalogo:
+                    self._error(404, f"Estación no encontrada: {ruta[1]}")
+                    return
+                self._recurso(ruta[1], ruta[2], consulta)
+            else:
+                self._error(404, "Ruta no encontrada")
+        except ValueError as e:
+            self._error(400, str(e))
+        except Exception as e:
+            self._error(500, f"Error al procesar la solicitud: {e}")
+
+    def _formato(self, consulta):
+        formato = consulta.get('formato', [''])[0].lower()
+        if formato in ('json', 'arrow'):
+            return formato
+        return 'arrow' if TIPO_ARROW in self.headers.get('Accept', '') else 'json'
+
+    def _listar(self):
+        filas = [
+            {
+                'id': ident,
+                'Estación': estacion['metadata'].get('Estación'),
+                'Coordenadas': estacion['metadata'].get('Coordenadas'),
+                'Año inicial': int(estacion['datos']['Año'].min()),
+                'Año final': int(estacion['datos']['Año'].max()),
+                'Registros': len(estacion['datos']),
+                'huella': estacion['huella']
+            }
+            for ident, estacion in self.catalogo.items()
+        ]
+        etag = Etiqueta(tuple(f['huella'] for f in filas), 'estaciones', None, 'json')
+        self._enviar(200, json.dumps(filas, ensure_ascii=False, default=str).encode('utf-8'), TIPO_JSON, etag)
+
+    def _recurso(self, ident, recurso, consulta):
+        filtros = Leer_filtros(consulta)
+        formato = self._formato(consulta)
+        etag = Etiqueta(self.catalogo[ident]['huella'], recurso, filtros, formato)
+
+        # El cliente ya tiene esta versión: no se calcula ni se envía el cuerpo
+        if etag in self.headers.get('If-None-Match', ''):
+            self._enviar(304, b'', None, etag)
+            return
+
+        cuerpo = self._respuesta(ident, recurso, filtros, formato)
+        self._enviar(200, cuerpo, TIPO_ARROW if formato == 'arrow' else TIPO_JSON, etag)
+
+    def _error(self, estado, mensaje):
+        self._enviar(estado, json.dumps({'error': mensaje}, ensure_ascii=False).encode('utf-8'), TIPO_JSON)
+
+    def _enviar(self, estado, cuerpo, tipo, etag=None):
+        self.send_response(estado)
+        if tipo:
+            self.send_header('Content-Type', tipo)
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        if cuerpo:
+            self.wfile.write(cuerpo)
+
+def main():
+    parser = argparse.ArgumentParser(description="API local de estadísticas de estaciones pluviométricas")
+    parser.add_argument('carpeta', help="Carpeta con los archivos Excel de las estaciones (formato ANA)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8765)
+    args = parser.parse_args()
+
+    Manejador.catalogo = Cargar_catalogo(args.carpeta)
+    if not Manejador.catalogo:
+        sys.exit(f"No se encontraron estaciones válidas en {args.carpeta}")
+
+    servidor = ThreadingHTTPServer((args.host, args.puerto), Manejador)
+    print(f"{len(Manejador.catalogo)} estaciones disponibles en http://{args.host}:{args.puerto}/estaciones")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Construye el cubo en disco de la red de estaciones para el tablero (ana5.py)
+
+Lee los Excel de una carpeta de uno en uno y copia cada estación a su fila
+de un cubo estaciones × años × 12 (float32, NaN en faltantes) guardado como
+.npy, con un índice JSON de metadatos al lado. La aplicación lo abre con
+memoria mapeada si la variable de entorno CUENCAS_CUBO apunta a la carpeta.
+
+Uso:
+    python cubo_nacional.py CARPETA DESTINO [--desde 1900] [--hasta AÑO]
+"""
+
+import os
+import sys
+import glob
+import hashlib
+import argparse
+import datetime
+
+import ana5
+
+def main():
+    parser = argparse.ArgumentParser(description="Cubo en disco de la red de estaciones pluviométricas")
+    parser.add_argument('carpeta', help="Carpeta con los archivos Excel de las estaciones (formato ANA)")
+    parser.add_argument('destino', help="Carpeta donde se escriben cubo.npy e indice.json")
+    parser.add_argument('--desde', type=int, default=1900, help="Primer año del cubo")
+    parser.add_argument('--hasta', type=int, default=datetime.date.today().year, help="Último año del cubo")
+    args = parser.parse_args()
+
+    rutas = sorted(glob.glob(os.path.join(args.carpeta, '*.xlsx')))
+    if not rutas:
+        sys.exit(f"No se encontraron archivos Excel en {args.carpeta}")
+
+    escritor = ana5.Escritor_cubo(args.destino, len(rutas), args.desde, args.hasta)
+    nombres = set()
+    errores = {}
+    for ruta in rutas:
+        # Un libro ilegible se salta: el cubo y su índice se escriben con los demás
+        try:
+            with open(ruta, 'rb') as archivo:
+                contenido = archivo.read()
+            metadata, data_df = ana5.Cargar_estacion(contenido)
+        except Exception as e:
+            errores[ruta] = f"{type(e).__name__}: {e}"
+            continue
+        if data_df.empty:
+            print(f"Sin datos válidos: {ruta}", file=sys.stderr)
+            continue
+
+        nombre = metadata.get('Estación') or os.path.basename(ruta)
+        if nombre in nombres:
+            nombre = f"{nombre} ({os.path.basename(ruta)})"
+        nombres.add(nombre)
+        escritor.agregar(nombre, metadata, data_df, hashlib.sha1(contenido).hexdigest())
+
+    escritor.cerrar()
+    print(f"{len(escritor.estaciones)} estaciones, {escritor.n_años} años en {args.destino}; {len(errores)} archivos con errores")
+    if escritor.descartados:
+        print(f"{escritor.descartados} valores fuera de {args.desde}–{args.hasta} no se incluyeron", file=sys.stderr)
+    for ruta, error in list(errores.items())[:20]:
+        print(f"  {ruta}: {error}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Ingesta masiva de archivos Excel ANA a un almacén columnar (Parquet)
+
+Procesa miles de archivos como un flujo de generadores: lectura en un grupo
+de procesos -> extracción -> validación -> escritura por lotes. En memoria solo
+hay un lote de estaciones y los archivos en vuelo; si la escritura se atrasa,
+no se envían archivos nuevos a los procesos (contrapresión). Tras cada lote se
+guarda un punto de control, de modo que una ejecución interrumpida continúa
+donde quedó.
+
+Uso:
+    python ingesta_masiva.py CARPETA DESTINO [--procesos N] [--lote 200] [--en-vuelo N]
+                             [--reintentar] [--cubo CARPETA_CUBO] [--desde 1900] [--hasta AÑO]
+
+Estructura del destino:
+    datos/lote-00000.parquet         Registros mensuales (Archivo, Estación, Variable, Año, Mes_num, Valor);
+                                     la unidad de Valor es la de la variable en ana5.VARIABLES
+    estaciones/lote-00000.parquet    Metadatos de cada estación, en el formato del índice del cubo
+    progreso.json                    Punto de control: archivos procesados, errores y siguiente lote
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import ana5
+
+ARCHIVO_PROGRESO = 'progreso.json'
+AÑO_MINIMO = 1850
+COLUMNAS_DATOS = ['Año', 'Mes_num', 'Valor']
+
+def Listar_archivos(carpeta, procesados):
+    """Rutas relativas de los Excel de la carpeta (y subcarpetas) que aún no se procesaron"""
+    for ruta in sorted(glob.iglob(os.path.join(carpeta, '**', '*.xlsx'), recursive=True)):
+        relativa = os.path.relpath(ruta, carpeta)
+        if relativa not in procesados:
+            yield relativa
+
+def Procesar_archivo(carpeta, relativa):
+    """Lee y extrae una estación (se ejecuta en un proceso de trabajo)"""
+    try:
+        with open(os.path.join(carpeta, relativa), 'rb') as archivo:
+            contenido = archivo.read()
+        metadata, data_df = ana5.Cargar_estacion(contenido)
+        return {
+            'archivo': relativa,
+            'huella': hashlib.sha1(contenido).hexdigest(),
+            'metadata': metadata,
+            'datos': data_df,
+            'error': None
+        }
+    except Exception as e:
+        return {'archivo': relativa, 'huella': None, 'metadata': {}, 'datos': pd.DataFrame(), 'error': f"{type(e).__name__}: {e}"}
+
+def Leer_en_paralelo(carpeta, rutas, procesos, en_vuelo):
+    """Resultados de Procesar_archivo a medida que terminan, con a lo sumo en_vuelo archivos pendientes
+
+    Solo se envía un archivo nuevo cuando el consumidor pide el siguiente
+    resultado: si la escritura se atrasa, la lectura se detiene.
+    """
+    rutas = iter(rutas)
+    agotado = False
+    pendientes = set()
+    with ProcessPoolExecutor(max_workers=procesos) as executor:
+        while True:
+            while not agotado and len(pendientes) < en_vuelo:
+                ruta = next(rutas, None)
+                if ruta is None:
+                    agotado = True
+                else:
+                    pendientes.add(executor.submit(Procesar_archivo, carpeta, ruta))
+            if not pendientes:
+                return
+            listos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                yield futuro.result()
+
+def Validar(resultados, año_final):
+    """Descarta registros imposibles (años fuera de rango, valores no finitos, meses repetidos)
+
+    Los archivos sin datos válidos siguen en el flujo marcados con su error,
+    para que el punto de control los registre y no se relean al continuar.
+    """
+    for resultado in resultados:
+        datos = resultado['datos']
+        if resultado['error'] is None and not datos.empty:
+            valido = datos['Año'].between(AÑO_MINIMO, año_final) & np.isfinite(datos[ana5.Columna_valor(datos)])
+            datos = datos[valido].drop_duplicates(['Año', 'Mes_num'])
+            resultado['datos'] = datos
+        if resultado['error'] is None and datos.empty:
+            resultado['error'] = 'Sin datos válidos'
+        yield resultado
+
+def Lotes(resultados, tamaño):
+    """Agrupa el flujo en lotes de hasta tamaño estaciones válidas"""
+    lote = []
+    validas = 0
+    for resultado in resultados:
+        lote.append(resultado)
+        validas += resultado['error'] is None
+        if validas >= tamaño:
+            yield lote
+            lote, validas = [], 0
+    if lote:
+        yield lote
+
+def Nombre_estacion(resultado):
+    """Nombre de la estación en los metadatos o, si falta, el del archivo"""
+    return resultado['metadata'].get('Estación') or os.path.basename(resultado['archivo'])
+
+def _Escribir_parquet(df, ruta):
+    """Escribe un DataFrame como Parquet de forma atómica (archivo temporal y renombrado)"""
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), ruta + '.tmp', compression='zstd')
+    os.replace(ruta + '.tmp', ruta)
+
+def Escribir_lote(destino, numero, lote, primera_fila):
+    """Escribe los datos y metadatos de las estaciones válidas del lote; devuelve cuántas escribió"""
+    validos = [r for r in lote if r['error'] is None]
+    if not validos:
+        return 0
+
+    nombre = f'lote-{numero:05d}.parquet'
+    # Formato largo: estaciones de distintas variables comparten el mismo esquema
+    datos = pd.concat([
+        r['datos'].rename(columns={ana5.Columna_valor(r['datos']): 'Valor'})[COLUMNAS_DATOS].assign(
+            Archivo=r['archivo'], Estación=Nombre_estacion(r), Variable=ana5.Variable_datos(r['datos'])
+        )
+        for r in validos
+    ], ignore_index=True)
+    datos = datos.astype({'Archivo': 'category', 'Estación': 'category', 'Variable': 'category'})
+    _Escribir_parquet(datos[['Archivo', 'Estación', 'Variable'] + COLUMNAS_DATOS], os.path.join(destino, 'datos', nombre))
+
+    estaciones = pd.DataFrame([
+        {**ana5.Fila_indice(primera_fila + i, Nombre_estacion(r), r['metadata'], r['datos'], r['huella']), 'Archivo': r['archivo']}
+        for i, r in enumerate(validos)
+    ])
+    _Escribir_parquet(estaciones.fillna({'Altitud': ''}).astype({'Altitud': str}), os.path.join(destino, 'estaciones', nombre))
+    return len(validos)
+
+def Leer_progreso(destino):
+    """Punto de control de una ejecución anterior (o uno vacío)"""
+    ruta = os.path.join(destino, ARCHIVO_PROGRESO)
+    if not os.path.exists(ruta):
+        return {'procesados': {}, 'errores': {}, 'siguiente_lote': 0, 'estaciones': 0}
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+def Guardar_progreso(destino, progreso):
+    """Guarda el punto de control de forma atómica"""
+    ruta = os.path.join(destino, ARCHIVO_PROGRESO)
+    with open(ruta + '.tmp', 'w', encoding='utf-8') as archivo:
+        json.dump(progreso, archivo, ensure_ascii=False)
+    os.replace(ruta + '.tmp', ruta)
+
+def Limpiar_lotes_huerfanos(destino, siguiente_lote):
+    """Borra los lotes escritos después del último punto de control (se volverán a generar)"""
+    for carpeta in ('datos', 'estaciones'):
+        for ruta in glob.glob(os.path.join(destino, carpeta, 'lote-*.parquet*')):
+            numero = re.match(r'lote-(\d+)', os.path.basename(ruta))
+            if ruta.endswith('.tmp') or (numero and int(numero.group(1)) >= siguiente_lote):
+                os.remove(ruta)
+
+def Ingerir(carpeta, destino, procesos=None, tamaño_lote=200, en_vuelo=None, reintentar=False, año_final=None):
+    """Ejecuta (o continúa) la ingesta de la carpeta en el almacén destino; devuelve el punto de control final"""
+    for subcarpeta in ('datos', 'estaciones'):
+        os.makedirs(os.path.join(destino, subcarpeta), exist_ok=True)
+
+    progreso = Leer_progreso(destino)
+    if reintentar:
+        for archivo in progreso['errores']:
+            progreso['procesados'].pop(archivo, None)
+        progreso['errores'] = {}
+    Limpiar_lotes_huerfanos(destino, progreso['siguiente_lote'])
+
+    procesos = procesos or max(1, (os.cpu_count() or 2) - 1)
+    rutas = Listar_archivos(carpeta, progreso['procesados'])
+    flujo = Validar(
+        Leer_en_paralelo(carpeta, rutas, procesos, en_vuelo or 2 * procesos),
+        año_final or datetime.date.today().year
+    )
+
+    inicio = time.perf_counter()
+    for lote in Lotes(flujo, tamaño_lote):
+        escritas = Escribir_lote(destino, progreso['siguiente_lote'], lote, progreso['estaciones'])
+        for resultado in lote:
+            progreso['procesados'][resultado['archivo']] = resultado['huella']
+            if resultado['error'] is not None:
+                progreso['errores'][resultado['archivo']] = resultado['error']
+        progreso['siguiente_lote'] += 1
+        progreso['estaciones'] += escritas
+        Guardar_progreso(destino, progreso)
+        print(
+            f"Lote {progreso['siguiente_lote'] - 1}: {escritas} estaciones, {len(lote) - escritas} rechazadas "
+            f"({progreso['estaciones']} en total, {time.perf_counter() - inicio:.0f} s)"
+        )
+    return progreso
+
+def Construir_cubo(destino, carpeta_cubo, año_inicial, año_final):
+    """Escribe el cubo en disco de la aplicación (CUENCAS_CUBO) leyendo el almacén lote por lote"""
+    estaciones = pq.read_table(os.path.join(destino, 'estaciones')).to_pandas().sort_values('Fila')
+    escritor = ana5.Escritor_cubo(carpeta_cubo, len(estaciones), año_inicial, año_final)
+    por_archivo = estaciones.set_index('Archivo')
+
+    nombres = set()
+    for ruta in sorted(glob.glob(os.path.join(destino, 'datos', 'lote-*.parquet'))):
+        datos = pq.read_table(ruta).to_pandas()
+        for archivo, grupo in datos.groupby('Archivo', sort=False, observed=True):
+            fila = por_archivo.loc[archivo]
+            nombre = fila['Estación']
+            if nombre in nombres:
+                nombre = f"{nombre} ({archivo})"
+            nombres.add(nombre)
+            columna = ana5.VARIABLES[grupo['Variable'].iloc[0]]['columna']
+            escritor.agregar(nombre, ana5.Metadata_desde_indice(fila), grupo.rename(columns={'Valor': columna}), fila['Huella'])
+        del datos
+    escritor.cerrar()
+    return len(escritor.estaciones)
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta masiva de estaciones pluviométricas a Parquet")
+    parser.add_argument('carpeta', help="Carpeta con los archivos Excel de las estaciones (formato ANA)")
+    parser.add_argument('destino', help="Carpeta del almacén Parquet y del punto de control")
+    parser.add_argument('--procesos', type=int, default=None, help="Procesos de lectura (predeterminado: núcleos - 1)")
+    parser.add_argument('--lote', type=int, default=200, help="Estaciones por archivo Parquet")
+    parser.add_argument('--en-vuelo', type=int, default=None, help="Máximo de archivos leyéndose a la vez (predeterminado: 2 × procesos)")
+    parser.add_argument('--reintentar', action='store_true', help="Vuelve a leer los archivos que fallaron en ejecuciones anteriores")
+    parser.add_argument('--cubo', default=None, help="Además, escribe el cubo en disco de la aplicación en esta carpeta")
+    parser.add_argument('--desde', type=int, default=1900, help="Primer año del cubo")
+    parser.add_argument('--hasta', type=int, default=datetime.date.today().year, help="Último año aceptado")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.carpeta):
+        sys.exit(f"No existe la carpeta {args.carpeta}")
+
+    progreso = Ingerir(args.carpeta, args.destino, args.procesos, args.lote, args.en_vuelo, args.reintentar, args.hasta)
+    print(f"{progreso['estaciones']} estaciones en {args.destino}; {len(progreso['errores'])} archivos con errores")
+    for archivo, error in list(progreso['errores'].items())[:20]:
+        print(f"  {archivo}: {error}", file=sys.stderr)
+
+    if args.cubo and progreso['estaciones']:
+        n = Construir_cubo(args.destino, args.cubo, args.desde, args.hasta)
+        print(f"Cubo con {n} estaciones en {args.cubo}")
+
+if __name__ == "__main__":
+    main()